@@ -1,8 +1,28 @@
 import sys
+import threading
+
 from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QProgressBar, \
     QPushButton
 from PyQt6.QtCore import Qt, QTimer, QSize
-from PyQt6.QtGui import QFont, QPixmap, QIcon
+from PyQt6.QtGui import QFont
+
+import assets
+from definitions import DefinitionUpdater, definitions_counter
+from engines import ENGINE_HOSTS
+from installers import InstallerDistributor, install_counter
+from progress_pump import shared_pump
+from telemetry import card_lines, shared_poller
+from verdict_cache import VerdictCache
+
+# How often the cards are refreshed from the latest telemetry, in milliseconds
+TELEMETRY_REFRESH_INTERVAL = 1000
+
+# Card icons, in ENGINE_HOSTS order
+AV_ICONS = [
+    "../assets/AV/windows_defender.png",
+    "../assets/AV/Trend_Micro_Maximum_Security.png",
+    "../assets/AV/eset.png",
+]
 
 
 class AVWindow(QMainWindow):
@@ -10,8 +30,13 @@ class AVWindow(QMainWindow):
         super().__init__()
         self.parent = parent
 
-        # Store progress bars in a list so they can be updated later
+        # Store progress bars; the byte counters of the running install or definition update feed them
         self.progress_bars = []
+        self.job = None
+        self.job_counter = install_counter
+        self.job_thread = None
+        # Engine name -> the card's labels showing its VM's live figures
+        self.telemetry_labels = {}
 
         # Window settings
         self.setWindowTitle("Anti-Virus Page")
@@ -24,7 +49,7 @@ class AVWindow(QMainWindow):
         main_layout = QVBoxLayout(main_widget)
 
         back_button = QPushButton()
-        back_button.setIcon(QIcon("../assets/main_menu/back.png"))  # Set the back arrow image path here
+        back_button.setIcon(assets.icon("../assets/main_menu/back.png"))  # Set the back arrow image path here
         back_button.setIconSize(QSize(40, 40))  # Corrected: Use QSize from PyQt6.QtCore
         back_button.setStyleSheet("background-color: transparent; border: none;")  # Remove background and borders
         back_button.clicked.connect(self.go_back)  # Connect the button to the back function
@@ -32,8 +57,7 @@ class AVWindow(QMainWindow):
 
         # Icon above the header
         icon_label = QLabel()
-        icon_pixmap = QPixmap("../assets/main_menu/AV.png").scaled(50, 50,
-                                                                   Qt.AspectRatioMode.KeepAspectRatio)  # Adjust the icon size if needed
+        icon_pixmap = assets.pixmap("../assets/main_menu/AV.png", 50, 50)  # Adjust the icon size if needed
         icon_label.setPixmap(icon_pixmap)
         icon_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         main_layout.addWidget(icon_label)  # Add icon to the main layout
@@ -52,23 +76,28 @@ class AVWindow(QMainWindow):
         av_layout = QHBoxLayout()
 
         # Add anti-virus cards (wrapped in QWidget)
-        av_layout.addWidget(self.wrap_in_widget(
-            self.create_av_card("Microsoft Defender", "Windows 11", "8 GB", "4 GB", "4", "0.37.208.72",
-                                "../assets/AV/windows_defender.png")))
-        av_layout.addWidget(self.wrap_in_widget(
-            self.create_av_card("Trend Micro Security", "Windows 11", "8 GB", "4 GB", "4", "124.208.27.73",
-                                "../assets/AV/Trend_Micro_Maximum_Security.png")))
-        av_layout.addWidget(self.wrap_in_widget(
-            self.create_av_card("Eset Internet Security", "Windows 11", "8 GB", "4 GB", "4", "1.137.244.126",
-                                "../assets/AV/eset.png")))
+        for (name, ip_address, _), icon_path in zip(ENGINE_HOSTS, AV_ICONS):
+            av_layout.addWidget(self.wrap_in_widget(
+                self.create_av_card(name, "Windows 11", "8 GB", "4 GB", "4", ip_address, icon_path)))
 
         main_layout.addLayout(av_layout)
 
-        # Add Install button at the bottom of the layout
+        # Add Install and Update Definitions buttons at the bottom of the layout
+        buttons_layout = QHBoxLayout()
         install_button = QPushButton("Install")
         install_button.setStyleSheet("background-color: #1565C0; color: white; font-size: 14px; padding: 10px;")
         install_button.clicked.connect(self.start_installation)
-        main_layout.addWidget(install_button, alignment=Qt.AlignmentFlag.AlignCenter)
+        buttons_layout.addWidget(install_button)
+        update_button = QPushButton("Update Definitions")
+        update_button.setStyleSheet("background-color: #1565C0; color: white; font-size: 14px; padding: 10px;")
+        update_button.clicked.connect(self.start_definition_update)
+        buttons_layout.addWidget(update_button)
+        main_layout.addLayout(buttons_layout)
+        buttons_layout.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        # Live RAM, CPU, disk and queue figures from each engine VM's agent, refreshed while the page is shown
+        self.telemetry_timer = QTimer(self)
+        self.telemetry_timer.timeout.connect(self.update_telemetry)
 
     def wrap_in_widget(self, layout):
         """Wraps a layout in a QWidget so it can be added to another layout."""
@@ -89,7 +118,7 @@ class AVWindow(QMainWindow):
 
         # Icon inside black box - reduce icon size
         icon_label = QLabel()
-        icon_pixmap = QPixmap(icon_path).scaled(60, 60, Qt.AspectRatioMode.KeepAspectRatio)  # Smaller icon size
+        icon_pixmap = assets.pixmap(icon_path, 60, 60)  # Smaller icon size
         icon_label.setPixmap(icon_pixmap)
         icon_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         icon_layout.addWidget(icon_label)
@@ -106,9 +135,16 @@ class AVWindow(QMainWindow):
         info_layout = QVBoxLayout()
         info_layout.addWidget(self.create_info_label(f"OS: {os_name}"))
         info_layout.addWidget(self.create_info_label(f"Size: {os_size}"))
-        info_layout.addWidget(self.create_info_label(f"RAM: {os_ram}"))
-        info_layout.addWidget(self.create_info_label(f"P-cores: {p_cores}"))
-        info_layout.addWidget(self.create_info_label(f"IP: {ip_address}"))  # Placeholder for IP info
+        # Until the agent answers these show the configured figures
+        labels = self.telemetry_labels[name] = {
+            "ram": self.create_info_label(f"RAM: {os_ram}"),
+            "cores": self.create_info_label(f"P-cores: {p_cores}"),
+            "load": self.create_info_label("CPU: ..."),
+            "disk": self.create_info_label("Disk I/O: ..."),
+        }
+        for label in labels.values():
+            info_layout.addWidget(label)
+        info_layout.addWidget(self.create_info_label(f"IP: {ip_address}"))
         card_layout.addLayout(info_layout)
 
         # Progress Bar - Make smaller in height
@@ -128,8 +164,9 @@ class AVWindow(QMainWindow):
         """)
         card_layout.addWidget(progress_bar)
 
-        # Store the progress bar in the list for later use
+        # Store the progress bar in the list for later use and let the shared pump repaint it
         self.progress_bars.append(progress_bar)
+        shared_pump().bind(progress_bar, lambda: self.install_progress(name))
 
         return card_layout
 
@@ -140,24 +177,65 @@ class AVWindow(QMainWindow):
         label.setStyleSheet("color: white; background-color: #1565C0; padding: 5px;")
         return label
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.update_telemetry()
+        self.telemetry_timer.start(TELEMETRY_REFRESH_INTERVAL)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.telemetry_timer.stop()
+
+    def update_telemetry(self):
+        """Show the latest figures the telemetry poller has for each engine VM; never waits on the network."""
+        snapshot = shared_poller().snapshot()
+        for name, labels in self.telemetry_labels.items():
+            telemetry = snapshot.get(name)
+            if telemetry is None:
+                continue
+            for key, text in card_lines(telemetry).items():
+                labels[key].setText(text)
+
     def go_back(self):
         """Go back to the main application window."""
         self.parent.show()
         self.close()
 
     def start_installation(self):
-        """Start the installation process and update all progress bars."""
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_progress_bars)
-        self.timer.start(100)  # Update every 100 milliseconds
-
-    def update_progress_bars(self):
-        """Update the progress bars by increasing their values."""
-        all_finished = True
-        for progress_bar in self.progress_bars:
-            if progress_bar.value() < 100:
-                progress_bar.setValue(progress_bar.value() + 1)  # Increment by 1
-                all_finished = False
-
-        if all_finished:
-            self.timer.stop()  # Stop updating when all progress bars reach 100
+        """Download each engine's installer once and push it to the engine VMs on a background thread."""
+        if self.job_running():
+            return
+        distributor = InstallerDistributor()
+        self.start_job(distributor, distributor.install, install_counter)
+
+    def start_definition_update(self):
+        """Push each engine's newest definitions to its VMs as deltas on a background thread."""
+        if self.job_running():
+            return
+        updater = DefinitionUpdater(verdict_cache=VerdictCache())
+
+        def run():
+            try:
+                updater.update()
+            finally:
+                updater.verdict_cache.close()
+        self.start_job(updater, run, definitions_counter)
+
+    def job_running(self):
+        return self.job_thread is not None and self.job_thread.is_alive()
+
+    def start_job(self, job, run, counter):
+        """Run an install or definition update in the background; the bars follow counter's byte counts."""
+        self.job, self.job_counter = job, counter
+        self.job_thread = threading.Thread(target=run, name="av-install", daemon=True)
+        self.job_thread.start()
+
+    def install_progress(self, engine_name):
+        """Return (value, maximum, text) for a bar: KiB moved out of KiB to move, or why it failed."""
+        done, total = self.job_counter(engine_name).snapshot()
+        error = self.job.errors.get(engine_name) if self.job is not None else None
+        if error is not None:
+            return done // 1024, max(total // 1024, 1), f"Failed: {error}"
+        if total == 0:
+            return 0, 1, "%p%"
+        return done // 1024, max(total // 1024, 1), f"{done / 1024 ** 2:.1f} / {total / 1024 ** 2:.1f} MB"
@@ -0,0 +1,224 @@
+import gzip
+import io
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+from collections import namedtuple
+
+# Separates an archive's path from the path of a member inside it: "a.zip!/dir/b.exe"
+MEMBER_SEPARATOR = "!/"
+
+# Shown in place of MEMBER_SEPARATOR in the result views
+DISPLAY_SEPARATOR = "  ▸  "
+
+ARCHIVE_SUFFIXES = (".zip", ".jar", ".tar", ".tar.gz", ".tgz", ".gz")
+
+# Zip bomb defences, per top-level archive
+MAX_DEPTH = 3
+MAX_EXPANDED_SIZE = 1024 ** 3
+MAX_RATIO = 100
+# Members are held in memory while the engines scan them, so each one is capped
+MAX_MEMBER_SIZE = 64 * 1024 * 1024
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Reasons a member was not scanned
+DEPTH_LIMIT = "archive-depth"
+SIZE_LIMIT = "archive-size"
+RATIO_LIMIT = "archive-ratio"
+MEMBER_LIMIT = "archive-member-size"
+CORRUPT = "archive-corrupt"
+
+# One member of an archive: data is None when a limit stopped it from being read, and reason says which
+Member = namedtuple("Member", "path data reason")
+
+
+class ArchiveLimits:
+    """Bounds on how far one top-level archive may be expanded; tracks the bytes expanded so far."""
+
+    def __init__(self, max_depth=MAX_DEPTH, max_expanded_size=MAX_EXPANDED_SIZE, max_ratio=MAX_RATIO,
+                 max_member_size=MAX_MEMBER_SIZE):
+        self.max_depth = max_depth
+        self.max_expanded_size = max_expanded_size
+        self.max_ratio = max_ratio
+        self.max_member_size = max_member_size
+        self.expanded = 0
+
+
+class _LimitExceeded(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def is_archive_name(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def is_member_path(path):
+    return MEMBER_SEPARATOR in path
+
+
+def outer_path(path):
+    """Return the file on disk that holds path: the outermost archive for members, else path itself."""
+    return path.split(MEMBER_SEPARATOR, 1)[0]
+
+
+def display_path(path):
+    return path.replace(MEMBER_SEPARATOR, DISPLAY_SEPARATOR)
+
+
+def _archive_kind(head):
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    if head.startswith(b"\x1f\x8b"):
+        return "gzip"
+    if head[257:262] == b"ustar":
+        return "tar"
+    return None
+
+
+def _read_limited(stream, limits, declared_size, compressed_size):
+    """Read one member into memory, enforcing the member, total and ratio limits as bytes arrive."""
+    if declared_size is not None and declared_size > limits.max_member_size:
+        raise _LimitExceeded(MEMBER_LIMIT)
+    if compressed_size and declared_size is not None and declared_size > compressed_size * limits.max_ratio:
+        raise _LimitExceeded(RATIO_LIMIT)
+    data = bytearray()
+    while chunk := stream.read(READ_CHUNK_SIZE):
+        data += chunk
+        limits.expanded += len(chunk)
+        # Declared sizes can lie, so the limits are checked against what was actually inflated
+        if len(data) > limits.max_member_size:
+            raise _LimitExceeded(MEMBER_LIMIT)
+        if limits.expanded > limits.max_expanded_size:
+            raise _LimitExceeded(SIZE_LIMIT)
+        if compressed_size and len(data) > compressed_size * limits.max_ratio:
+            raise _LimitExceeded(RATIO_LIMIT)
+    return bytes(data)
+
+
+def _zip_members(source, prefix, limits):
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            path = prefix + info.filename
+            try:
+                with archive.open(info) as stream:
+                    yield path, _read_limited(stream, limits, info.file_size, info.compress_size), None
+            except _LimitExceeded as error:
+                yield path, None, error.reason
+                if error.reason != MEMBER_LIMIT:
+                    return
+
+
+def _tar_members(source, prefix, limits, archive_size):
+    # Streaming mode reads members in order without seeking, so nothing is buffered twice
+    with tarfile.open(fileobj=source, mode="r|*") as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            path = prefix + info.name
+            stream = archive.extractfile(info)
+            try:
+                if limits.expanded + info.size > archive_size * limits.max_ratio:
+                    raise _LimitExceeded(RATIO_LIMIT)
+                yield path, _read_limited(stream, limits, info.size, None), None
+            except _LimitExceeded as error:
+                yield path, None, error.reason
+                if error.reason != MEMBER_LIMIT:
+                    return
+
+
+def _gzip_members(source, prefix, limits, archive_size, name):
+    # A .tar.gz is a tar stream; anything else gzipped is a single member
+    with gzip.GzipFile(fileobj=source) as stream:
+        head = stream.peek(512)[:512]
+        if head[257:262] == b"ustar":
+            yield from _tar_members(stream, prefix, limits, archive_size)
+            return
+        path = prefix + (name[:-3] if name.lower().endswith(".gz") else name)
+        try:
+            yield path, _read_limited(stream, limits, None, archive_size), None
+        except _LimitExceeded as error:
+            yield path, None, error.reason
+
+
+def iter_members(path, limits=None, source=None, depth=1):
+    """Yield a Member for every file inside the archive at path, recursing into nested archives.
+
+    Members are decompressed straight from the archive into memory; nothing
+    is extracted to disk. Nested archives are opened from the member's bytes
+    up to limits.max_depth levels deep. When a limit is hit the offending
+    member is yielded with data None and its reason, and the rest of that
+    archive is abandoned unless only the single member was too large.
+    """
+    limits = limits or ArchiveLimits()
+    if source is None:
+        try:
+            source = open(path, "rb")
+        except OSError:
+            return
+        with source:
+            yield from iter_members(path, limits, source, depth)
+        return
+
+    source.seek(0, os.SEEK_END)
+    archive_size = source.tell()
+    source.seek(0)
+    kind = _archive_kind(source.read(512))
+    source.seek(0)
+    prefix = path + MEMBER_SEPARATOR
+    name = os.path.basename(path.rsplit(MEMBER_SEPARATOR, 1)[-1])
+    if kind == "zip":
+        members = _zip_members(source, prefix, limits)
+    elif kind == "gzip":
+        members = _gzip_members(source, prefix, limits, archive_size, name)
+    elif kind == "tar":
+        members = _tar_members(source, prefix, limits, archive_size)
+    else:
+        return
+
+    try:
+        for member_path, data, reason in members:
+            yield Member(member_path, data, reason)
+            if data is not None and _archive_kind(data[:512]) is not None:
+                if depth >= limits.max_depth:
+                    yield Member(member_path + MEMBER_SEPARATOR, None, DEPTH_LIMIT)
+                else:
+                    yield from iter_members(member_path, limits, io.BytesIO(data), depth + 1)
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError, ValueError, zlib.error, RuntimeError,
+            NotImplementedError):
+        # RuntimeError: encrypted zip member; NotImplementedError: unsupported compression method
+        yield Member(prefix, None, CORRUPT)
+
+
+class ByteBudget:
+    """Caps the bytes of archive members held in memory while engines scan them.
+
+    acquire() blocks while the budget is spent, except that a single member
+    larger than the whole budget is still let through on its own.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size, cancelled):
+        """Reserve size bytes; returns False without reserving if cancelled is set first."""
+        with self._condition:
+            while self.used and self.used + size > self.limit:
+                if cancelled.is_set():
+                    return False
+                self._condition.wait(0.1)
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
@@ -0,0 +1,27 @@
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QIcon, QPixmap, QPixmapCache
+
+# Room for every scaled asset the windows use, in KiB
+QPixmapCache.setCacheLimit(32 * 1024)
+
+
+def pixmap(path, width=None, height=None):
+    """Return the asset at path, decoded and scaled (keeping aspect ratio) only once per process.
+
+    Only the scaled copy is cached, so large source images such as the Trend
+    Micro logo do not stay decoded at full size.
+    """
+    key = f"{path}@{width}x{height}"
+    cached = QPixmapCache.find(key)
+    if cached is not None:
+        return cached
+    result = QPixmap(path)
+    if width is not None and height is not None and not result.isNull():
+        result = result.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio)
+    QPixmapCache.insert(key, result)
+    return result
+
+
+def icon(path):
+    """Return a QIcon built from the cached asset at path."""
+    return QIcon(pixmap(path))
@@ -0,0 +1,205 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from engines import create_engines
+from report_writer import LatencyHistogram
+from scan_engine import ScanPipeline
+from synthetic_corpus import DEFAULT_PARAMETERS, generate_corpus
+from verdict_cache import VerdictCache
+
+# Benchmark results are compared on these keys; higher is better unless listed in LOWER_IS_BETTER
+COMPARED_KEYS = ["files_per_second", "mb_per_second", "latency_p50_ms", "latency_p99_ms",
+                 "peak_rss_mb", "max_stall_ms", "total_stall_ms"]
+LOWER_IS_BETTER = {"latency_p50_ms", "latency_p99_ms", "peak_rss_mb", "max_stall_ms", "total_stall_ms"}
+
+
+class StallMonitor(threading.Thread):
+    """Stands in for the GUI event loop: wakes every frame and records how late each wake-up was.
+
+    Lateness comes from the scan threads holding the GIL, which is exactly
+    what would freeze the Scan page's event loop.
+    """
+
+    def __init__(self, frame_seconds=1 / 60):
+        super().__init__(name="stall-monitor", daemon=True)
+        self.frame_seconds = frame_seconds
+        self.max_stall = 0.0
+        self.total_stall = 0.0
+        self._stopped = threading.Event()
+
+    def run(self):
+        expected = time.perf_counter() + self.frame_seconds
+        while not self._stopped.wait(max(0.0, expected - time.perf_counter())):
+            stall = time.perf_counter() - expected
+            if stall > 0.001:
+                self.max_stall = max(self.max_stall, stall)
+                self.total_stall += stall
+            expected = time.perf_counter() + self.frame_seconds
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_engine_server(latency):
+    """Start the stand-in engine server in a process of its own; returns (process, port).
+
+    Run in this process, its event loop would compete with the scan for the
+    GIL and its memory would count towards the scan's.
+    """
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine_server.py")
+    process = subprocess.Popen([sys.executable, server_path, "--port", "0", "--latency", str(latency)],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        process.wait()
+        raise RuntimeError(f"stand-in engine server exited with status {process.returncode}")
+    return process, int(line.strip().rpartition(":")[2])
+
+
+def stop_engine_server(process):
+    process.terminate()
+    process.wait()
+    process.stdout.close()
+
+
+def measure_phase(root, port, cache_path, workers):
+    """Run one scan in a fresh process, so peak_rss_mb is that scan's alone, and return its measurements."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_scan, root, port, cache_path, workers).result()
+
+
+def run_scan(root, port, cache_path, workers):
+    """Scan root once against the stand-in engines on port and return the measurements."""
+    cache = VerdictCache(cache_path)
+    engines = create_engines(f"127.0.0.1:{port}")
+    pipeline = ScanPipeline(root, engines, cache=cache, max_workers=workers)
+    latencies = LatencyHistogram()
+    scanned = {"bytes": 0}
+    lock = threading.Lock()
+    first_engine = engines[0].name
+
+    def on_verdict(record):
+        with lock:
+            if not record.cached and not record.prefilter:
+                latencies.add(record.latency)
+            if record.engine == first_engine:
+                scanned["bytes"] += record.size
+
+    monitor = StallMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    pipeline.run(on_verdict=on_verdict)
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    for engine in engines:
+        engine.close()
+    cache.close()
+
+    files_total, _, _ = pipeline.progress()
+    return {
+        "files": files_total,
+        "bytes": scanned["bytes"],
+        "detections": len({path for path, _ in pipeline.detections}),
+        "seconds": elapsed,
+        "files_per_second": files_total / elapsed if elapsed else 0.0,
+        "mb_per_second": scanned["bytes"] / elapsed / 1e6 if elapsed else 0.0,
+        "latency_p50_ms": latencies.percentile(0.50) * 1000,
+        "latency_p99_ms": latencies.percentile(0.99) * 1000,
+        "cache_hit_rate": pipeline.cache_hit_rate(),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "max_stall_ms": monitor.max_stall * 1000,
+        "total_stall_ms": monitor.total_stall * 1000,
+    }
+
+
+def compare(current, previous):
+    """Print the change of every compared key between two result files."""
+    for phase in ("cold", "warm"):
+        if phase not in current or phase not in previous:
+            continue
+        print(f"{phase} scan vs {previous.get('commit', '?')}:")
+        for key in COMPARED_KEYS:
+            old = previous[phase].get(key)
+            new = current[phase].get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change < 0 if key in LOWER_IS_BETTER else change > 0
+            print(f"  {key:18} {old:12.2f} -> {new:12.2f}  {change:+6.1f}% {'better' if better else 'worse'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scan pipeline on a synthetic corpus.")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "av_pipeline_corpus"))
+    parser.add_argument("--latency", type=float, default=0.001, help="stand-in engine latency per file, seconds")
+    parser.add_argument("--workers", type=int, default=None, help="hashing threads")
+    parser.add_argument("--output", default=None, help="where to save the JSON results")
+    parser.add_argument("--compare", default=None, help="earlier JSON results to compare against")
+    for name, default in DEFAULT_PARAMETERS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args(argv)
+
+    parameters = {name: getattr(args, name) for name in DEFAULT_PARAMETERS}
+    started = time.perf_counter()
+    manifest = generate_corpus(args.corpus, **parameters)
+    print(f"Corpus ready in {time.perf_counter() - started:.1f}s: {manifest['files']} files, "
+          f"{manifest['bytes'] / 1e6:.1f} MB")
+
+    server, port = start_engine_server(args.latency)
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # The warm scan reuses the cache file the cold scan filled
+            cache_path = os.path.join(cache_dir, "verdicts.sqlite3")
+            cold = measure_phase(args.corpus, port, cache_path, args.workers)
+            warm = measure_phase(args.corpus, port, cache_path, args.workers)
+    finally:
+        stop_engine_server(server)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "corpus": parameters,
+        "engine_latency": args.latency,
+        "expected_detections": len(manifest["infected"]),
+        "cold": cold,
+        "warm": warm,
+    }
+    for phase in ("cold", "warm"):
+        measured = results[phase]
+        print(f"{phase}: {measured['files_per_second']:.0f} files/s, {measured['mb_per_second']:.1f} MB/s, "
+              f"p50 {measured['latency_p50_ms']:.2f} ms, p99 {measured['latency_p99_ms']:.2f} ms, "
+              f"peak RSS {measured['peak_rss_mb']:.0f} MB, max stall {measured['max_stall_ms']:.1f} ms, "
+              f"{measured['detections']} infected files")
+
+    output = args.output or f"bench-{results['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from archives import is_member_path
+from engines import ENGINE_NAMES, ERROR, INFECTED
+from metrics import metrics
+from progress_bus import ProgressCounter
+from scan_engine import VerdictRecord, walk_files
+
+# Rule name recorded for files whose batch was lost more than max_attempts times
+WORKER_LOST = "worker-lost"
+
+# How often waiting threads look for expired leases, in seconds
+LEASE_CHECK_INTERVAL = 1.0
+
+
+def parse_address(address):
+    """Return (family, socket address) for "unix:/path" or "host:port"."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_record(fields):
+    """True for [batch id, *VerdictRecord fields] as a worker sends them."""
+    if not isinstance(fields, list) or len(fields) not in (len(VerdictRecord._fields), len(VerdictRecord._fields) + 1):
+        return False
+    batch_id, path, engine, verdict, size, latency, cached, *prefilter = fields
+    return (_is_int(batch_id) and isinstance(path, str) and isinstance(engine, str) and isinstance(verdict, str)
+            and _is_int(size) and isinstance(latency, (int, float)) and isinstance(cached, bool)
+            and all(isinstance(rule, str) for rule in prefilter))
+
+
+def check_worker_message(message):
+    """Raise ValueError unless message is one of the worker messages ScanCoordinator understands."""
+    op = message.get("op") if isinstance(message, dict) else None
+    if op == "hello" and isinstance(message.get("worker", "?"), str):
+        return
+    if op == "lease":
+        return
+    if op == "ack" and _is_int(message.get("id")):
+        return
+    if op == "renew" and isinstance(message.get("ids"), list) and all(map(_is_int, message["ids"])):
+        return
+    if op == "results" and isinstance(message.get("records"), list) and all(map(_is_record, message["records"])):
+        return
+    raise ValueError(f"malformed worker message: {str(message)[:80]}")
+
+
+def send_message(connection, lock, message):
+    data = (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+    with lock:
+        connection.sendall(data)
+
+
+class _Batch:
+    """A leased unit of work: the files, who holds it, until when, and what has come back so far."""
+    __slots__ = ("batch_id", "paths", "attempts", "worker", "deadline", "answered")
+
+    def __init__(self, batch_id, paths):
+        self.batch_id = batch_id
+        self.paths = paths
+        self.attempts = 0
+        self.worker = None
+        self.deadline = 0.0
+        # (path, engine) pairs already reported, so a retried batch does not report them twice
+        self.answered = set()
+
+
+class _WorkerConnection:
+    __slots__ = ("name", "sock", "send_lock", "batches")
+
+    def __init__(self, sock):
+        self.name = "?"
+        self.sock = sock
+        self.send_lock = threading.Lock()
+        self.batches = set()
+
+
+class ScanCoordinator:
+    """Walks a folder and leases batches of its files to scan worker processes over a socket.
+
+    Workers (scan_worker.py, on this host or another) connect to address,
+    "unix:/path" or "host:port", and speak JSON lines:
+
+        worker: {"op": "hello", "worker": name}
+        worker: {"op": "lease"}                      -> {"op": "batch", "id", "root", "paths", "lease"}
+                                                        or {"op": "done"} once nothing is left
+        worker: {"op": "results", "records": [...]}  VerdictRecord fields, streamed as verdicts arrive
+        worker: {"op": "ack", "id"}                  every file of the batch is complete
+        worker: {"op": "renew", "ids": [...]}        extend the leases on batches still in progress
+
+    A worker that sends anything else is disconnected, and its batches go
+    straight back to the queue.
+
+    A lease request is answered as soon as a batch is available, so an idle
+    worker waits without polling. A batch whose worker disconnects, or whose
+    lease runs out without a renewal, goes back to the front of the queue;
+    after max_attempts its files are recorded as errors. Results of a batch
+    that is retried are only reported once per file and engine.
+
+    The walker blocks once max_batches batches are queued or leased, so the
+    coordinator's memory stays flat. It exposes the same progress(),
+    detections and cancel() as ScanPipeline, for scan_cli and the Scan page.
+    """
+
+    def __init__(self, root, address, engine_names=ENGINE_NAMES, batch_size=64, lease_seconds=30.0,
+                 max_attempts=3, max_batches=64):
+        self.root = root
+        self.address = address
+        self.engine_names = list(engine_names)
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_batches = max_batches
+
+        self.engine_progress = [ProgressCounter() for _ in self.engine_names]
+        self.walk_finished = False
+        self.detections = []
+        self.verdicts = 0
+        self.cache_hits = 0
+        self.consensus_saved = 0
+        self.batches_retried = 0
+        self.workers_seen = 0
+
+        self._condition = threading.Condition()
+        self._cancelled = threading.Event()
+        self._batch_ids = itertools.count(1)
+        self._queued = deque()
+        self._leased = {}
+        self._waiting = deque()
+        self._connections = set()
+        self._listener = None
+        self._on_detection = None
+        self._on_verdict = None
+
+    def listen(self):
+        """Bind the broker socket; run() does this if it has not been done yet."""
+        if self._listener is not None:
+            return
+        family, bind_address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)  # Left behind by an earlier coordinator
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(bind_address)
+        self._listener.listen()
+        if family == socket.AF_INET:
+            self.address = "%s:%d" % self._listener.getsockname()[:2]
+        threading.Thread(target=self._accept, name="broker-accept", daemon=True).start()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def progress(self):
+        """Return (files_total, files_done per engine, walk_finished)."""
+        snapshots = [counter.snapshot() for counter in self.engine_progress]
+        files_total = snapshots[0][1] if snapshots else 0
+        return files_total, [done for done, _ in snapshots], self.walk_finished
+
+    def cache_hit_rate(self):
+        with self._condition:
+            return self.cache_hits / self.verdicts if self.verdicts else 0.0
+
+    def run(self, on_detection=None, on_verdict=None):
+        """Scan the whole tree with whichever workers connect, returning the detections."""
+        self._on_detection = on_detection
+        self._on_verdict = on_verdict
+        self.listen()
+        try:
+            batch = []
+            for entry in walk_files(self.root):
+                if self._cancelled.is_set():
+                    break
+                for counter in self.engine_progress:
+                    counter.add(total=1)
+                metrics.inc("av_files_walked_total")
+                batch.append(entry.path)
+                if len(batch) >= self.batch_size:
+                    self._enqueue(batch)
+                    batch = []
+            if batch and not self._cancelled.is_set():
+                self._enqueue(batch)
+            with self._condition:
+                self.walk_finished = True
+                self._assign()
+                while (self._queued or self._leased) and not self._cancelled.is_set():
+                    self._condition.wait(LEASE_CHECK_INTERVAL)
+                    self._expire_leases()
+                self._queued.clear()
+                self._leased.clear()
+                self._assign()  # Tell waiting workers there is nothing left
+        finally:
+            self._close()
+        return self.detections
+
+    def _enqueue(self, paths):
+        with self._condition:
+            while len(self._queued) + len(self._leased) >= self.max_batches and not self._cancelled.is_set():
+                self._condition.wait(LEASE_CHECK_INTERVAL)
+                self._expire_leases()
+            self._queued.append(_Batch(next(self._batch_ids), paths))
+            self._assign()
+
+    def _assign(self):
+        """Hand queued batches to waiting workers; called with the condition held."""
+        while self._waiting and self._queued:
+            worker = self._waiting.popleft()
+            if worker not in self._connections:
+                continue
+            batch = self._queued.popleft()
+            batch.attempts += 1
+            batch.worker = worker
+            batch.deadline = time.monotonic() + self.lease_seconds
+            self._leased[batch.batch_id] = batch
+            worker.batches.add(batch.batch_id)
+            self._send(worker, {"op": "batch", "id": batch.batch_id, "root": self.root, "paths": batch.paths,
+                                "lease": self.lease_seconds})
+        if self.walk_finished and not self._queued and not self._leased:
+            while self._waiting:
+                self._send(self._waiting.popleft(), {"op": "done"})
+
+    def _send(self, worker, message):
+        try:
+            send_message(worker.sock, worker.send_lock, message)
+        except OSError:
+            worker.sock.close()  # Its reader thread notices and requeues its batches
+
+    def _expire_leases(self):
+        """Requeue batches whose lease ran out; called with the condition held."""
+        now = time.monotonic()
+        for batch in [batch for batch in self._leased.values() if batch.deadline < now]:
+            self._requeue(batch)
+
+    def _requeue(self, batch):
+        del self._leased[batch.batch_id]
+        if batch.worker is not None:
+            batch.worker.batches.discard(batch.batch_id)
+            batch.worker = None
+        if batch.attempts >= self.max_attempts:
+            self._give_up(batch)
+        else:
+            self.batches_retried += 1
+            self._queued.appendleft(batch)
+            self._assign()
+        self._condition.notify_all()
+
+    def _give_up(self, batch):
+        for path in batch.paths:
+            for engine in self.engine_names:
+                if (path, engine) not in batch.answered:
+                    self._report(batch, VerdictRecord(path, engine, ERROR, 0, 0.0, False, WORKER_LOST))
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return  # Listener closed
+            worker = _WorkerConnection(sock)
+            with self._condition:
+                self._connections.add(worker)
+                self.workers_seen += 1
+            threading.Thread(target=self._serve, args=(worker,), name="broker-worker", daemon=True).start()
+
+    def _serve(self, worker):
+        try:
+            with worker.sock.makefile("rb") as lines:
+                for line in lines:
+                    message = json.loads(line)
+                    check_worker_message(message)
+                    self._handle(worker, message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            worker.sock.close()
+            with self._condition:
+                self._connections.discard(worker)
+                for batch_id in list(worker.batches):
+                    batch = self._leased.get(batch_id)
+                    if batch is not None:
+                        self._requeue(batch)
+
+    def _handle(self, worker, message):
+        op = message["op"]
+        with self._condition:
+            if op == "hello":
+                worker.name = message.get("worker", "?")
+            elif op == "lease":
+                self._waiting.append(worker)
+                self._assign()
+            elif op == "renew":
+                deadline = time.monotonic() + self.lease_seconds
+                for batch_id in message["ids"]:
+                    batch = self._leased.get(batch_id)
+                    if batch is not None and batch.worker is worker:
+                        batch.deadline = deadline
+            elif op == "results":
+                for fields in message["records"]:
+                    batch = self._leased.get(fields[0])
+                    if batch is not None:
+                        self._report(batch, VerdictRecord(*fields[1:]))
+            elif op == "ack":
+                batch = self._leased.get(message["id"])
+                if batch is not None and batch.worker is worker:
+                    del self._leased[batch.batch_id]
+                    worker.batches.discard(batch.batch_id)
+                    self._assign()
+                    self._condition.notify_all()
+
+    def _report(self, batch, record):
+        """Pass on a worker's verdict once per file and engine; called with the condition held."""
+        key = (record.path, record.engine)
+        if key in batch.answered:
+            return
+        batch.answered.add(key)
+        try:
+            index = self.engine_names.index(record.engine)
+        except ValueError:
+            return
+        if is_member_path(record.path) and (record.path, None) not in batch.answered:
+            batch.answered.add((record.path, None))
+            for counter in self.engine_progress:
+                counter.add(total=1)
+        self.engine_progress[index].add(done=1)
+        self.verdicts += 1
+        self.cache_hits += record.cached
+        self.consensus_saved += record.prefilter == "consensus"
+        if record.verdict == INFECTED:
+            self.detections.append((record.path, record.engine))
+        if self._on_verdict is not None:
+            self._on_verdict(record)
+        if record.verdict == INFECTED and self._on_detection is not None:
+            self._on_detection(record.path, record.engine)
+
+    def _close(self):
+        self._listener.close()
+        family, bind_address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            try:
+                os.unlink(bind_address)
+            except OSError:
+                pass
+        with self._condition:
+            connections = list(self._connections)
+        for worker in connections:
+            try:
+                worker.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
@@ -0,0 +1,141 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+class ResumableWalk:
+    """Directory walk whose position can be saved and restored.
+
+    The position is the stack of directories not listed yet plus the "open"
+    directories: those being listed, or listed but with files that are not
+    complete. On resume the open directories are listed again, and files
+    recorded as complete are skipped by the caller. Subdirectories are only
+    pushed again for a directory whose listing was cut short, and then only
+    if they are not on the stack already: the walk is depth first, so no
+    subdirectory of a directory still being listed can have been walked.
+    """
+
+    def __init__(self, root, pending=None, reopen=()):
+        self.pending = list(pending) if pending is not None else [root]
+        # (directory, listing finished) pairs saved as open by the previous run
+        self.reopen = [tuple(item) for item in reopen]
+        # Directory -> [files not complete yet, listing finished]
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        """Yield a DirEntry for every regular file, like scan_engine.walk_files()."""
+        while True:
+            with self._lock:
+                if self.reopen:
+                    directory, listed = self.reopen.pop()
+                    known_dirs = set(self.pending)
+                elif self.pending:
+                    directory, listed = self.pending.pop(), False
+                    known_dirs = ()
+                else:
+                    return
+                self._open[directory] = [0, False]
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if not listed and entry.path not in known_dirs:
+                                    with self._lock:
+                                        self.pending.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                with self._lock:
+                                    self._open[directory][0] += 1
+                                yield entry
+                        except OSError:
+                            continue  # Entry vanished or is unreadable
+            except OSError:
+                pass  # Directory vanished or permission denied
+            with self._lock:
+                state = self._open[directory]
+                state[1] = True
+                if not state[0]:
+                    del self._open[directory]
+
+    def file_done(self, path):
+        """Mark a file yielded by the walk as complete."""
+        directory = os.path.dirname(path)
+        with self._lock:
+            state = self._open.get(directory)
+            if state is None:
+                return
+            state[0] -= 1
+            if state[1] and not state[0]:
+                del self._open[directory]
+
+    def position(self):
+        """Return the walk position as a JSON-serialisable dict for ResumableWalk(**position)."""
+        with self._lock:
+            return {"pending": list(self.pending),
+                    "reopen": self.reopen + [(directory, state[1]) for directory, state in self._open.items()]}
+
+
+class ScanCheckpoint:
+    """Crash-safe record of one scan job's walk position and completed files, in SQLite.
+
+    save() writes the position and every file completed since the last save
+    in a single transaction, so after a crash the database holds either the
+    previous checkpoint or the new one, never a mix.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS completed (path TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+        self._completed = []
+
+    def position(self):
+        """Return the saved walk position, or None if the job has not been checkpointed yet."""
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM state WHERE key = 'walk'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def is_completed(self, path):
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM completed WHERE path = ?", (path,)).fetchone() is not None
+
+    def completed_count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM completed").fetchone()[0] + len(self._completed)
+
+    def file_done(self, path):
+        """Queue a completed file for the next save()."""
+        with self._lock:
+            self._completed.append((path,))
+
+    def save(self, position):
+        with self._lock:
+            completed, self._completed = self._completed, []
+            with self._connection:
+                self._connection.executemany("INSERT OR IGNORE INTO completed VALUES (?)", completed)
+                self._connection.execute("INSERT OR REPLACE INTO state VALUES ('walk', ?)", (json.dumps(position),))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def discard(self):
+        """Close and delete the checkpoint once its job is finished or cancelled."""
+        self.close()
+        remove_checkpoint(self.path)
+
+
+def remove_checkpoint(path):
+    """Delete the checkpoint database at path, if there is one."""
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+from collections import Counter
+
+from engines import CLEAN, ENGINE_NAMES, ERROR, SKIPPED
+from metrics import metrics
+from scan_engine import DATA_DIR
+
+DEFAULT_HISTORY_PATH = os.path.join(DATA_DIR, "engine_history.json")
+
+# Extensions treated as low risk by FastClean
+LOW_RISK_TYPES = frozenset({
+    ".txt", ".log", ".csv", ".json", ".xml", ".md", ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp",
+    ".mp3", ".flac", ".ogg", ".wav", ".mp4", ".mkv", ".avi", ".mov",
+})
+
+# How strongly a higher detection rate moves an engine forward relative to its latency
+DETECTION_WEIGHT = 10.0
+
+# Weight of the newest latency sample in an engine's moving average
+LATENCY_SMOOTHING = 0.05
+
+
+class ConsensusPolicy:
+    """Decides a file's verdict before every engine has answered.
+
+    fanout engines are asked first; after each answer decide() is given the
+    verdicts so far and returns the settled verdict, or None to ask the next
+    engine in line.
+    """
+
+    name = "all"
+    fanout = None  # None asks every engine at once
+
+    def fanout_for(self, kind):
+        """Return how many engines to ask first about a file of type kind."""
+        return self.fanout
+
+    def decide(self, verdicts, kind):
+        return None
+
+
+class AllEngines(ConsensusPolicy):
+    """Every engine scans every file; the behaviour without a consensus policy."""
+
+
+class Agreement(ConsensusPolicy):
+    """Stop once count engines have given the same (non-error) verdict."""
+
+    def __init__(self, count=2):
+        if count < 1:
+            raise ValueError(f"agreement needs at least one engine, not {count}")
+        self.count = count
+        self.fanout = count
+        self.name = f"agree:{count}"
+
+    def decide(self, verdicts, kind):
+        votes = Counter(verdict for verdict in verdicts if verdict not in (ERROR, SKIPPED))
+        for verdict, count in votes.items():
+            if count >= self.count:
+                return verdict
+        return None
+
+
+class FastClean(ConsensusPolicy):
+    """Clean as soon as the best-ranked engine says clean on a low-risk file type.
+
+    Anything else falls back to the fallback policy (every engine by default),
+    which also decides how many engines are asked first about it.
+    """
+
+    fanout = 1
+
+    def __init__(self, fallback=None, low_risk_types=LOW_RISK_TYPES):
+        self.fallback = fallback or AllEngines()
+        self.low_risk_types = low_risk_types
+        self.name = "fast-clean" if isinstance(self.fallback, AllEngines) else f"fast-clean+{self.fallback.name}"
+
+    def fanout_for(self, kind):
+        return self.fanout if kind in self.low_risk_types else self.fallback.fanout_for(kind)
+
+    def decide(self, verdicts, kind):
+        if kind in self.low_risk_types and verdicts and verdicts[0] == CLEAN:
+            return CLEAN
+        return self.fallback.decide(verdicts, kind)
+
+
+def create_policy(spec=None, engine_count=len(ENGINE_NAMES)):
+    """Build a policy from spec (default: $AV_PIPELINE_CONSENSUS); None means every engine.
+
+    spec is "all", "agree:N", "fast-clean" or "fast-clean+agree:N", with N
+    from 1 to engine_count. Raises ValueError for anything else.
+    """
+    spec = spec or os.environ.get("AV_PIPELINE_CONSENSUS", "all")
+    if spec == "all":
+        return None
+    if spec.startswith("fast-clean"):
+        _, _, fallback = spec.partition("+")
+        return FastClean(create_policy(fallback, engine_count) if fallback else None)
+    if spec.startswith("agree:"):
+        count = spec.split(":", 1)[1]
+        if not count.isdigit() or not 1 <= int(count) <= engine_count:
+            raise ValueError(f"agree:N needs N from 1 to {engine_count}, not {count!r}")
+        return Agreement(int(count))
+    raise ValueError(f"unknown consensus policy: {spec}")
+
+
+class EngineHistory:
+    """Per file type and engine: moving-average latency and detection rate, kept between runs.
+
+    rank() orders engines by latency / (1 + DETECTION_WEIGHT * detection
+    rate), so fast engines go first and an engine that catches more of a type
+    moves forward for that type. Given the current load of each engine's VM,
+    latency is scaled by (1 + load) so busy engines are asked later. Engines
+    never measured for a type go behind the measured ones, least loaded
+    first and otherwise in their configured order.
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # (type, engine name) -> [files, detections, average latency]
+        self._stats = {}
+        try:
+            with open(path, encoding="utf-8") as file:
+                for kind, name, files, detections, latency in json.load(file):
+                    self._stats[(kind, name)] = [files, detections, latency]
+        except (OSError, ValueError):
+            pass
+
+    def record(self, kind, engine_name, latency, infected):
+        with self._lock:
+            stats = self._stats.get((kind, engine_name))
+            if stats is None:
+                self._stats[(kind, engine_name)] = [1, int(infected), latency]
+                return
+            stats[0] += 1
+            stats[1] += infected
+            stats[2] += LATENCY_SMOOTHING * (latency - stats[2])
+
+    def rank(self, kind, engine_names, loads=None):
+        """Return positions into engine_names, best engine for kind first; loads maps names to VM load."""
+        loads = loads or {}
+        with self._lock:
+            def key(position):
+                load = loads.get(engine_names[position], 0.0)
+                stats = self._stats.get((kind, engine_names[position]))
+                if stats is None:
+                    return (1, load, position)
+                files, detections, latency = stats
+                return (0, latency * (1 + load) / (1 + DETECTION_WEIGHT * detections / files), position)
+            return sorted(range(len(engine_names)), key=key)
+
+    def save(self):
+        with self._lock:
+            rows = [[kind, name, *stats] for (kind, name), stats in self._stats.items()]
+        temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(rows, file)
+        os.replace(temporary, self.path)
+
+
+metrics.describe("av_consensus_saved_total", "Engine submissions a consensus decision made unnecessary.")
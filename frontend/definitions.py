@@ -0,0 +1,433 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from engines import ENGINE_NAMES, note_definitions_changed
+from hashing import hash_file
+from installers import MAX_TRANSFERS, ask_agent, install_targets, push_artifact
+from metrics import metrics
+from progress_bus import progress_bus
+from scan_engine import DATA_DIR
+from verdict_cache import DEFAULT_CACHE_PATH, WORKER_CACHE_DIR, VerdictCache, invalidate_worker_caches
+
+DEFAULT_DEFINITIONS_DIR = os.path.join(DATA_DIR, "definitions")
+
+# Versions kept per engine; a VM on an older one gets the full definitions
+KEEP_VERSIONS = 5
+
+# Average size of the pieces deltas are made of
+DELTA_CHUNK_SIZE = 8 * 1024
+
+# Pieces shorter than this are joined to the next one, so clustered anchors do not cost an op each
+_SHORTEST_PIECE = 64
+
+# Samples of data anchors are picked from, and their size
+_SAMPLES = 8
+_SAMPLE_SIZE = 128 * 1024
+
+_DELTA_MAGIC = b"AVD1"
+_DELTA_HEADER = struct.Struct(">32s32sQ")  # old digest, new digest, new size
+_COPY = struct.Struct(">cQQ")  # b"C", offset in old, length
+_INSERT = struct.Struct(">cQ")  # b"I", length, then the bytes
+
+_EMPTY_DIGEST = hashlib.sha256(b"").digest()
+
+_VERSION = re.compile(r"[^\s]+")
+
+
+def definitions_counter(engine_name):
+    """Return the progress bus counter of an engine's definition update, in bytes."""
+    return progress_bus.counter(f"av-definitions/{engine_name}")
+
+
+def _anchor_pattern(data, chunk_size):
+    """Return a regex of byte pairs that together turn up about once every chunk_size bytes of data.
+
+    Pieces end after each match, so where they end depends only on the
+    bytes there: an insertion or deletion changes the pieces it touches and
+    leaves the rest to line up again. The pairs are the rarest of those
+    found in every one of a few samples spread over data, so they are not
+    confined to one region of it, and the regex engine finds them instead
+    of a loop over every byte.
+    """
+    step = max(_SAMPLE_SIZE, len(data) // _SAMPLES)
+    counts = None
+    everywhere = None
+    for offset in range(0, len(data), step):
+        sample = data[offset:offset + _SAMPLE_SIZE]
+        sample_counts = Counter(zip(sample, sample[1:]))
+        counts = sample_counts if counts is None else counts + sample_counts
+        everywhere = set(sample_counts) if everywhere is None else everywhere & set(sample_counts)
+    if not counts:
+        return re.compile(b"\\0\\0")
+    wanted = sum(counts.values()) / chunk_size
+    chosen = []
+    seen = 0
+    for pair, count in sorted(counts.items(), key=lambda item: (item[0] not in everywhere, item[1])):
+        chosen.append(re.escape(bytes(pair)))
+        seen += count
+        if seen >= wanted:
+            break
+    return re.compile(b"|".join(chosen))
+
+
+def _pieces(data, pattern, chunk_size):
+    """Yield (start, end) of the content-defined pieces of data; anchor-free stretches are cut every 8 chunk_size."""
+    longest = chunk_size * 8
+    last = 0
+    for match in pattern.finditer(data):
+        end = match.end()
+        if end - last < _SHORTEST_PIECE:
+            continue
+        while end - last > longest:
+            yield last, last + longest
+            last += longest
+        yield last, end
+        last = end
+    while len(data) - last > longest:
+        yield last, last + longest
+        last += longest
+    if last < len(data):
+        yield last, len(data)
+
+
+def make_delta(old, new, chunk_size=DELTA_CHUNK_SIZE):
+    """Return a compressed delta that turns old into new.
+
+    Both are cut into content-defined pieces; pieces of new found in old
+    become copies of old's bytes and the rest is sent as is. With old empty
+    the delta is just new compressed, which is how a VM without definitions
+    gets its first ones.
+    """
+    old, new = bytes(old), bytes(new)
+    pattern = _anchor_pattern(old or new, chunk_size)
+    old_view, new_view = memoryview(old), memoryview(new)
+    known = {}
+    for start, end in _pieces(old, pattern, chunk_size):
+        known.setdefault(old_view[start:end], start)
+
+    ops = [_DELTA_HEADER.pack(hashlib.sha256(old).digest(), hashlib.sha256(new).digest(), len(new))]
+    copy_offset = copy_length = 0
+    literal_start = literal_end = 0
+
+    def flush():
+        nonlocal copy_length, literal_start
+        if copy_length:
+            ops.append(_COPY.pack(b"C", copy_offset, copy_length))
+            copy_length = 0
+        if literal_end > literal_start:
+            ops.append(_INSERT.pack(b"I", literal_end - literal_start))
+            ops.append(new_view[literal_start:literal_end])
+            literal_start = literal_end
+
+    for start, end in _pieces(new, pattern, chunk_size):
+        offset = known.get(new_view[start:end])
+        if offset is None:
+            if copy_length:
+                flush()
+                literal_start = start
+            literal_end = end
+        elif copy_length and offset == copy_offset + copy_length:
+            copy_length += end - start
+        else:
+            flush()
+            copy_offset, copy_length = offset, end - start
+            literal_start = literal_end = end
+    flush()
+    return _DELTA_MAGIC + zlib.compress(b"".join(ops), 6)
+
+
+def apply_delta(old, delta):
+    """Return the new definitions a delta made by make_delta() builds from old.
+
+    A delta made from nothing replaces old whatever it is. Raises
+    ValueError if the delta is damaged or was made from other definitions
+    than old, or if the result does not hash to the new digest.
+    """
+    if not delta.startswith(_DELTA_MAGIC):
+        raise ValueError("not a definitions delta")
+    try:
+        body = zlib.decompress(memoryview(delta)[len(_DELTA_MAGIC):])
+        old_digest, new_digest, size = _DELTA_HEADER.unpack_from(body)
+    except (zlib.error, struct.error) as error:
+        raise ValueError(f"damaged definitions delta: {error}") from error
+    if old_digest == _EMPTY_DIGEST:
+        old = b""
+    elif hashlib.sha256(old).digest() != old_digest:
+        raise ValueError("delta was made from other definitions")
+    result = bytearray()
+    view = memoryview(body)
+    position = _DELTA_HEADER.size
+    try:
+        while position < len(body):
+            if body[position:position + 1] == b"C":
+                _, offset, length = _COPY.unpack_from(body, position)
+                result += old[offset:offset + length]
+                position += _COPY.size
+            else:
+                _, length = _INSERT.unpack_from(body, position)
+                position += _INSERT.size
+                result += view[position:position + length]
+                position += length
+    except struct.error as error:
+        raise ValueError(f"damaged definitions delta: {error}") from error
+    if len(result) != size or hashlib.sha256(result).digest() != new_digest:
+        raise ValueError("delta did not rebuild the new definitions")
+    return bytes(result)
+
+
+class DefinitionStore:
+    """Versioned definition blobs per engine, with the deltas between them.
+
+    Blobs are stored once under their SHA-256 digest and listed per engine,
+    oldest first, in index.json; only the newest keep versions are kept.
+    A delta is made the first time it is asked for and kept next to the
+    blobs, so every VM moving between the same two versions shares it.
+    """
+
+    def __init__(self, directory=DEFAULT_DEFINITIONS_DIR, keep=KEEP_VERSIONS):
+        self.directory = directory
+        self.keep = keep
+        self.objects_dir = os.path.join(directory, "objects")
+        self.deltas_dir = os.path.join(directory, "deltas")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.deltas_dir, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        self._making = {}
+        try:
+            with open(self._index_path) as file:
+                self._index = json.load(file)
+        except FileNotFoundError:
+            self._index = {}
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def add(self, engine_name, version, path):
+        """Store the definitions file at path as engine_name's newest version; returns its digest."""
+        if not _VERSION.fullmatch(version):
+            raise ValueError(f"bad definition version {version!r}")
+        digest = hash_file(path)
+        if digest is None:
+            raise OSError(f"cannot read {path}")
+        target = self.object_path(digest)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(path, "rb") as source, open(target + ".part", "wb") as file:
+                while chunk := source.read(1024 * 1024):
+                    file.write(chunk)
+            os.replace(target + ".part", target)
+        with self._lock:
+            versions = [entry for entry in self._index.get(engine_name, []) if entry["version"] != version]
+            versions.append({"version": version, "sha256": digest, "size": os.path.getsize(target),
+                             "added": time.time()})
+            self._index[engine_name] = versions[-self.keep:]
+            self._save()
+            self._prune()
+        return digest
+
+    def versions(self, engine_name):
+        """Return engine_name's versions, oldest first."""
+        return [entry["version"] for entry in self._index.get(engine_name, [])]
+
+    def latest(self, engine_name):
+        versions = self.versions(engine_name)
+        return versions[-1] if versions else None
+
+    def digest(self, engine_name, version):
+        """Return the digest of one of engine_name's versions, or None if it is not kept."""
+        for entry in self._index.get(engine_name, []):
+            if entry["version"] == version:
+                return entry["sha256"]
+        return None
+
+    def delta(self, engine_name, from_version, to_version):
+        """Return the path of the delta from from_version (None: no definitions) to to_version, making it if needed."""
+        old = self.digest(engine_name, from_version) if from_version is not None else None
+        new = self.digest(engine_name, to_version)
+        if new is None or (from_version is not None and old is None):
+            raise KeyError(f"{engine_name} has no definitions {to_version if new is None else from_version}")
+        path = os.path.join(self.deltas_dir, f"{old or 'empty'}-{new}")
+        with self._lock:
+            lock = self._making.setdefault(path, threading.Lock())
+        with lock:
+            if not os.path.exists(path):
+                old_data = b""
+                if old is not None:
+                    with open(self.object_path(old), "rb") as file:
+                        old_data = file.read()
+                with open(self.object_path(new), "rb") as file:
+                    new_data = file.read()
+                with open(path + ".part", "wb") as file:
+                    file.write(make_delta(old_data, new_data))
+                os.replace(path + ".part", path)
+                metrics.inc("av_definition_deltas_made_total", engine=engine_name)
+        return path
+
+    def _save(self):
+        with open(self._index_path + ".new", "w") as file:
+            json.dump(self._index, file, indent=2)
+        os.replace(self._index_path + ".new", self._index_path)
+
+    def _prune(self):
+        """Remove blobs no engine keeps any more and the deltas from or to them."""
+        kept = {entry["sha256"] for versions in self._index.values() for entry in versions}
+        for prefix in os.listdir(self.objects_dir):
+            for digest in os.listdir(os.path.join(self.objects_dir, prefix)):
+                if digest not in kept:
+                    os.unlink(os.path.join(self.objects_dir, prefix, digest))
+        for name in os.listdir(self.deltas_dir):
+            old, _, new = name.partition("-")
+            if (old != "empty" and old not in kept) or new not in kept:
+                os.unlink(os.path.join(self.deltas_dir, name))
+
+
+class DefinitionUpdater:
+    """Brings every engine VM to its engine's latest definitions in the DefinitionStore.
+
+    Each VM is asked for its definition version and sent only the delta from
+    that version, or the full definitions as a delta from nothing when the
+    store no longer keeps it or the delta does not apply there. Deltas go
+    out with push_artifact, so they are chunked, verified and resumable, to
+    up to max_transfers VMs at once; each VM gets one update at a time, as
+    every delta builds on what it had. Once any VM of an engine is on the new version the
+    engine's adapters are told to fetch their version again and verdict_cache,
+    if given, and the caches of the local scan workers in worker_cache_dir drop
+    the engine's verdicts from every other version. Adapters in other
+    processes pick the new version up within engines.VERSION_TTL seconds.
+    """
+
+    def __init__(self, store=None, verdict_cache=None, max_transfers=MAX_TRANSFERS, timeout=30.0,
+                 worker_cache_dir=WORKER_CACHE_DIR):
+        self.store = store or DefinitionStore()
+        self.verdict_cache = verdict_cache
+        self.worker_cache_dir = worker_cache_dir
+        self.max_transfers = max_transfers
+        self.timeout = timeout
+        # Engine name -> why some of its VMs were not updated
+        self.errors = {}
+        # Engine name -> addresses moved to the latest version by the last update()
+        self.updated = {}
+        self.bytes_sent = 0
+
+        self._lock = threading.Lock()
+        self._vm_locks = {}
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Stop every transfer at its next chunk; a later update() resumes them."""
+        self._cancelled.set()
+
+    def update(self, targets=None):
+        """Update targets, {engine name: [(host, port)]} (default: install_targets()); returns self.errors."""
+        targets = install_targets() if targets is None else targets
+        self.errors = {}
+        self.updated = {}
+        self._cancelled.clear()
+        for name in targets:
+            definitions_counter(name).reset()
+        jobs = []
+        with ThreadPoolExecutor(max_workers=self.max_transfers, thread_name_prefix="definitions") as pool:
+            for name, addresses in targets.items():
+                version = self.store.latest(name)
+                if version is None:
+                    self.errors[name] = "no definitions stored"
+                    continue
+                if not addresses:
+                    self.errors[name] = "no engine VM to update"
+                    continue
+                self.updated[name] = []
+                for address in dict.fromkeys(addresses):
+                    jobs.append((name, address, pool.submit(self._update_vm, name, address, version)))
+            for name, (host, port), future in jobs:
+                try:
+                    if future.result():
+                        self.updated[name].append((host, port))
+                except (OSError, ValueError, KeyError) as error:
+                    self.errors[name] = f"{host}:{port}: {error}"
+
+        for name, addresses in self.updated.items():
+            if addresses:
+                note_definitions_changed(name)
+                if self.verdict_cache is not None:
+                    self.verdict_cache.invalidate(name, keep_version=self.store.latest(name))
+                if self.worker_cache_dir is not None:
+                    for path in invalidate_worker_caches(name, self.store.latest(name), self.worker_cache_dir):
+                        self.errors[name] = f"cannot invalidate {path}"
+        return self.errors
+
+    def _update_vm(self, name, address, version):
+        """Move one VM to version; returns False if it already had it."""
+        with self._lock:
+            vm_lock = self._vm_locks.setdefault(address, threading.Lock())
+        with vm_lock:
+            current = ask_agent(address, "VERSION", timeout=self.timeout)
+            if current == version:
+                return False
+            base = current if self.store.digest(name, current) is not None else None
+            if self._send(name, address, base, version):
+                return True
+            if base is not None:
+                # The VM's definitions are not what the store has for its version
+                metrics.inc("av_definition_full_fallbacks_total", engine=name)
+                if self._send(name, address, None, version):
+                    return True
+        raise ValueError("the VM could not apply its definitions")
+
+    def _send(self, name, address, base, version):
+        """Push the delta from base to version and have the agent apply it; False if it would not apply."""
+        path = self.store.delta(name, base, version)
+        digest = hash_file(path)
+        counter = definitions_counter(name)
+        counter.add(total=os.path.getsize(path))
+        sent = push_artifact(address, path, digest, timeout=self.timeout, on_bytes=lambda n: counter.add(done=n),
+                             cancelled=self._cancelled)
+        if sent is None:
+            raise ValueError("cancelled")
+        with self._lock:
+            self.bytes_sent += sent
+        return ask_agent(address, "UPDATE", digest, version, timeout=self.timeout) == "ok"
+
+
+metrics.describe("av_definition_deltas_made_total", "Definition deltas computed between two stored versions.")
+metrics.describe("av_definition_full_fallbacks_total",
+                 "VMs sent full definitions because a delta did not apply to what they had.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep engine definitions and push them to the engine VMs as deltas.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="store a definitions file as an engine's newest version")
+    add.add_argument("engine", choices=ENGINE_NAMES)
+    add.add_argument("version")
+    add.add_argument("file")
+    commands.add_parser("versions", help="list the stored versions")
+    push = commands.add_parser("push", help="bring every engine VM to its engine's newest version")
+    push.add_argument("--engines", help="engine mode as for scan_cli (default: $AV_PIPELINE_ENGINES)")
+    push.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="verdict cache database to invalidate")
+    args = parser.parse_args()
+
+    store = DefinitionStore()
+    if args.command == "add":
+        print(store.add(args.engine, args.version, args.file))
+    elif args.command == "versions":
+        for name in ENGINE_NAMES:
+            print(f"{name}: {', '.join(store.versions(name)) or '-'}")
+    else:
+        cache = VerdictCache(args.cache)
+        updater = DefinitionUpdater(store, cache)
+        errors = updater.update(install_targets(args.engines))
+        cache.close()
+        for name in ENGINE_NAMES:
+            print(f"{name}: {len(updater.updated.get(name, []))} VMs updated"
+                  + (f", {errors[name]}" if name in errors else ""))
+        raise SystemExit(1 if errors else 0)
@@ -0,0 +1,212 @@
+import logging
+import queue
+import threading
+import time
+
+from engines import ERROR, SKIPPED
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Pushed once per worker thread to tell it the lane is closing
+_CLOSE = object()
+
+
+class EngineLane:
+    """Bounded queue plus a fixed number of worker threads feeding a single engine.
+
+    Workers pull a batch of up to batch_size files, submit it with the engine's
+    scan_batch() and resize the next batch from how long this one took: batches
+    that finish well under target_batch_seconds double, batches that overrun it
+    halve. A full queue blocks submit(), which pushes back on the stage feeding it.
+
+    Items for which withdrawn(context) is true by the time a worker takes them
+    are not scanned; on_verdict() gets SKIPPED for them instead. If scan_batch()
+    raises, every file in the batch gets ERROR and the worker goes on; if
+    on_verdict() raises, the error is logged and the rest of the batch is
+    still delivered.
+    """
+
+    def __init__(self, index, engine, on_verdict, cancelled, max_in_flight=4, queue_size=256,
+                 min_batch=1, max_batch=64, target_batch_seconds=0.5, resumed=None, withdrawn=None,
+                 on_done=None):
+        self.index = index
+        self.engine = engine
+        self.on_verdict = on_verdict
+        self.on_done = on_done
+        self.cancelled = cancelled
+        self.resumed = resumed
+        self.withdrawn = withdrawn
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.target_batch_seconds = target_batch_seconds
+
+        self.batch_size = min_batch
+        self.in_flight = 0
+        self.completed = 0
+        self.files_per_second = 0.0
+
+        # Unbounded queue; queue_size is enforced on blocking submits by _slots
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"engine-{index}-{n}", daemon=True)
+            for n in range(max_in_flight)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, item, block=True):
+        """Queue item (path, context, data) for this engine, blocking while the queue is full.
+
+        With block false the item is queued past the limit; used for follow-up
+        submissions made from verdict callbacks, which run on lane workers and
+        must never wait on a lane.
+        """
+        if block:
+            self._slots.acquire()
+        self._queue.put((item, block))
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Wait for every queued file to be scanned, then stop the workers."""
+        for _ in self._threads:
+            self._queue.put(_CLOSE)
+        for thread in self._threads:
+            thread.join()
+
+    def _take_batch(self):
+        """Return (batch, closing); closing is set once this worker has taken its close marker."""
+        first = self._queue.get()
+        if first is _CLOSE:
+            return [], True
+        batch = [self._unwrap(first)]
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                return batch, True
+            batch.append(self._unwrap(item))
+        return batch, False
+
+    def _unwrap(self, queued):
+        item, held = queued
+        if held:
+            self._slots.release()
+        return item
+
+    def _work(self):
+        closing = False
+        while not closing:
+            batch, closing = self._take_batch()
+            if not batch:
+                continue
+            try:
+                self._scan(batch)
+            except Exception:
+                # Never costs the worker: close() waits on it
+                log.exception("engine lane %s failed a batch", self.engine.name)
+                metrics.inc("av_engine_lane_errors_total", engine=self.engine.name)
+            finally:
+                if self.on_done is not None:
+                    self.on_done(len(batch))
+
+    def _scan(self, batch):
+        if self.resumed is not None:
+            self.resumed.wait()  # Paused: hold the batch until resumed or cancelled
+        if self.cancelled.is_set():
+            return  # Drain without scanning so blocked submitters wake up
+        if self.withdrawn is not None:
+            kept = []
+            for item in batch:
+                if self.withdrawn(item[1]):
+                    self._deliver(item[0], item[1], SKIPPED, 0.0)
+                else:
+                    kept.append(item)
+            batch = kept
+            if not batch:
+                return
+
+        with self._lock:
+            self.in_flight += len(batch)
+        started = time.perf_counter()
+        # Archive members carry their content as data and have no file of their own
+        try:
+            verdicts = self.engine.scan_batch([path if data is None else data for path, _, data in batch])
+        except Exception:
+            # An engine that raises fails this batch like a lost connection would, and the lane carries on
+            metrics.inc("av_engine_lane_errors_total", engine=self.engine.name)
+            verdicts = [ERROR] * len(batch)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.in_flight -= len(batch)
+            self.completed += len(batch)
+            rate = len(batch) / elapsed if elapsed > 0 else float(len(batch))
+            self.files_per_second = rate if not self.files_per_second else \
+                0.8 * self.files_per_second + 0.2 * rate
+            if elapsed < self.target_batch_seconds / 2:
+                self.batch_size = min(self.batch_size * 2, self.max_batch)
+            elif elapsed > self.target_batch_seconds:
+                self.batch_size = max(self.batch_size // 2, self.min_batch)
+
+        metrics.record("av_engine_batch_seconds", elapsed, engine=self.engine.name)
+        latency = elapsed / len(batch)
+        for (path, context, _), verdict in zip(batch, verdicts):
+            self._deliver(path, context, verdict, latency)
+
+    def _deliver(self, path, context, verdict, latency):
+        """Pass one verdict to on_verdict; one that raises must not cost the other files their verdicts."""
+        try:
+            self.on_verdict(self.index, path, context, verdict, latency)
+        except Exception:
+            log.exception("verdict callback failed for %s", path)
+            metrics.inc("av_engine_lane_errors_total", engine=self.engine.name)
+
+
+class EngineDispatcher:
+    """Sends files to each engine independently through one EngineLane per engine.
+
+    A fast engine can run ahead of a slow one by up to its queue size; after
+    that submit() blocks, so a slow engine bounds memory rather than letting
+    its backlog grow. on_verdict(engine_index, path, context, verdict, latency)
+    is called from the lane's worker thread; latency is the file's share of
+    its batch's round trip, in seconds, and may itself submit follow-up files
+    with block=False.
+    """
+
+    def __init__(self, engines, on_verdict, cancelled=None, resumed=None, **lane_options):
+        self.cancelled = cancelled or threading.Event()
+        # Files submitted and not yet through on_verdict() or drained; close() waits for none
+        self._unfinished = 0
+        self._idle = threading.Condition()
+        self.lanes = [EngineLane(index, engine, on_verdict, self.cancelled, resumed=resumed, on_done=self._done,
+                                 **lane_options)
+                      for index, engine in enumerate(engines)]
+
+    def submit(self, engine_index, path, context=None, data=None, block=True):
+        """Queue path for one engine; data, if given, is sent in place of the file's content."""
+        with self._idle:
+            self._unfinished += 1
+        self.lanes[engine_index].submit((path, context, data), block)
+
+    def _done(self, count):
+        with self._idle:
+            self._unfinished -= count
+            if not self._unfinished:
+                self._idle.notify_all()
+
+    def stats(self):
+        """Return [(queue depth, in flight, files per second)] in engine order."""
+        return [(lane.queue_depth(), lane.in_flight, lane.files_per_second) for lane in self.lanes]
+
+    def close(self):
+        """Wait until every submitted file, follow-ups included, is done, then stop the lanes."""
+        with self._idle:
+            self._idle.wait_for(lambda: not self._unfinished)
+        for lane in self.lanes:
+            lane.close()
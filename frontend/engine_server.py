@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+from definitions import apply_delta
+from engines import CLEAN, EICAR_SIGNATURE, ENGINE_PORT, ERROR, INFECTED
+from hashing import hash_file
+from telemetry import HostSampler
+
+# Only this much of each submitted file is kept for signature matching
+HEAD_SIZE = 4096
+
+_DIGEST = re.compile(rb"[0-9a-f]{64}")
+# Sizes and offsets: decimal, and small enough that a typo cannot ask for petabytes
+_SIZE = re.compile(rb"[0-9]{1,15}")
+
+
+class StandInEngineServer:
+    """Local asyncio TCP service that speaks the RemoteEngine protocol.
+
+    It flags files containing the EICAR test string in their first 4 KiB and
+    answers every request after latency seconds. Requests on one connection
+    are handled concurrently, so pipelined clients only pay the latency once
+    per batch. Used to load-test the scan path without any real AV engine.
+    As the VM agent, it answers STATS with this host's CPU, memory and disk
+    I/O and the number of files still waiting for a verdict, and takes
+    installer uploads (OFFER, CHUNK and COMMIT, see installers.push_artifact)
+    into upload_dir, a temporary directory made on start unless given.
+    UPDATE applies an uploaded definition delta to the definitions kept in
+    upload_dir and switches definition_version to the new version.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, definition_version="standin-1", upload_dir=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.definition_version = definition_version
+        self.upload_dir = upload_dir
+        self.requests_served = 0
+        self.connections_accepted = 0
+        self.queue_length = 0
+        self.chunks_received = 0
+
+        self._sampler = HostSampler()
+
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._writers = set()
+
+    async def start(self):
+        if self.upload_dir is None:
+            self.upload_dir = tempfile.mkdtemp(prefix="standin-agent-")
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def serve_in_thread(self):
+        """Run the server on a background event loop and return once it is listening."""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="engine-server", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            await self._server.wait_closed()
+            # Closing the transports ends every handler's read loop cleanly
+            for writer in list(self._writers):
+                writer.transport.abort()
+            handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.gather(*handlers, return_exceptions=True)
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    async def _handle(self, reader, writer):
+        self.connections_accepted += 1
+        self._writers.add(writer)
+        pending = set()
+        try:
+            while line := await reader.readline():
+                parts = line.split()
+                if len(parts) == 3 and parts[0] == b"SCAN":
+                    if not _SIZE.fullmatch(parts[2]):
+                        writer.write(parts[1] + b" " + ERROR.encode() + b"\n")
+                        break  # The file that follows cannot be skipped without its size
+                    head = await self._read_payload(reader, int(parts[2]))
+                    self.queue_length += 1
+                    task = asyncio.create_task(self._answer(writer, parts[1], head))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                elif len(parts) == 2 and parts[0] == b"VERSION":
+                    writer.write(parts[1] + b" " + self.definition_version.encode() + b"\n")
+                elif len(parts) == 2 and parts[0] == b"STATS":
+                    stats = dict(self._sampler.sample(), queue=self.queue_length)
+                    writer.write(parts[1] + b" " + json.dumps(stats).encode() + b"\n")
+                elif len(parts) == 3 and parts[0] == b"OFFER" and _DIGEST.fullmatch(parts[2]):
+                    offset = await asyncio.to_thread(self._offered, parts[2].decode())
+                    writer.write(parts[1] + b" " + str(offset).encode() + b"\n")
+                elif len(parts) == 6 and parts[0] == b"CHUNK" and _DIGEST.fullmatch(parts[2]):
+                    if not (_SIZE.fullmatch(parts[3]) and _SIZE.fullmatch(parts[4])):
+                        writer.write(parts[1] + b" " + ERROR.encode() + b"\n")
+                        break
+                    data = await reader.readexactly(int(parts[4]))
+                    size = await asyncio.to_thread(self._store_chunk, parts[2].decode(), int(parts[3]), data,
+                                                   parts[5].decode())
+                    writer.write(parts[1] + b" " + str(size).encode() + b"\n")
+                elif len(parts) == 3 and parts[0] == b"COMMIT" and _DIGEST.fullmatch(parts[2]):
+                    committed = await asyncio.to_thread(self._commit, parts[2].decode())
+                    writer.write(parts[1] + (b" ok\n" if committed else b" bad\n"))
+                elif len(parts) == 4 and parts[0] == b"UPDATE" and _DIGEST.fullmatch(parts[2]):
+                    updated = await asyncio.to_thread(self._update_definitions, parts[2].decode(), parts[3].decode())
+                    writer.write(parts[1] + (b" ok\n" if updated else b" bad\n"))
+                else:
+                    break  # Protocol error, drop the connection
+            if pending:
+                await asyncio.gather(*pending)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _read_payload(self, reader, size):
+        head = await reader.readexactly(min(size, HEAD_SIZE))
+        remaining = size - len(head)
+        while remaining:
+            chunk = await reader.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(chunk)
+        return head
+
+    async def _answer(self, writer, request_id, head):
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        finally:
+            self.queue_length -= 1
+        verdict = INFECTED if EICAR_SIGNATURE in head else CLEAN
+        self.requests_served += 1
+        writer.write(request_id + b" " + verdict.encode() + b"\n")
+
+    def installed_path(self, digest):
+        """Where a committed upload with this SHA-256 digest is kept."""
+        return os.path.join(self.upload_dir, digest)
+
+    def _offered(self, digest):
+        """Return "installed" for a committed upload, else how many bytes of it are already held."""
+        if os.path.exists(self.installed_path(digest)):
+            return "installed"
+        try:
+            return os.path.getsize(self.installed_path(digest) + ".part")
+        except OSError:
+            return 0
+
+    def _store_chunk(self, digest, offset, data, chunk_digest):
+        """Append data if it continues the partial upload and matches its digest; return the held size."""
+        part = self.installed_path(digest) + ".part"
+        with open(part, "ab") as file:
+            size = file.tell()
+            if offset == size and hashlib.sha256(data).hexdigest() == chunk_digest:
+                file.write(data)
+                size += len(data)
+                self.chunks_received += 1
+        return size
+
+    def _commit(self, digest):
+        """Install a complete upload whose digest checks out; a mismatch throws the partial upload away."""
+        part = self.installed_path(digest) + ".part"
+        if os.path.exists(self.installed_path(digest)):
+            return True  # Another connection committed the same content first
+        if hash_file(part) != digest:
+            try:
+                os.unlink(part)
+            except OSError:
+                pass
+            return False
+        try:
+            os.replace(part, self.installed_path(digest))
+        except FileNotFoundError:
+            return os.path.exists(self.installed_path(digest))
+        return True
+
+    def _update_definitions(self, delta_digest, version):
+        """Apply the uploaded delta to the current definitions; False if it is missing or does not apply."""
+        path = os.path.join(self.upload_dir, "definitions")
+        try:
+            with open(self.installed_path(delta_digest), "rb") as file:
+                delta = file.read()
+            try:
+                with open(path, "rb") as file:
+                    current = file.read()
+            except FileNotFoundError:
+                current = b""
+            definitions = apply_delta(current, delta)
+            with open(path + ".new", "wb") as file:
+                file.write(definitions)
+            os.replace(path + ".new", path)
+            os.unlink(self.installed_path(delta_digest))
+        except (OSError, ValueError):
+            return False
+        self.definition_version = version
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in AV engine server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=ENGINE_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering each file")
+    parser.add_argument("--definition-version", default="standin-1")
+    parser.add_argument("--upload-dir", help="where installer uploads are kept (default: a temporary directory)")
+    args = parser.parse_args()
+
+    server = StandInEngineServer(args.host, args.port, args.latency, args.definition_version, args.upload_dir)
+
+    async def serve():
+        await server.start()
+        # Printed once bound, so a parent that passed --port 0 can read the port it got
+        print(f"Stand-in engine listening on {server.host}:{server.port}", flush=True)
+        await server.serve_forever()
+
+    asyncio.run(serve())
@@ -0,0 +1,321 @@
+import argparse
+import os
+import queue
+import socket
+import threading
+import time
+
+# Standard anti-virus test string, flagged by the local stand-in engines
+EICAR_SIGNATURE = b"X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*"
+
+CLEAN = "clean"
+INFECTED = "infected"
+ERROR = "error"
+# Not sent to any engine because a pre-filter policy excludes the file
+SKIPPED = "skipped"
+
+# Reported as definition_version while the engine host cannot be asked; verdicts are never cached under it
+UNKNOWN_VERSION = "unknown"
+
+# Port the engine agents listen on inside each VM
+ENGINE_PORT = 3310
+
+# Every engine VM as (engine name, IP address, port), in display order
+ENGINE_HOSTS = [
+    ("Microsoft Defender", "0.37.208.72", ENGINE_PORT),
+    ("Trend Micro Security", "124.208.27.73", ENGINE_PORT),
+    ("Eset Internet Security", "1.137.244.126", ENGINE_PORT),
+]
+
+ENGINE_NAMES = [name for name, _, _ in ENGINE_HOSTS]
+
+# Seconds a definition version reported by an engine host is trusted before it is asked again, so
+# processes other than the one that pushed new definitions notice them
+VERSION_TTL = 60.0
+
+# Seconds UNKNOWN_VERSION is reported after the engine host could not be asked, before it is asked again
+VERSION_RETRY = 10.0
+
+# Engine name -> how many times new definitions were pushed to its VMs in this process
+_definition_generations = {}
+
+
+def note_definitions_changed(engine_name):
+    """Make every adapter of engine_name fetch its definition version again before the next verdict is cached."""
+    _definition_generations[engine_name] = _definition_generations.get(engine_name, 0) + 1
+
+
+def definitions_generation(engine_name):
+    return _definition_generations.get(engine_name, 0)
+
+
+class EngineAdapter:
+    """Interface every engine the scanner can submit files to implements.
+
+    name and definition_version together identify the verdicts an engine
+    gives, so they are also the verdict cache key. Items passed to scan() and
+    scan_batch() are file paths, or bytes for archive members that only
+    exist in memory.
+    """
+
+    name = None
+    definition_version = None
+
+    def scan(self, path):
+        """Return CLEAN, INFECTED or ERROR for a single file."""
+        return self.scan_batch([path])[0]
+
+    def scan_batch(self, paths):
+        """Return the verdicts for several files, in order."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any connections held by the adapter."""
+
+
+class SignatureEngine(EngineAdapter):
+    """In-process stand-in for an AV engine that only knows the EICAR test string."""
+
+    def __init__(self, name, definition_version="eicar-1"):
+        self.name = name
+        self.definition_version = definition_version
+
+    def scan(self, path):
+        if isinstance(path, bytes):
+            head = path[:4096]
+        else:
+            try:
+                with open(path, "rb") as file:
+                    head = file.read(4096)
+            except OSError:
+                return ERROR
+        return INFECTED if EICAR_SIGNATURE in head else CLEAN
+
+    def scan_batch(self, paths):
+        return [self.scan(path) for path in paths]
+
+
+class _Connection:
+    """A socket to an engine host plus a buffered reader for its replies."""
+
+    def __init__(self, host, port, timeout):
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.socket.makefile("rb")
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+
+class RemoteEngine(EngineAdapter):
+    """Submits files to an engine host over TCP.
+
+    Wire protocol, one request per file:
+        client: b"SCAN <id> <size>\\n" followed by size bytes of content
+        server: b"<id> <verdict>\\n"
+    and b"VERSION <id>\\n" answered with b"<id> <definition version>\\n". The
+    same agent answers b"STATS <id>\\n" with b"<id> <JSON host stats>\\n",
+    which telemetry.TelemetryPoller polls.
+
+    With pooled set, up to pool_size connections are kept open and reused,
+    and every file of a batch is sent before any reply is read, so a batch
+    costs one round trip. With pooled unset every file opens and closes its
+    own connection, which is the baseline pooling is measured against.
+    """
+
+    def __init__(self, name, host, port=ENGINE_PORT, pool_size=4, pooled=True, timeout=30.0,
+                 version_ttl=VERSION_TTL, version_retry=VERSION_RETRY):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.pooled = pooled
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self.version_retry = version_retry
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+        self._definition_version = None
+        self._definitions_generation = None
+        self._version_expires = 0.0
+
+    @property
+    def definition_version(self):
+        """Definition version reported by the engine host.
+
+        Fetched again after version_ttl seconds and after a definition update
+        made by this process. A host that cannot be asked is reported as
+        UNKNOWN_VERSION for version_retry seconds, so callers do not each
+        wait for it to time out.
+        """
+        generation = definitions_generation(self.name)
+        if self._definition_version is None or self._definitions_generation != generation or \
+                time.monotonic() >= self._version_expires:
+            try:
+                version, lifetime = self._request_version(), self.version_ttl
+            except OSError:
+                version, lifetime = UNKNOWN_VERSION, self.version_retry
+            self._definition_version = version
+            self._definitions_generation = generation
+            self._version_expires = time.monotonic() + lifetime
+        return self._definition_version
+
+    def scan_batch(self, paths):
+        if not self.pooled:
+            return [self._scan_batch_on_new_connection([path])[0] for path in paths]
+
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                try:
+                    connection = _Connection(self.host, self.port, self.timeout)
+                except OSError:
+                    return [ERROR] * len(paths)
+            try:
+                verdicts = self._exchange(connection, paths)
+            except (OSError, ValueError):
+                connection.close()
+                return [ERROR] * len(paths)
+            self._idle.put(connection)
+            return verdicts
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _scan_batch_on_new_connection(self, paths):
+        try:
+            connection = _Connection(self.host, self.port, self.timeout)
+        except OSError:
+            return [ERROR] * len(paths)
+        try:
+            return self._exchange(connection, paths)
+        except (OSError, ValueError):
+            return [ERROR] * len(paths)
+        finally:
+            connection.close()
+
+    def _request_id(self):
+        with self._id_lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _request_version(self):
+        connection = _Connection(self.host, self.port, self.timeout)
+        try:
+            request_id = self._request_id()
+            connection.socket.sendall(f"VERSION {request_id}\n".encode())
+            line = connection.reader.readline()
+            try:
+                reply_id, version = line.decode().split(maxsplit=1)
+                if int(reply_id) != request_id:
+                    raise ValueError(reply_id)
+            except (UnicodeDecodeError, ValueError):
+                raise OSError(f"unexpected reply from engine host: {line[:80]!r}") from None
+            return version.strip()
+        finally:
+            connection.close()
+
+    def _exchange(self, connection, paths):
+        """Send every file (or bytes item) in paths, then collect the replies; unreadable files get ERROR."""
+        verdicts = [ERROR] * len(paths)
+        sent = {}
+        for position, path in enumerate(paths):
+            if isinstance(path, bytes):
+                request_id = self._request_id()
+                connection.socket.sendall(f"SCAN {request_id} {len(path)}\n".encode() + path)
+                sent[request_id] = position
+                continue
+            try:
+                file = open(path, "rb")
+            except OSError:
+                continue
+            with file:
+                size = os.fstat(file.fileno()).st_size
+                request_id = self._request_id()
+                connection.socket.sendall(f"SCAN {request_id} {size}\n".encode())
+                if size:
+                    connection.socket.sendfile(file, count=size)
+                sent[request_id] = position
+
+        while sent:
+            line = connection.reader.readline()
+            if not line:
+                raise OSError("engine host closed the connection")
+            # A reply that does not parse or answers nothing outstanding means the stream is out of step;
+            # OSError makes the caller drop the connection instead of returning it to the pool
+            try:
+                reply_id, verdict = line.decode().split()
+                position = sent.pop(int(reply_id))
+            except (UnicodeDecodeError, ValueError, KeyError):
+                raise OSError(f"unexpected reply from engine host: {line[:80]!r}") from None
+            verdicts[position] = verdict
+        return verdicts
+
+
+def create_engines(mode=None):
+    """Build one adapter per engine in ENGINE_HOSTS.
+
+    mode (default: the AV_PIPELINE_ENGINES environment variable) selects them:
+    "local" for in-process signature engines, "remote" for the engine VMs,
+    "pool" for VMs borrowed from the shared warm pool of snapshotted scan VMs
+    (see vm_pool.py), or "host:port" to send every engine's traffic to one
+    stand-in engine server.
+    """
+    mode = mode or os.environ.get("AV_PIPELINE_ENGINES", "local")
+    if mode == "local":
+        return [SignatureEngine(name) for name in ENGINE_NAMES]
+    if mode == "pool":
+        from vm_pool import PooledEngine, shared_pool  # vm_pool builds on this module
+        pool = shared_pool()
+        return [PooledEngine(name, pool) for name in ENGINE_NAMES]
+    if mode == "remote":
+        return [RemoteEngine(name, host, port) for name, host, port in ENGINE_HOSTS]
+    host, _, port = mode.rpartition(":")
+    return [RemoteEngine(name, host, int(port)) for name in ENGINE_NAMES]
+
+
+def compare_connection_modes(paths, host, port):
+    """Scan paths pooled and with one connection per file; return files per second for each."""
+    results = {}
+    for pooled in (True, False):
+        engine = RemoteEngine("compare", host, port, pooled=pooled)
+        started = time.perf_counter()
+        for offset in range(0, len(paths), 64):
+            engine.scan_batch(paths[offset:offset + 64])
+        elapsed = time.perf_counter() - started
+        engine.close()
+        results["pooled" if pooled else "per_file"] = len(paths) / elapsed if elapsed else 0.0
+    return results
+
+
+if __name__ == "__main__":
+    from engine_server import StandInEngineServer
+    from scan_engine import walk_files
+
+    parser = argparse.ArgumentParser(description="Compare pooled, pipelined submission with one connection per file.")
+    parser.add_argument("folder")
+    parser.add_argument("--latency", type=float, default=0.001, help="stand-in engine latency per file, seconds")
+    parser.add_argument("--limit", type=int, default=2000, help="maximum number of files to submit")
+    args = parser.parse_args()
+
+    server = StandInEngineServer(latency=args.latency)
+    server.serve_in_thread()
+    paths = []
+    for entry in walk_files(args.folder):
+        paths.append(entry.path)
+        if len(paths) >= args.limit:
+            break
+    for mode, files_per_second in compare_connection_modes(paths, server.host, server.port).items():
+        print(f"{mode}: {files_per_second:.0f} files/s")
+    server.stop()
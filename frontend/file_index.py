@@ -0,0 +1,100 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+from scan_engine import DATA_DIR
+
+DEFAULT_INDEX_DIR = os.path.join(DATA_DIR, "index")
+
+
+class FileIndex:
+    """Per-root record of each file's (device, inode, size, mtime) and content hash.
+
+    An incremental scan looks every file up here before touching its contents:
+    if the stat metadata matches the last run, the stored hash is reused and
+    the file is never read. Only new or modified files are hashed again.
+    Files that were not seen by a completed run are pruned by finish().
+    """
+
+    def __init__(self, root, directory=DEFAULT_INDEX_DIR, commit_every=5000):
+        self.root = os.path.abspath(root)
+        self.commit_every = commit_every
+
+        os.makedirs(directory, exist_ok=True)
+        root_key = hashlib.sha256(self.root.encode("utf-8", "surrogateescape")).hexdigest()[:32]
+        self.path = os.path.join(directory, f"{root_key}.sqlite3")
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                last_seen INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._connection.commit()
+        last_run = self._connection.execute("SELECT MAX(last_seen) FROM files").fetchone()[0]
+        self.run_id = (last_run or 0) + 1
+
+        self._pending_records = []
+        self._pending_touches = []
+
+    def lookup(self, path, stat):
+        """Return the stored digest for path if its stat metadata is unchanged, else None."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT device, inode, size, mtime_ns, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        if row[:4] != (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return None
+        return row[4]
+
+    def record(self, path, stat, digest):
+        """Store the stat metadata and digest of a new or modified file."""
+        with self._lock:
+            self._pending_records.append(
+                (path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, digest, self.run_id))
+            self._maybe_flush()
+
+    def touch(self, path):
+        """Mark an unchanged file as seen by this run."""
+        with self._lock:
+            self._pending_touches.append((self.run_id, path))
+            self._maybe_flush()
+
+    def finish(self, prune=True):
+        """Write pending changes and, if prune is set, drop files this run did not see."""
+        with self._lock:
+            self._flush()
+            if prune:
+                self._connection.execute("DELETE FROM files WHERE last_seen != ?", (self.run_id,))
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._connection.commit()
+            self._connection.close()
+
+    def _maybe_flush(self):
+        if len(self._pending_records) + len(self._pending_touches) >= self.commit_every:
+            self._flush()
+            self._connection.commit()
+
+    def _flush(self):
+        if self._pending_records:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending_records)
+            self._pending_records = []
+        if self._pending_touches:
+            self._connection.executemany("UPDATE files SET last_seen = ? WHERE path = ?", self._pending_touches)
+            self._pending_touches = []
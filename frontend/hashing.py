@@ -0,0 +1,128 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+
+# Files at least this large are hashed through mmap instead of read()
+LARGE_FILE_THRESHOLD = 8 * 1024 * 1024
+
+# How much of a mapped file is hashed per update; a multiple of the page size
+LARGE_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Size of the reusable per-thread buffer small files are read into
+SMALL_BUFFER_SIZE = 1024 * 1024
+
+LARGE = "large"
+SMALL = "small"
+
+_buffers = threading.local()
+
+
+class HashStats:
+    """Bytes hashed and time spent hashing, kept separately for the large and small file paths."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bytes = {LARGE: 0, SMALL: 0}
+        self._seconds = {LARGE: 0.0, SMALL: 0.0}
+
+    def add(self, kind, nbytes, seconds):
+        with self._lock:
+            self._bytes[kind] += nbytes
+            self._seconds[kind] += seconds
+
+    def bytes_hashed(self, kind=None):
+        with self._lock:
+            return sum(self._bytes.values()) if kind is None else self._bytes[kind]
+
+    def throughput(self, kind):
+        """Return MB/s for one path, per hashing thread."""
+        with self._lock:
+            seconds = self._seconds[kind]
+            return self._bytes[kind] / seconds / 1e6 if seconds else 0.0
+
+
+def _thread_buffer():
+    view = getattr(_buffers, "view", None)
+    if view is None:
+        view = _buffers.view = memoryview(bytearray(SMALL_BUFFER_SIZE))
+    return view
+
+
+def hash_small_files(paths, stats=None):
+    """Return SHA-256 hex digests for paths, in order, with None for unreadable files.
+
+    Every file is read with readinto() into one buffer that is reused for the
+    whole batch, so no per-file bytes objects are created.
+    """
+    view = _thread_buffer()
+    digests = []
+    total = 0
+    started = time.perf_counter()
+    for path in paths:
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb", buffering=0) as file:
+                while read := file.readinto(view):
+                    digest.update(view[:read])
+                    total += read
+        except OSError:
+            digests.append(None)
+            continue
+        digests.append(digest.hexdigest())
+    if stats is not None:
+        stats.add(SMALL, total, time.perf_counter() - started)
+    return digests
+
+
+def hash_large_file(path, stats=None):
+    """Return the SHA-256 hex digest of a large file, or None if it can't be read.
+
+    The file is mapped read-only and hashed through memoryview slices, so its
+    contents are never copied into Python objects. Pages are hinted as
+    sequential and dropped from the page cache once hashed.
+    """
+    digest = hashlib.sha256()
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return digest.hexdigest()
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, LARGE_CHUNK_SIZE):
+                        digest.update(view[offset:offset + LARGE_CHUNK_SIZE])
+                        if hasattr(os, "posix_fadvise"):
+                            os.posix_fadvise(file.fileno(), offset, LARGE_CHUNK_SIZE, os.POSIX_FADV_DONTNEED)
+                finally:
+                    view.release()
+    except (OSError, ValueError):
+        return None
+    if stats is not None:
+        stats.add(LARGE, size, time.perf_counter() - started)
+    return digest.hexdigest()
+
+
+def hash_member(data, stats=None):
+    """Return the SHA-256 hex digest of an archive member already in memory."""
+    started = time.perf_counter()
+    digest = hashlib.sha256(data).hexdigest()
+    if stats is not None:
+        stats.add(SMALL, len(data), time.perf_counter() - started)
+    return digest
+
+
+def hash_file(path, stats=None):
+    """Return the SHA-256 hex digest of any file, choosing the path by its size."""
+    try:
+        size = os.stat(path).st_size
+    except OSError:
+        return None
+    if size >= LARGE_FILE_THRESHOLD:
+        return hash_large_file(path, stats)
+    return hash_small_files([path], stats)[0]
@@ -0,0 +1,473 @@
+import argparse
+import functools
+import hashlib
+import http.server
+import itertools
+import json
+import os
+import re
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from engines import ENGINE_HOSTS, ENGINE_NAMES
+from hashing import hash_file
+from metrics import metrics
+from progress_bus import progress_bus
+from scan_engine import DATA_DIR
+
+DEFAULT_CACHE_DIR = os.path.join(DATA_DIR, "installers")
+
+# Installer manifest at the root of the installer source: {engine name: {"file", "sha256", "size"}}
+MANIFEST_NAME = "manifest.json"
+
+CHUNK_SIZE = 1024 * 1024
+
+# Chunks sent to an agent before waiting for the first one to be acknowledged
+CHUNK_WINDOW = 4
+
+# Transfers to one VM at a time, and over all VMs
+PER_HOST_TRANSFERS = 2
+MAX_TRANSFERS = 8
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+_RANGE = re.compile(r"bytes=(\d+)-")
+
+
+def install_counter(engine_name):
+    """Return the progress bus counter of an engine's installation, in bytes."""
+    return progress_bus.counter(f"av-install/{engine_name}")
+
+
+class ArtifactCache:
+    """Downloaded installers, each kept once under its SHA-256 digest.
+
+    A download goes to a .part file next to its object and is renamed in
+    only once its digest checks out, so an object in the cache is always
+    complete; an interrupted download resumes from its .part file with an
+    HTTP Range request. Concurrent fetches of one digest share one download.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._fetching = {}
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.object_path(digest))
+
+    def fetch(self, url, digest, size=None, on_bytes=None, cancelled=None, timeout=30.0):
+        """Return the cached path of digest, downloading it from url first unless it is already cached.
+
+        on_bytes(n) is called as bytes arrive, including those a resumed
+        download already had. Returns None if cancelled is set mid-download;
+        raises OSError if the download fails and ValueError if what arrived
+        does not hash to digest.
+        """
+        with self._lock:
+            lock = self._fetching.setdefault(digest, threading.Lock())
+        with lock:
+            path = self.object_path(digest)
+            if os.path.exists(path):
+                metrics.inc("av_installer_cache_hits_total")
+                return path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            part = path + ".part"
+            try:
+                offset = os.path.getsize(part)
+            except OSError:
+                offset = 0
+            if size is not None and offset > size:
+                offset = 0
+            if offset and on_bytes:
+                on_bytes(offset)
+
+            if size is None or offset < size:
+                headers = {"Range": f"bytes={offset}-"} if offset else {}
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+                    if offset and response.status != 206:
+                        # The server sent the whole file, so start over
+                        if on_bytes:
+                            on_bytes(-offset)
+                        offset = 0
+                    with open(part, "ab" if offset else "wb") as file:
+                        while chunk := response.read(CHUNK_SIZE):
+                            file.write(chunk)
+                            metrics.inc("av_installer_bytes_total", len(chunk), direction="download")
+                            if on_bytes:
+                                on_bytes(len(chunk))
+                            if cancelled is not None and cancelled.is_set():
+                                return None
+
+            if hash_file(part) != digest:
+                os.unlink(part)
+                raise ValueError(f"download of {url} does not match its digest")
+            os.replace(part, path)
+            return path
+
+
+def push_artifact(address, path, digest, chunk_size=CHUNK_SIZE, window=CHUNK_WINDOW, timeout=30.0, on_bytes=None,
+                  cancelled=None, attempts=5):
+    """Upload the file at path, whose SHA-256 is digest, to the engine agent at address (host, port).
+
+    Wire protocol, on the agent's engine port:
+        client: b"OFFER <id> <digest>\\n"
+        server: b"<id> installed\\n", or b"<id> <bytes already held>\\n"
+        client: b"CHUNK <id> <digest> <offset> <length> <chunk sha256>\\n" followed by length bytes
+        server: b"<id> <bytes held>\\n", unchanged if the chunk was out of place or corrupt
+        client: b"COMMIT <id> <digest>\\n"
+        server: b"<id> ok\\n" once the whole upload hashes to digest, else b"<id> bad\\n" and it is dropped
+    Up to window chunks are in flight before the first is acknowledged. The
+    upload resumes wherever the agent's partial copy ends, so a dropped
+    connection or a rerun only sends what is missing, and a rejected chunk
+    is sent again from the agent's end. on_bytes(n) is called as the agent
+    acknowledges bytes, so it may go back if the agent loses some.
+
+    Returns the bytes sent, or None if cancelled is set; raises OSError
+    once attempts connections in a row end without progress.
+    """
+    size = os.path.getsize(path)
+    request_ids = itertools.count(1)
+    sent = reported = failures = 0
+
+    def report(held):
+        nonlocal reported
+        if on_bytes and held != reported:
+            on_bytes(held - reported)
+        reported = held
+
+    with open(path, "rb") as file:
+        while True:
+            progress = reported
+            try:
+                with socket.create_connection(address, timeout=timeout) as sock, sock.makefile("rb") as reader:
+                    def ask(command):
+                        request_id = next(request_ids)
+                        sock.sendall(f"{command} {request_id} {digest}\n".encode())
+                        return _reply(reader, request_id)
+
+                    held = ask("OFFER")
+                    if held == "installed":
+                        report(size)
+                        return sent
+                    held = int(held)
+                    report(held)
+                    rejected = 0
+                    while held < size:
+                        position = held
+                        in_flight = deque()
+                        while True:
+                            while len(in_flight) < window and position < size:
+                                if cancelled is not None and cancelled.is_set():
+                                    return None
+                                file.seek(position)
+                                data = file.read(chunk_size)
+                                request_id = next(request_ids)
+                                sock.sendall(f"CHUNK {request_id} {digest} {position} {len(data)} "
+                                             f"{hashlib.sha256(data).hexdigest()}\n".encode() + data)
+                                position += len(data)
+                                sent += len(data)
+                                in_flight.append((request_id, position))
+                                metrics.inc("av_installer_bytes_total", len(data), direction="upload")
+                            if not in_flight:
+                                break
+                            request_id, expected = in_flight.popleft()
+                            held = int(_reply(reader, request_id))
+                            report(held)
+                            if held != expected:
+                                # Out of place or corrupt; the rest in flight is rejected too, so resend from here
+                                metrics.inc("av_installer_chunk_retries_total")
+                                for request_id, _ in in_flight:
+                                    held = int(_reply(reader, request_id))
+                                report(held)
+                                rejected += 1
+                                if rejected > attempts:
+                                    raise ValueError("agent keeps rejecting chunks")
+                                break
+                    if ask("COMMIT") == "ok":
+                        report(size)
+                        return sent
+                    report(0)
+                    raise ValueError("agent rejected the upload's digest")
+            except (OSError, ValueError) as error:
+                failures = 0 if reported > progress else failures + 1
+                if failures >= attempts:
+                    raise OSError(f"upload to {address[0]}:{address[1]} failed: {error}") from error
+                time.sleep(min(5.0, 0.1 * 2 ** failures))
+
+
+def ask_agent(address, command, *arguments, timeout=30.0):
+    """Send one b"<command> <id> <arguments>" request to the agent at address and return its one-word answer."""
+    with socket.create_connection(address, timeout=timeout) as sock, sock.makefile("rb") as reader:
+        sock.sendall(" ".join((command, "1") + arguments).encode() + b"\n")
+        return _reply(reader, 1)
+
+
+def _reply(reader, request_id):
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("agent closed the connection")
+    reply_id, value = line.decode().split()
+    if int(reply_id) != request_id:
+        raise ValueError(f"reply {reply_id} to request {request_id}")
+    return value
+
+
+def fetch_manifest(source, timeout=30.0):
+    """Return the installer manifest at source, checked for a file, digest and size per engine."""
+    with urllib.request.urlopen(f"{source}/{MANIFEST_NAME}", timeout=timeout) as response:
+        manifest = json.load(response)
+    for name, entry in manifest.items():
+        if not (isinstance(entry.get("file"), str) and _DIGEST.fullmatch(str(entry.get("sha256")))
+                and isinstance(entry.get("size"), int)):
+            raise ValueError(f"bad manifest entry for {name}")
+    return manifest
+
+
+def write_manifest(directory, files):
+    """Write the manifest for files, {engine name: installer file name in directory}; returns it."""
+    manifest = {}
+    for name, file_name in files.items():
+        path = os.path.join(directory, file_name)
+        manifest[name] = {"file": file_name, "sha256": hash_file(path), "size": os.path.getsize(path)}
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def install_targets(mode=None):
+    """Return {engine name: [(host, port) of each agent to install on]} for an engine mode as create_engines() takes it.
+
+    The in-process "local" engines have no VM, and the pool's VMs get their
+    engines from the snapshot they are booted from, so both have no targets.
+    """
+    mode = mode or os.environ.get("AV_PIPELINE_ENGINES", "local")
+    if mode in ("local", "pool"):
+        return {name: [] for name in ENGINE_NAMES}
+    if mode == "remote":
+        return {name: [(host, port)] for name, host, port in ENGINE_HOSTS}
+    host, _, port = mode.rpartition(":")
+    return {name: [(host, int(port))] for name in ENGINE_NAMES}
+
+
+class InstallerDistributor:
+    """Installs every engine's installer on its VMs.
+
+    Each installer is downloaded from source (default: the
+    AV_PIPELINE_INSTALLER_SOURCE environment variable) once into the
+    ArtifactCache, whatever the number of VMs, and then pushed from the
+    cache to the VMs in parallel with push_artifact: at most per_host
+    transfers to one VM and max_transfers in all, so the uplink is not
+    flooded. Engines are handled concurrently. Every byte downloaded or
+    acknowledged by a VM is added to the engine's install_counter(), whose
+    total is the bytes still to download plus the installer's size per VM.
+    """
+
+    def __init__(self, source=None, cache=None, per_host=PER_HOST_TRANSFERS, max_transfers=MAX_TRANSFERS,
+                 chunk_size=CHUNK_SIZE, timeout=30.0):
+        self.source = (source or os.environ.get("AV_PIPELINE_INSTALLER_SOURCE", "")).rstrip("/")
+        self.cache = cache or ArtifactCache()
+        self.per_host = per_host
+        self.max_transfers = max_transfers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        # Engine name -> why its installation failed
+        self.errors = {}
+        self.bytes_sent = 0
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Stop every download and transfer at its next chunk; a later install() resumes them."""
+        self._cancelled.set()
+
+    def install(self, targets=None):
+        """Install on targets, {engine name: [(host, port)]} (default: install_targets()); returns self.errors."""
+        targets = install_targets() if targets is None else targets
+        self.errors = {}
+        self._cancelled.clear()
+        for name in targets:
+            install_counter(name).reset()
+        try:
+            if not self.source:
+                raise ValueError("no installer source, set AV_PIPELINE_INSTALLER_SOURCE")
+            manifest = fetch_manifest(self.source, self.timeout)
+        except (OSError, ValueError) as error:
+            self.errors = {name: str(error) for name in targets}
+            return self.errors
+
+        with ThreadPoolExecutor(max_workers=self.max_transfers, thread_name_prefix="install-transfer") as transfers, \
+                ThreadPoolExecutor(max_workers=max(1, len(targets)), thread_name_prefix="install") as engines:
+            for future in [engines.submit(self._install_engine, name, addresses, manifest, transfers)
+                           for name, addresses in targets.items()]:
+                future.result()
+        return self.errors
+
+    def _install_engine(self, name, addresses, manifest, transfers):
+        entry = manifest.get(name)
+        if entry is None:
+            self.errors[name] = "not in the installer manifest"
+            return
+        if not addresses:
+            self.errors[name] = "no engine VM to install on"
+            return
+        addresses = list(dict.fromkeys(addresses))
+        counter = install_counter(name)
+        digest, size = entry["sha256"], entry["size"]
+        counter.add(total=size * (len(addresses) + (not self.cache.has(digest))))
+        try:
+            path = self.cache.fetch(f"{self.source}/{urllib.parse.quote(entry['file'])}", digest, size,
+                                    on_bytes=lambda n: counter.add(done=n), cancelled=self._cancelled,
+                                    timeout=self.timeout)
+        except (OSError, ValueError) as error:
+            self.errors[name] = f"download failed: {error}"
+            return
+        if path is None:
+            self.errors[name] = "cancelled"
+            return
+
+        futures = [(address, transfers.submit(self._push, address, path, digest, counter)) for address in addresses]
+        for (host, port), future in futures:
+            try:
+                future.result()
+            except OSError as error:
+                self.errors[name] = f"{host}:{port}: {error}"
+        if self._cancelled.is_set():
+            self.errors.setdefault(name, "cancelled")
+
+    def _push(self, address, path, digest, counter):
+        with self._lock:
+            slots = self._host_slots.setdefault(address, threading.BoundedSemaphore(self.per_host))
+        with slots:
+            sent = push_artifact(address, path, digest, self.chunk_size, timeout=self.timeout,
+                                 on_bytes=lambda n: counter.add(done=n), cancelled=self._cancelled)
+        with self._lock:
+            self.bytes_sent += sent or 0
+
+
+class _RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves a directory, honouring "Range: bytes=<start>-" so downloads can resume."""
+
+    def send_head(self):
+        match = _RANGE.fullmatch(self.headers.get("Range", ""))
+        self.server.requests.append((self.path, match and int(match[1])))
+        if match is None:
+            return super().send_head()
+        path = self.translate_path(self.path)
+        try:
+            file = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+        size = os.fstat(file.fileno()).st_size
+        start = int(match[1])
+        if start >= size:
+            file.close()
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return None
+        file.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        return file
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FileServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler):
+        super().__init__(address, handler)
+        self.requests = []
+
+    def handle_error(self, request, client_address):
+        pass  # A client dropping a download half way is expected
+
+
+class StandInFileServer:
+    """Local HTTP server standing in for the vendors' download servers, to test installs without them.
+
+    It serves directory, where write_manifest() puts the manifest, and
+    records every (path, range start) it was asked for in requests.
+    """
+
+    def __init__(self, directory, host="127.0.0.1", port=0):
+        self.directory = directory
+        self._server = _FileServer((host, port), functools.partial(_RangeRequestHandler, directory=directory))
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    def serve_in_thread(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="file-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._thread = None
+
+
+metrics.describe("av_installer_bytes_total", "Installer bytes downloaded into the cache and uploaded to VMs.")
+metrics.describe("av_installer_cache_hits_total", "Installer fetches answered from the local cache.")
+metrics.describe("av_installer_chunk_retries_total", "Installer chunks a VM rejected and that were sent again.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve engine installers locally, or install them on the engine VMs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="serve a directory of installers as a stand-in download server")
+    serve.add_argument("directory")
+    serve.add_argument("--installer", action="append", default=[], metavar="ENGINE=FILE",
+                       help="write the manifest entry of an engine's installer file first")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    install = commands.add_parser("install", help="download each installer once and push it to the engine VMs")
+    install.add_argument("--source", help="installer source URL (default: $AV_PIPELINE_INSTALLER_SOURCE)")
+    install.add_argument("--engines", help="engine mode as for scan_cli (default: $AV_PIPELINE_ENGINES)")
+    install.add_argument("--per-host", type=int, default=PER_HOST_TRANSFERS)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if args.installer:
+            write_manifest(args.directory, dict(item.split("=", 1) for item in args.installer))
+        server = StandInFileServer(args.directory, args.host, args.port)
+        print(f"Serving installers on {server.url}")
+        server.serve_in_thread()
+        try:
+            server._thread.join()
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        distributor = InstallerDistributor(args.source, per_host=args.per_host)
+        errors = distributor.install(install_targets(args.engines))
+        for name in ENGINE_NAMES:
+            print(f"{name}: {errors.get(name, 'installed')}")
+        raise SystemExit(1 if errors else 0)
@@ -1,15 +1,34 @@
+import os
 import sys
+import time
+
+# Taken before any Qt import so the cold start timing includes it
+STARTED = time.perf_counter()
+
 from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QPushButton, QLabel, QHBoxLayout
-from PyQt6.QtGui import QIcon, QFont
-from PyQt6.QtCore import QSize, Qt
-from virtual_machines import VMWindow
-from anti_virus import AVWindow
-from scans import ScanWindow
+from PyQt6.QtGui import QFont
+from PyQt6.QtCore import Qt, QTimer
+
+import assets
+
+# Set AV_PIPELINE_TIMINGS=1 to print cold start and page switch latency
+SHOW_TIMINGS = bool(os.environ.get("AV_PIPELINE_TIMINGS"))
+
+
+def report_timing(label, started):
+    """Print how long ago started was, once the event loop has painted the new window."""
+    if SHOW_TIMINGS:
+        QTimer.singleShot(0, lambda: print(f"{label}: {(time.perf_counter() - started) * 1000:.1f} ms"))
 
 class HomePage(QMainWindow):
     def __init__(self):
         super().__init__()
 
+        # Pages are imported and built on first use, then reused
+        self.vm_window = None
+        self.av_window = None
+        self.scans_window = None
+
         # Window settings
         self.setWindowTitle("AV Pipeline")
         self.setFixedSize(600, 400)
@@ -69,7 +88,7 @@ class HomePage(QMainWindow):
 
         # Create the icon label
         icon_label = QLabel()
-        icon_label.setPixmap(QIcon(icon_path).pixmap(QSize(60, 60)))  # Adjust the icon size to fit better
+        icon_label.setPixmap(assets.pixmap(icon_path, 60, 60))  # Adjust the icon size to fit better
         icon_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         icon_label.setStyleSheet("background-color: #0056b3;")  # Icon caption background to blue
 
@@ -95,21 +114,33 @@ class HomePage(QMainWindow):
 
     def open_vm_page(self):
         """Opens the Virtual Machines page."""
-        self.vm_window = VMWindow(self)
+        started = time.perf_counter()
+        if self.vm_window is None:
+            from virtual_machines import VMWindow
+            self.vm_window = VMWindow(self)
         self.vm_window.show()
         self.hide()
+        report_timing("Virtual Machines page", started)
 
     def open_av_page(self):
         """Opens the Antivirus page."""
-        self.av_window = AVWindow(self)
+        started = time.perf_counter()
+        if self.av_window is None:
+            from anti_virus import AVWindow
+            self.av_window = AVWindow(self)
         self.av_window.show()
         self.hide()
+        report_timing("Antivirus page", started)
 
     def open_scans_page(self):
         """Opens the Scan page."""
-        self.scans_window = ScanWindow(self)
+        started = time.perf_counter()
+        if self.scans_window is None:
+            from scans import ScanWindow
+            self.scans_window = ScanWindow(self)
         self.scans_window.show()
         self.hide()
+        report_timing("Scan page", started)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -117,4 +148,5 @@ if __name__ == '__main__':
     app.setFont(app_font)
     home_page = HomePage()
     home_page.show()
+    report_timing("Cold start", STARTED)
     sys.exit(app.exec())
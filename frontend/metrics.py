@@ -0,0 +1,224 @@
+import bisect
+import os
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+# Set to a .prom path to export metrics for node_exporter's textfile collector
+METRICS_FILE_VARIABLE = "AV_PIPELINE_METRICS_FILE"
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class _Histogram:
+    """Cumulative-bucket latency histogram for one label set."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, fraction):
+        """Return the upper bound of the bucket holding the given fraction of observations."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Counters, latency histograms and gauges for the scan pipeline's stages.
+
+    While disabled, clock() returns 0 and every recording call returns at
+    once, so instrumented code pays about one attribute check per call.
+    Gauges are read from callbacks only when metrics are rendered.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def clock(self):
+        """Return a start time for observe(), or 0 while disabled."""
+        return time.perf_counter() if self.enabled else 0
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, started, **labels):
+        """Record the time since started (from clock()) in the histogram called name."""
+        if not self.enabled or not started:
+            return
+        self.record(name, time.perf_counter() - started, **labels)
+
+    def record(self, name, seconds, **labels):
+        """Record an already measured duration in the histogram called name."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(seconds)
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def add_gauge(self, name, read):
+        """Register read() -> {label tuple: value}; values from several sources are summed."""
+        with self._lock:
+            self._gauges.setdefault(name, []).append(read)
+
+    def remove_gauge(self, name, read):
+        with self._lock:
+            sources = self._gauges.get(name, [])
+            if read in sources:
+                sources.remove(read)
+
+    def snapshot(self):
+        """Return (counters, histograms, gauges), each keyed by (name, labels)."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h.buckets), h.count, h.sum, h.quantile(0.5), h.quantile(0.99))
+                          for key, h in self._histograms.items()}
+            gauge_sources = {name: list(sources) for name, sources in self._gauges.items()}
+        gauges = {}
+        for name, sources in gauge_sources.items():
+            for read in sources:
+                for labels, value in read().items():
+                    key = (name, labels)
+                    gauges[key] = gauges.get(key, 0) + value
+        return counters, histograms, gauges
+
+    def render_prometheus(self):
+        """Return every metric in the Prometheus text exposition format."""
+        counters, histograms, gauges = self.snapshot()
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), (buckets, count, total, _, _) in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {total}")
+            lines.append(f"{name}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def render_summary(self):
+        """Return a short human-readable summary for the metrics panel."""
+        counters, histograms, gauges = self.snapshot()
+        lines = []
+        for (name, labels), (_, count, total, p50, p99) in sorted(histograms.items()):
+            label = ",".join(str(value) for _, value in labels)
+            lines.append(f"{name}[{label}]: n={count} p50<={p50 * 1000:g}ms p99<={p99 * 1000:g}ms "
+                         f"total={total:.2f}s")
+        for (name, labels), value in sorted(counters.items()):
+            label = ",".join(str(value) for _, value in labels)
+            lines.append(f"{name}[{label}]: {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            label = ",".join(str(value) for _, value in labels)
+            lines.append(f"{name}[{label}]: {value}")
+        return "\n".join(lines) if lines else "No metrics recorded yet"
+
+
+class PrometheusTextfileWriter:
+    """Writes the metrics to a .prom file for node_exporter's textfile collector every interval seconds.
+
+    The file is replaced atomically so the collector never reads half of it.
+    """
+
+    def __init__(self, registry, path, interval=15.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.write()
+
+    def write(self):
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(self.registry.render_prometheus())
+        os.replace(temporary, self.path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass  # Try again next interval
+
+
+def start_textfile_writer(path=None, interval=15.0):
+    """Enable the shared registry and start exporting it to path (default: $AV_PIPELINE_METRICS_FILE).
+
+    Returns the running writer, or None when no path is configured.
+    """
+    path = path or os.environ.get(METRICS_FILE_VARIABLE)
+    if not path:
+        return None
+    metrics.enabled = True
+    writer = PrometheusTextfileWriter(metrics, path, interval)
+    writer.start()
+    return writer
+
+# Registry shared by every pipeline in the process
+metrics = Metrics(enabled=bool(os.environ.get(METRICS_FILE_VARIABLE)))
+metrics.describe("av_stage_seconds", "Time spent per item in each scan pipeline stage.")
+metrics.describe("av_engine_batch_seconds", "Round trip time of one batch submitted to an engine.")
+metrics.describe("av_engine_lane_errors_total", "Engine batches or verdict callbacks that raised.")
+metrics.describe("av_files_walked_total", "Files found by the directory walker.")
+metrics.describe("av_files_not_scanned_total", "Files a pre-filter rule kept from every engine unscanned.")
+metrics.describe("av_bytes_hashed_total", "Bytes read and hashed.")
+metrics.describe("av_cache_lookups_total", "Verdict cache lookups, one per file and engine.")
+metrics.describe("av_cache_hits_total", "Verdict cache lookups that found a verdict.")
+metrics.describe("av_verdicts_total", "Verdicts produced, by engine and verdict.")
+metrics.describe("av_engine_queue_depth", "Files waiting in each engine's dispatch queue.")
+metrics.describe("av_engine_in_flight", "Files currently submitted to each engine.")
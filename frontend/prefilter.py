@@ -0,0 +1,212 @@
+import argparse
+import bisect
+import mmap
+import os
+import threading
+from collections import namedtuple
+
+from engines import CLEAN, ERROR, SKIPPED
+from metrics import metrics
+from scan_engine import DATA_DIR
+
+# Sorted SHA-256 digests of files known to be clean, 32 raw bytes each
+DEFAULT_KNOWN_CLEAN_PATH = os.path.join(DATA_DIR, "known_clean.sha256")
+
+DIGEST_SIZE = 32
+
+# Bytes read from the start of a file to sniff its type
+SNIFF_SIZE = 16
+
+# (offset, magic bytes, file type), checked in order
+MAGIC_NUMBERS = [
+    (0, b"MZ", "pe"),
+    (0, b"\x7fELF", "elf"),
+    (0, b"\xcf\xfa\xed\xfe", "macho"),
+    (0, b"\xca\xfe\xba\xbe", "macho"),
+    (0, b"PK\x03\x04", "zip"),
+    (0, b"\x1f\x8b", "gzip"),
+    (0, b"%PDF", "pdf"),
+    (0, b"\xd0\xcf\x11\xe0", "ole"),
+    (0, b"#!", "script"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"GIF8", "gif"),
+    (0, b"ID3", "mp3"),
+    (0, b"fLaC", "flac"),
+    (0, b"OggS", "ogg"),
+    (4, b"ftyp", "mp4"),
+    (8, b"WAVE", "wav"),
+    (8, b"WEBP", "webp"),
+]
+
+# Formats that carry no executable content an engine would look for
+MEDIA_TYPES = frozenset({"png", "jpeg", "gif", "mp3", "flac", "ogg", "mp4", "wav", "webp"})
+
+# A rule settles matching files with verdict for every engine; types None matches any type.
+# A rule with verdict ERROR marks files the engines were never given: they are reported as not
+# scanned and never counted as a saving.
+PolicyRule = namedtuple("PolicyRule", "name verdict types min_size max_size")
+
+DEFAULT_RULES = [
+    PolicyRule("empty-file", CLEAN, None, 0, 0),
+    PolicyRule("oversize", ERROR, None, 4 * 1024 ** 3, None),
+]
+
+# Opt-in only: magic bytes are chosen by whoever made the file, so a polyglot that starts like an
+# image would otherwise reach no engine at all
+INERT_MEDIA_RULE = PolicyRule("inert-media", SKIPPED, MEDIA_TYPES, 0, 512 * 1024 ** 2)
+
+
+def sniff_type(head):
+    """Return the file type named by the magic bytes at the start of head, or "unknown"."""
+    for offset, magic, file_type in MAGIC_NUMBERS:
+        if head.startswith(magic, offset):
+            return file_type
+    return "unknown"
+
+
+def read_head(path, size=SNIFF_SIZE):
+    """Return the first size bytes of path, or b"" if it can't be read."""
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return b""
+    try:
+        return os.pread(descriptor, size, 0)
+    except OSError:
+        return b""
+    finally:
+        os.close(descriptor)
+
+
+class KnownCleanSet:
+    """Membership test against a sorted file of raw SHA-256 digests, binary searched through mmap.
+
+    Opening costs one mmap call whatever the size of the set, and lookups
+    touch about log2(n) pages that the kernel shares with other processes,
+    so tens of millions of digests take no Python heap. An exact sorted array
+    is used rather than a Bloom filter because a false positive here would
+    let an unknown file skip every engine.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size % DIGEST_SIZE:
+            self._file.close()
+            raise ValueError(f"{path} is not a whole number of {DIGEST_SIZE}-byte digests")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._count = size // DIGEST_SIZE
+
+    @classmethod
+    def open_default(cls, path=DEFAULT_KNOWN_CLEAN_PATH):
+        """Return the set at path, or None if none has been built."""
+        return cls(path) if os.path.exists(path) else None
+
+    @staticmethod
+    def build(path, hex_digests):
+        """Write the digests to path as a sorted, de-duplicated set; returns the number written.
+
+        The file is written next to path and renamed over it, so scans that
+        have the old set open keep a consistent view.
+        """
+        digests = sorted({bytes.fromhex(digest.strip()) for digest in hex_digests if digest.strip()})
+        temporary = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(temporary, "wb") as file:
+            for digest in digests:
+                if len(digest) != DIGEST_SIZE:
+                    raise ValueError(f"not a SHA-256 digest: {digest.hex()}")
+                file.write(digest)
+        os.replace(temporary, path)
+        return len(digests)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, position):
+        start = position * DIGEST_SIZE
+        return self._map[start:start + DIGEST_SIZE]
+
+    def __contains__(self, hex_digest):
+        if not self._count:
+            return False
+        digest = bytes.fromhex(hex_digest)
+        position = bisect.bisect_left(self, digest, 0, self._count)
+        return position < self._count and self[position] == digest
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class PreFilter:
+    """Settles files before they reach any engine, from policy rules and a known-clean digest set.
+
+    match_rule() runs before hashing and sniffs the first bytes of a file only
+    when a type rule could apply at its size; is_known_clean() runs once the
+    digest is known. Every file settled as CLEAN or SKIPPED saves one
+    submission per engine, and saved() reports those savings per rule.
+    """
+
+    def __init__(self, rules=None, known_clean=None):
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.known_clean = known_clean
+        self._lock = threading.Lock()
+        self._saved = {}
+
+    def match_rule(self, path, size, head=None):
+        """Return the first PolicyRule matching the file, or None; head is its content when already in memory."""
+        file_type = None
+        for rule in self.rules:
+            if size < rule.min_size or (rule.max_size is not None and size > rule.max_size):
+                continue
+            if rule.types is None:
+                return rule
+            if file_type is None:
+                file_type = sniff_type(read_head(path) if head is None else head)
+            if file_type in rule.types:
+                return rule
+        return None
+
+    def is_known_clean(self, digest):
+        return self.known_clean is not None and digest is not None and digest in self.known_clean
+
+    def record(self, rule_name, submissions):
+        """Count submissions saved by rule_name."""
+        with self._lock:
+            self._saved[rule_name] = self._saved.get(rule_name, 0) + submissions
+        metrics.inc("av_prefilter_saved_total", submissions, rule=rule_name)
+
+    def saved(self):
+        """Return {rule name: engine submissions saved}."""
+        with self._lock:
+            return dict(self._saved)
+
+    def close(self):
+        if self.known_clean is not None:
+            self.known_clean.close()
+
+
+def create_prefilter(known_clean_path=DEFAULT_KNOWN_CLEAN_PATH, skip_media=False):
+    """Return a PreFilter with the default rules and the known-clean set at known_clean_path, if any.
+
+    With skip_media, files whose magic bytes name an image, audio or video format are not scanned either.
+    """
+    rules = DEFAULT_RULES + [INERT_MEDIA_RULE] if skip_media else None
+    return PreFilter(rules, known_clean=KnownCleanSet.open_default(known_clean_path))
+
+
+metrics.describe("av_prefilter_saved_total", "Engine submissions avoided by each pre-filter rule.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the known-clean digest set from SHA-256 hex digests.")
+    parser.add_argument("digests", help="text file with one hex digest per line")
+    parser.add_argument("--output", default=DEFAULT_KNOWN_CLEAN_PATH)
+    args = parser.parse_args()
+    with open(args.digests, encoding="ascii") as lines:
+        count = KnownCleanSet.build(args.output, lines)
+    print(f"{count} digests written to {args.output}")
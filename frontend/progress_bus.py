@@ -0,0 +1,67 @@
+import threading
+
+
+class ProgressCounter:
+    """A done/total pair that many threads can add to without sharing a lock.
+
+    Every thread adds into its own cell, so writers never contend; readers sum
+    the cells, which may lag a concurrent add by one update but never loses it.
+    """
+
+    def __init__(self):
+        self._cells = []
+        self._local = threading.local()
+
+    def add(self, done=0, total=0):
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = self._local.cell = [0, 0]
+            self._cells.append(cell)  # list.append is atomic, so no lock is needed
+        cell[0] += done
+        cell[1] += total
+
+    def snapshot(self):
+        """Return (done, total) summed over every thread."""
+        done = total = 0
+        for cell in list(self._cells):
+            done += cell[0]
+            total += cell[1]
+        return done, total
+
+    @property
+    def done(self):
+        return self.snapshot()[0]
+
+    @property
+    def total(self):
+        return self.snapshot()[1]
+
+    def reset(self):
+        """Start counting from zero again; only call while no thread is adding."""
+        self._cells = []
+        self._local = threading.local()
+
+
+class ProgressBus:
+    """Process-wide registry of named ProgressCounters that workers post to and the GUI reads."""
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name):
+        """Return the counter called name, creating it on first use."""
+        with self._lock:
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = ProgressCounter()
+            return counter
+
+    def snapshot(self):
+        """Return {name: (done, total)} for every counter."""
+        with self._lock:
+            counters = list(self._counters.items())
+        return {name: counter.snapshot() for name, counter in counters}
+
+
+progress_bus = ProgressBus()
@@ -0,0 +1,65 @@
+from PyQt6.QtCore import QObject, QTimer
+
+# How often bound progress bars are refreshed
+FRAMES_PER_SECOND = 30
+
+
+class ProgressPump(QObject):
+    """Refreshes bound QProgressBars from progress counters at a fixed frame rate.
+
+    Each binding has a read() callable returning (value, maximum, text); text
+    may be None to keep the bar's format. A bar is only touched when that
+    tuple changes, so idle bars are never repainted, and the timer only runs
+    while something is bound.
+    """
+
+    def __init__(self, fps=FRAMES_PER_SECOND):
+        super().__init__()
+        self._bindings = {}
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(1000 / fps))
+        self._timer.timeout.connect(self.refresh)
+
+    def bind(self, bar, read):
+        self._bindings[bar] = [read, None]
+        bar.destroyed.connect(lambda *_: self.unbind(bar))
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def bind_counter(self, bar, counter):
+        """Show counter's done out of its total on bar."""
+        def read():
+            done, total = counter.snapshot()
+            return done, max(total, 1), None
+        self.bind(bar, read)
+
+    def unbind(self, bar):
+        self._bindings.pop(bar, None)
+        if not self._bindings:
+            self._timer.stop()
+
+    def refresh(self):
+        """Pull one snapshot per binding and repaint only the bars whose numbers changed."""
+        for bar, binding in list(self._bindings.items()):
+            read, last = binding
+            current = read()
+            if current == last:
+                continue
+            binding[1] = current
+            value, maximum, text = current
+            if bar.maximum() != maximum:
+                bar.setMaximum(maximum)
+            bar.setValue(min(value, maximum))
+            if text is not None:
+                bar.setFormat(text)
+
+
+_shared_pump = None
+
+
+def shared_pump():
+    """Return the pump shared by every window; needs a QApplication."""
+    global _shared_pump
+    if _shared_pump is None:
+        _shared_pump = ProgressPump()
+    return _shared_pump
@@ -0,0 +1,266 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from archives import outer_path
+from hashing import hash_file
+from scan_engine import DATA_DIR
+
+DEFAULT_QUARANTINE_DIR = os.path.join(DATA_DIR, "quarantine")
+
+COPY_CHUNK_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+# Object file suffixes: moved in by rename and not compressed yet, or compressed
+RAW = ".raw"
+COMPRESSED = ".z"
+
+# One quarantined file: where it came from, which engines flagged it and the object holding its content
+QuarantineEntry = namedtuple("QuarantineEntry", "entry_id digest original_path engines quarantined_at size")
+
+
+class QuarantineStore:
+    """Content-addressed store for detected files, each content kept once and compressed.
+
+    Files are moved out of the scanned folder into objects named by their
+    SHA-256 digest. A file on the same filesystem as the store is renamed in,
+    so it leaves the folder atomically without being copied, and is then
+    compressed in the store; a file on another filesystem is compressed while
+    it is copied. A file whose content is already stored is just unlinked.
+    Original paths, flagging engines and times live in a SQLite index, with
+    one row per quarantined path pointing at the shared object.
+
+    Objects are written without any permission bits beyond owner read, so
+    nothing in the store can be executed in place. Each entry keeps the
+    permission bits its file had, and a restored file gets them back.
+    """
+
+    def __init__(self, directory=DEFAULT_QUARANTINE_DIR, max_workers=None):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.max_workers = max_workers or min(16, (os.cpu_count() or 1) * 2)
+        self._device = os.stat(self.objects_dir).st_dev
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "stored_size INTEGER NOT NULL, compressed INTEGER NOT NULL, created REAL NOT NULL) WITHOUT ROWID")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (entry_id INTEGER PRIMARY KEY, digest TEXT NOT NULL, "
+            "original_path TEXT NOT NULL, engines TEXT NOT NULL, quarantined_at REAL NOT NULL, mode INTEGER)")
+        if "mode" not in [row[1] for row in self._connection.execute("PRAGMA table_info(entries)")]:
+            # Stores made before modes were kept; their entries are restored owner-only
+            self._connection.execute("ALTER TABLE entries ADD COLUMN mode INTEGER")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+        self._connection.commit()
+
+    def object_path(self, digest, suffix=COMPRESSED):
+        return os.path.join(self.objects_dir, digest[:2], digest + suffix)
+
+    def quarantine_many(self, detections):
+        """Quarantine every file in detections, an iterable of (path, engine name) pairs.
+
+        Archive members are quarantined as their outermost archive. Returns
+        (entries added, paths that could not be moved). The work runs on a
+        thread pool and the index is updated in one transaction at the end.
+        """
+        engines_by_path = {}
+        for path, engine in detections:
+            engines_by_path.setdefault(outer_path(path), set()).add(engine)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="quarantine") as pool:
+            # Hash everything first so each content is moved in once and its duplicates just unlinked
+            paths_by_digest = {}
+            for path, digest in zip(engines_by_path, pool.map(hash_file, engines_by_path)):
+                paths_by_digest.setdefault(digest, []).append(path)
+            failed = paths_by_digest.pop(None, [])
+            with self._lock:
+                stored = {row[0] for row in self._connection.execute("SELECT digest FROM objects")}
+            moved = list(pool.map(lambda item: self._move_in(item[0], item[1], item[0] in stored),
+                                  paths_by_digest.items()))
+
+        now = time.time()
+        objects = []
+        entries = []
+        for digest, size, stored_size, new_object, removed in moved:
+            if new_object:
+                objects.append((digest, size, stored_size, 1, now))
+            for path in paths_by_digest[digest]:
+                if path in removed:
+                    entries.append((digest, path, ",".join(sorted(engines_by_path[path])), now, removed[path]))
+                else:
+                    failed.append(path)
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO objects VALUES (?, ?, ?, ?, ?)", objects)
+            self._connection.executemany(
+                "INSERT INTO entries (digest, original_path, engines, quarantined_at, mode) VALUES (?, ?, ?, ?, ?)",
+                entries)
+        return len(entries), failed
+
+    def _move_in(self, digest, paths, already_stored):
+        """Store the content shared by paths once and remove every path.
+
+        Returns (digest, size, stored size, new object, {path removed: its
+        permission bits}). Duplicates are only unlinked once the content is
+        safely in the store.
+        """
+        removed = {}
+        size = stored_size = 0
+        new_object = False
+        pending = list(paths)
+        if not already_stored:
+            target = self.object_path(digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            while pending and not new_object:
+                path = pending.pop(0)
+                try:
+                    stat = os.stat(path)
+                    size = stat.st_size
+                    if stat.st_dev == self._device:
+                        stored_size = self._rename_in(path, digest, target)
+                    else:
+                        stored_size = self._compress(path, target)
+                        os.unlink(path)
+                except OSError:
+                    continue
+                new_object = True
+                removed[path] = stat.st_mode & 0o777
+            if not new_object:
+                return digest, 0, 0, False, removed
+        for path in pending:
+            try:
+                mode = os.stat(path).st_mode & 0o777
+                os.unlink(path)
+            except OSError:
+                continue
+            removed[path] = mode
+        return digest, size, stored_size, new_object, removed
+
+    def _rename_in(self, path, digest, target):
+        """Rename path into the store, then compress it there; on failure the file is put back."""
+        raw = self.object_path(digest, RAW)
+        os.rename(path, raw)
+        try:
+            stored_size = self._compress(raw, target)
+        except OSError:
+            os.rename(raw, path)
+            raise
+        os.unlink(raw)
+        return stored_size
+
+    @staticmethod
+    def _compress(source, target):
+        """Write a zlib-compressed copy of source to target through a temporary file; returns its size."""
+        compressor = zlib.compressobj(COMPRESSION_LEVEL)
+        temporary = f"{target}.{threading.get_ident()}.tmp"
+        with open(source, "rb") as reader, open(temporary, "wb") as writer:
+            while chunk := reader.read(COPY_CHUNK_SIZE):
+                writer.write(compressor.compress(chunk))
+            writer.write(compressor.flush())
+            size = writer.tell()
+        os.chmod(temporary, 0o400)
+        os.replace(temporary, target)
+        return size
+
+    def entries(self, limit=1000, offset=0):
+        """Return quarantined files, newest first."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT entry_id, entries.digest, original_path, engines, quarantined_at, size FROM entries "
+                "JOIN objects ON objects.digest = entries.digest ORDER BY entry_id DESC LIMIT ? OFFSET ?",
+                (limit, offset)).fetchall()
+        return [QuarantineEntry(*row) for row in rows]
+
+    def stats(self):
+        """Return (entries, distinct objects, original bytes, stored bytes)."""
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            objects, size, stored = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM objects").fetchone()
+        return entries, objects, size, stored
+
+    def restore(self, entry_ids, destination=None, batch_size=1000):
+        """Put quarantined files back, batch_size entries per index transaction.
+
+        Files go to their original paths, or into destination under their base
+        names. An existing file is never overwritten. Objects no entry refers
+        to any more are deleted. Yields (entry_id, restored path or None) as
+        each batch finishes.
+        """
+        entry_ids = list(entry_ids)
+        for start in range(0, len(entry_ids), batch_size):
+            batch = entry_ids[start:start + batch_size]
+            marks = ", ".join("?" * len(batch))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT entry_id, digest, original_path, mode FROM entries WHERE entry_id IN ({marks})",
+                    batch).fetchall()
+            # Entries that would land on the same path are restored one per batch; the others stay quarantined
+            claimed = set()
+            targets = []
+            for row in rows:
+                target = self._restore_target(row[2], destination)
+                targets.append(None if target in claimed else target)
+                claimed.add(target)
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="restore") as pool:
+                restored = list(pool.map(lambda row, target: target and self._restore_one(row[1], target, row[3]),
+                                         rows, targets))
+
+            done = [(row[0],) for row, path in zip(rows, restored) if path is not None]
+            digests = {row[1] for row, path in zip(rows, restored) if path is not None}
+            with self._lock, self._connection:
+                self._connection.executemany("DELETE FROM entries WHERE entry_id = ?", done)
+                orphans = [digest for digest in digests if self._connection.execute(
+                    "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None]
+                self._connection.executemany("DELETE FROM objects WHERE digest = ?", [(d,) for d in orphans])
+            for digest in orphans:
+                try:
+                    os.unlink(self.object_path(digest))
+                except OSError:
+                    pass
+            for row, path in zip(rows, restored):
+                yield row[0], path
+
+    @staticmethod
+    def _restore_target(original_path, destination):
+        return original_path if destination is None else os.path.join(destination, os.path.basename(original_path))
+
+    def _restore_one(self, digest, target, mode=None):
+        """Write the object to target unless something is there already; returns target, or None if not written.
+
+        The file gets the permission bits in mode; without them it stays owner-only, as mkstemp made it.
+        """
+        temporary = None
+        decompressor = zlib.decompressobj()
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            handle, temporary = tempfile.mkstemp(prefix=".restoring-", dir=os.path.dirname(target))
+            with open(self.object_path(digest), "rb") as reader, os.fdopen(handle, "wb") as writer:
+                while chunk := reader.read(COPY_CHUNK_SIZE):
+                    writer.write(decompressor.decompress(chunk))
+                writer.write(decompressor.flush())
+            if mode is not None:
+                os.chmod(temporary, mode)
+            # Linking fails if target exists, so a file that appeared meanwhile is never overwritten
+            os.link(temporary, target)
+        except (OSError, zlib.error):
+            return None
+        finally:
+            if temporary is not None:
+                try:
+                    os.unlink(temporary)
+                except OSError:
+                    pass
+        return target
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
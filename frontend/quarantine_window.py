@@ -0,0 +1,157 @@
+import time
+from collections import namedtuple
+
+from PyQt6.QtWidgets import QDialog, QLabel, QPushButton, QHBoxLayout, QVBoxLayout, QTableWidget, \
+    QTableWidgetItem, QHeaderView, QAbstractItemView
+from PyQt6.QtGui import QFont
+from PyQt6.QtCore import Qt, QObject, QThread, pyqtSignal
+
+from quarantine import QuarantineStore
+
+# Newest entries shown in the table; the rest are counted in the summary
+VISIBLE_ENTRIES = 1000
+
+# What a QuarantineTask reports in place of a result when its call raised
+TaskError = namedtuple("TaskError", "message")
+
+
+class QuarantineTask(QObject):
+    """Runs one quarantine or restore call on a background thread.
+
+    finished is always emitted, with a TaskError if the call raised.
+    """
+    finished = pyqtSignal(object)
+
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function = function
+        self.args = args
+
+    def run(self):
+        result = None
+        try:
+            result = self.function(*self.args)
+        except Exception as error:
+            result = TaskError(str(error) or type(error).__name__)
+        finally:
+            self.finished.emit(result)
+
+
+class QuarantineWindow(QDialog):
+    """Lists quarantined files and moves detections in and restores entries out of the store."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Infected Folder")
+        self.resize(800, 500)
+        self.store = QuarantineStore()
+        self.detections = []
+        self.task_thread = None
+        self.task = None
+        self.on_task_finished = None
+
+        layout = QVBoxLayout(self)
+        header = QLabel("QUARANTINE")
+        header.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        header.setFont(QFont("Palatino Linotype", 16, QFont.Weight.Bold))
+        header.setStyleSheet("color: #1565C0;")
+        layout.addWidget(header)
+
+        self.summary_label = QLabel()
+        self.summary_label.setFont(QFont("Palatino Linotype", 10))
+        layout.addWidget(self.summary_label)
+
+        self.table = QTableWidget(0, 4)
+        self.table.setHorizontalHeaderLabels(["Original path", "Engines", "Quarantined", "Size"])
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        self.table.setStyleSheet("background-color: white; font-size: 12px;")
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        self.quarantine_button = QPushButton("Quarantine detections")
+        self.quarantine_button.clicked.connect(self.quarantine_detections)
+        self.restore_button = QPushButton("Restore selected")
+        self.restore_button.clicked.connect(self.restore_selected)
+        for button in (self.quarantine_button, self.restore_button):
+            button.setStyleSheet("background-color: #1565C0; color: white; font-size: 12px; padding: 5px;")
+            button_layout.addWidget(button)
+        layout.addLayout(button_layout)
+
+    def show_detections(self, detections):
+        """Offer detections, a list of (path, engine) pairs, for quarantine and show the store."""
+        self.detections = list(detections)
+        self.refresh()
+        self.show()
+        self.raise_()
+
+    def refresh(self):
+        entries, objects, size, stored = self.store.stats()
+        self.summary_label.setText(
+            f"{entries} quarantined files | {objects} distinct contents | "
+            f"{size / 1e6:.1f} MB stored in {stored / 1e6:.1f} MB")
+        self.quarantine_button.setText(f"Quarantine detections ({len({path for path, _ in self.detections})})")
+        self.quarantine_button.setEnabled(bool(self.detections) and self.task_thread is None)
+        self.restore_button.setEnabled(self.task_thread is None)
+
+        rows = self.store.entries(limit=VISIBLE_ENTRIES)
+        self.table.setRowCount(len(rows))
+        for row, entry in enumerate(rows):
+            path_item = QTableWidgetItem(entry.original_path)
+            path_item.setData(Qt.ItemDataRole.UserRole, entry.entry_id)
+            self.table.setItem(row, 0, path_item)
+            self.table.setItem(row, 1, QTableWidgetItem(entry.engines))
+            self.table.setItem(row, 2, QTableWidgetItem(time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.quarantined_at))))
+            self.table.setItem(row, 3, QTableWidgetItem(str(entry.size)))
+
+    def quarantine_detections(self):
+        detections, self.detections = self.detections, []
+        self.summary_label.setText("Quarantining ...")
+        self.run_task(self.quarantine_finished, self.store.quarantine_many, detections)
+
+    def quarantine_finished(self, result):
+        added, failed = result
+        self.refresh()
+        if failed:
+            self.summary_label.setText(self.summary_label.text() + f" | {len(failed)} files could not be moved")
+
+    def restore_selected(self):
+        rows = {index.row() for index in self.table.selectionModel().selectedRows()}
+        entry_ids = [self.table.item(row, 0).data(Qt.ItemDataRole.UserRole) for row in sorted(rows)]
+        if not entry_ids:
+            return
+        self.summary_label.setText("Restoring ...")
+        self.run_task(self.restore_finished, lambda ids: list(self.store.restore(ids)), entry_ids)
+
+    def restore_finished(self, results):
+        skipped = sum(1 for _, path in results if path is None)
+        self.refresh()
+        if skipped:
+            self.summary_label.setText(self.summary_label.text() + f" | {skipped} files not restored (path in use)")
+
+    def run_task(self, on_finished, function, *args):
+        self.task_thread = QThread(self)
+        self.task = QuarantineTask(function, *args)
+        self.on_task_finished = on_finished
+        self.task.moveToThread(self.task_thread)
+        self.task_thread.started.connect(self.task.run)
+        self.task.finished.connect(self.task_finished)
+        self.task.finished.connect(self.task_thread.quit)
+        self.task.finished.connect(self.task.deleteLater)
+        self.task_thread.finished.connect(self.task_thread.deleteLater)
+        self.quarantine_button.setEnabled(False)
+        self.restore_button.setEnabled(False)
+        self.task_thread.start()
+
+    def task_finished(self, result):
+        self.task_thread = None
+        self.task = None
+        on_finished, self.on_task_finished = self.on_task_finished, None
+        if isinstance(result, TaskError):
+            self.refresh()
+            self.summary_label.setText(self.summary_label.text() + f" | Failed: {result.message}")
+        else:
+            on_finished(result)
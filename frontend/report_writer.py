@@ -0,0 +1,172 @@
+import csv
+import html
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+from engines import ERROR, INFECTED
+from scan_engine import DATA_DIR
+
+DEFAULT_REPORT_DIR = os.path.join(DATA_DIR, "reports")
+
+CSV_FIELDS = ["path", "engine", "verdict", "size", "latency", "cached", "prefilter"]
+
+
+class LatencyHistogram:
+    """Fixed-size log-bucketed histogram for latency percentiles in constant memory.
+
+    Buckets grow by ratio from min_seconds upward, so any percentile is
+    reported within a few percent of its true value.
+    """
+
+    def __init__(self, min_seconds=1e-5, max_seconds=300.0, ratio=1.05):
+        self.min_seconds = min_seconds
+        self.log_ratio = math.log(ratio)
+        self.buckets = [0] * (int(math.log(max_seconds / min_seconds) / self.log_ratio) + 2)
+        self.count = 0
+
+    def add(self, seconds):
+        if seconds <= self.min_seconds:
+            bucket = 0
+        else:
+            bucket = min(int(math.log(seconds / self.min_seconds) / self.log_ratio) + 1, len(self.buckets) - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding the given fraction of samples, in seconds."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return self.min_seconds * math.exp(bucket * self.log_ratio)
+        return self.min_seconds * math.exp((len(self.buckets) - 1) * self.log_ratio)
+
+
+class EngineSummary:
+    """Aggregates for one engine, updated once per verdict."""
+
+    def __init__(self):
+        self.verdicts = 0
+        self.detections = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.prefiltered = 0
+        self.bytes_scanned = 0
+        self.latency = LatencyHistogram()
+
+
+class ReportWriter:
+    """Streams every verdict of a scan to JSONL and CSV as it arrives.
+
+    Summary aggregates are folded in with the same single pass, so memory use
+    does not depend on the number of files. close() renders report.html,
+    streaming detections back out of the JSONL file rather than holding them.
+    add() may be called from any thread.
+    """
+
+    def __init__(self, root, directory=None):
+        self.root = root
+        if directory is None:
+            # A scan and a watch started in the same second still get directories of their own
+            os.makedirs(DEFAULT_REPORT_DIR, exist_ok=True)
+            directory = tempfile.mkdtemp(prefix=time.strftime("%Y%m%d-%H%M%S-"), dir=DEFAULT_REPORT_DIR)
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.jsonl_path = os.path.join(self.directory, "report.jsonl")
+        self.csv_path = os.path.join(self.directory, "report.csv")
+        self.html_path = os.path.join(self.directory, "report.html")
+
+        self.started = time.time()
+        self.engines = {}
+        self._lock = threading.Lock()
+        self._jsonl = open(self.jsonl_path, "w", encoding="utf-8")
+        self._csv_file = open(self.csv_path, "w", encoding="utf-8", newline="")
+        self._csv = csv.writer(self._csv_file)
+        self._csv.writerow(CSV_FIELDS)
+
+    def add(self, record):
+        """Write one VerdictRecord and fold it into the summary."""
+        with self._lock:
+            self._jsonl.write(json.dumps(record._asdict(), ensure_ascii=False) + "\n")
+            self._csv.writerow(record)
+            summary = self.engines.get(record.engine)
+            if summary is None:
+                summary = self.engines[record.engine] = EngineSummary()
+            summary.verdicts += 1
+            if record.verdict == INFECTED:
+                summary.detections += 1
+            elif record.verdict == ERROR:
+                summary.errors += 1
+            if record.prefilter:
+                summary.prefiltered += 1
+            elif record.cached:
+                summary.cache_hits += 1
+            else:
+                summary.bytes_scanned += record.size
+                summary.latency.add(record.latency)
+
+    def summary(self):
+        """Return the aggregates as a dict, one entry per engine."""
+        with self._lock:
+            return {
+                "root": self.root,
+                "started": self.started,
+                "engines": {
+                    name: {
+                        "verdicts": engine.verdicts,
+                        "detections": engine.detections,
+                        "errors": engine.errors,
+                        "cache_hits": engine.cache_hits,
+                        "prefiltered": engine.prefiltered,
+                        "bytes_scanned": engine.bytes_scanned,
+                        "latency_p50": engine.latency.percentile(0.50),
+                        "latency_p90": engine.latency.percentile(0.90),
+                        "latency_p99": engine.latency.percentile(0.99),
+                    }
+                    for name, engine in self.engines.items()
+                },
+            }
+
+    def close(self):
+        """Finish the JSONL and CSV files and render the HTML summary."""
+        with self._lock:
+            self._jsonl.close()
+            self._csv_file.close()
+        summary = self.summary()
+        with open(os.path.join(self.directory, "summary.json"), "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+        self._write_html(summary)
+        return self.html_path
+
+    def _write_html(self, summary):
+        with open(self.html_path, "w", encoding="utf-8") as out:
+            out.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>AV Report</title>"
+                      "<style>body{font-family:sans-serif}table{border-collapse:collapse}"
+                      "td,th{border:1px solid #999;padding:4px 8px}th{background:#1565C0;color:white}</style>"
+                      "</head><body>\n")
+            out.write(f"<h1>AV Report</h1>\n<p>Folder: {html.escape(self.root)}<br>"
+                      f"Started: {time.ctime(self.started)}</p>\n")
+            out.write("<h2>Engines</h2>\n<table><tr><th>Engine</th><th>Verdicts</th><th>Detections</th>"
+                      "<th>Errors</th><th>Cache hits</th><th>Pre-filtered</th><th>Bytes scanned</th>"
+                      "<th>p50 latency (ms)</th><th>p90 latency (ms)</th><th>p99 latency (ms)</th></tr>\n")
+            for name, engine in summary["engines"].items():
+                out.write(f"<tr><td>{html.escape(name)}</td><td>{engine['verdicts']}</td>"
+                          f"<td>{engine['detections']}</td><td>{engine['errors']}</td>"
+                          f"<td>{engine['cache_hits']}</td><td>{engine['prefiltered']}</td><td>{engine['bytes_scanned']}</td>"
+                          f"<td>{engine['latency_p50'] * 1000:.1f}</td><td>{engine['latency_p90'] * 1000:.1f}</td>"
+                          f"<td>{engine['latency_p99'] * 1000:.1f}</td></tr>\n")
+            out.write("</table>\n<h2>Detections</h2>\n<table><tr><th>File</th><th>Engine</th></tr>\n")
+            with open(self.jsonl_path, encoding="utf-8") as records:
+                for line in records:
+                    record = json.loads(line)
+                    if record["verdict"] == INFECTED:
+                        out.write(f"<tr><td>{html.escape(record['path'])}</td>"
+                                  f"<td>{html.escape(record['engine'])}</td></tr>\n")
+            out.write("</table>\n</body></html>\n")
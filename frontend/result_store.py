@@ -0,0 +1,402 @@
+import array
+import heapq
+import itertools
+import mmap
+import os
+import re
+import struct
+import tempfile
+from bisect import bisect_right
+
+COLUMNS = ("path", "engine", "verdict", "latency")
+
+# Rows kept in memory before they are written out as a read-only segment file
+SEGMENT_ROWS = 65536
+
+# Segment file header: magic, rows, directories, directory runs, directory heap and name heap sizes
+_HEADER = struct.Struct("<8s5Q")
+_MAGIC = b"AVRSEG1\0"
+
+# Paths are stored as UTF-8; surrogatepass keeps undecodable file names round-tripping
+_ENCODING = ("utf-8", "surrogatepass")
+
+# Filter results a sealed segment remembers, and how selective one must be to be kept
+_CACHED_QUERIES = 8
+_CACHE_FRACTION = 16
+
+# Sorted queries kept open for paging through them
+_CURSORS = 4
+
+
+def _split(path):
+    """Return (directory including its trailing separator, name)."""
+    cut = max(path.rfind("/"), path.rfind(os.sep)) + 1
+    return path[:cut], path[cut:]
+
+
+class _Segment:
+    """Columns of up to SEGMENT_ROWS rows: the one being filled in memory, or a sealed one mapped from disk.
+
+    A path is kept as the id of its directory, interned per segment, and its
+    name in a heap of NUL-terminated UTF-8 names. Rows of one directory
+    arrive together, so the directory column is also kept as runs, which is
+    what a search that matches a directory walks.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sealed = False
+        self.dir_offsets = array.array("I", [0])
+        self.dir_heap = bytearray()
+        self.row_dir = array.array("I")
+        self.name_offsets = array.array("I", [0])
+        self.names = bytearray()
+        self.engine = bytearray()
+        self.verdict = bytearray()
+        self.latency = array.array("f")
+        self.run_starts = array.array("I")
+        self.run_dirs = array.array("I")
+        self._dir_ids = {}
+        self._map = None
+        self._views = []
+        self._file_path = None
+        # Filter or sort -> rows, and filter -> number of rows, for sealed segments
+        self._queries = {}
+        self._counts = {}
+
+    def append(self, directory, name, engine, verdict, latency):
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self._dir_ids)
+            self.dir_heap += directory.encode(*_ENCODING)
+            self.dir_offsets.append(len(self.dir_heap))
+        if not self.run_dirs or self.run_dirs[-1] != dir_id:
+            self.run_starts.append(self.count)
+            self.run_dirs.append(dir_id)
+        self.row_dir.append(dir_id)
+        self.names += name.encode(*_ENCODING)
+        self.names.append(0)
+        self.name_offsets.append(len(self.names))
+        self.engine.append(engine)
+        self.verdict.append(verdict)
+        self.latency.append(latency)
+        self.count += 1
+
+    def _columns(self):
+        return (self.dir_offsets, self.dir_heap, self.row_dir, self.name_offsets, self.names,
+                self.engine, self.verdict, self.latency, self.run_starts, self.run_dirs)
+
+    def seal(self, file_path):
+        """Write the columns to file_path and continue from a read-only mapping of it."""
+        with open(file_path, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC, self.count, len(self.dir_offsets) - 1, len(self.run_starts),
+                                    len(self.dir_heap), len(self.names)))
+            for column in self._columns():
+                data = memoryview(column).cast("B")
+                file.write(data)
+                file.write(bytes(-len(data) % 8))
+        self._dir_ids = None
+        self._file_path = file_path
+        with open(file_path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        self._views.append(view)
+        _, count, dir_count, run_count, dir_heap_size, names_size = _HEADER.unpack_from(view)
+        position = _HEADER.size
+
+        def take(size, format):
+            nonlocal position
+            part = view[position:position + size].cast(format)
+            self._views.append(part)
+            position += size + (-size % 8)
+            return part
+
+        self.dir_offsets = take(4 * (dir_count + 1), "I")
+        self.dir_heap = take(dir_heap_size, "B")
+        self.row_dir = take(4 * count, "I")
+        self.name_offsets = take(4 * (count + 1), "I")
+        self.names = take(names_size, "B")
+        self.engine = take(count, "B")
+        self.verdict = take(count, "B")
+        self.latency = take(4 * count, "f")
+        self.run_starts = take(4 * run_count, "I")
+        self.run_dirs = take(4 * run_count, "I")
+        self.sealed = True
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file_path is not None:
+            os.unlink(self._file_path)
+            self._file_path = None
+
+    def directory(self, dir_id):
+        return str(self.dir_heap[self.dir_offsets[dir_id]:self.dir_offsets[dir_id + 1]], *_ENCODING)
+
+    def name(self, row):
+        return str(self.names[self.name_offsets[row]:self.name_offsets[row + 1] - 1], *_ENCODING)
+
+    def path(self, row):
+        return self.directory(self.row_dir[row]) + self.name(row)
+
+    def _run_rows(self, dir_ids):
+        """Rows in any of dir_ids, in row order."""
+        for run, dir_id in enumerate(self.run_dirs):
+            if dir_id in dir_ids:
+                end = self.run_starts[run + 1] if run + 1 < len(self.run_starts) else self.count
+                yield from range(self.run_starts[run], end)
+
+    def search(self, text):
+        """Rows whose path contains text (already lower-case), in row order.
+
+        Text inside a directory matches every row of its runs. Otherwise the
+        match either lies inside the name, found with one regular expression
+        pass over the name heap, or text runs from the end of the directory
+        into the start of the name, split at its last separator.
+        """
+        directories = [self.directory(dir_id).lower() for dir_id in range(len(self.dir_offsets) - 1)]
+        rows = set(self._run_rows({dir_id for dir_id, directory in enumerate(directories) if text in directory}))
+        head, tail = _split(text)
+        if head:
+            ends = {dir_id for dir_id, directory in enumerate(directories) if directory.endswith(head)}
+            rows.update(row for row in self._run_rows(ends) if self.name(row).lower().startswith(tail))
+        elif text.isascii():
+            # NUL terminators keep a match from running across two names
+            pattern = re.compile(re.escape(text.encode("ascii")), re.IGNORECASE)
+            rows.update(bisect_right(self.name_offsets, match.start()) - 1 for match in pattern.finditer(self.names))
+        else:
+            rows.update(row for row in range(self.count) if text in self.name(row).lower())
+        return array.array("I", sorted(rows))
+
+    def with_verdict(self, code):
+        pattern = re.compile(re.escape(bytes([code])))
+        return array.array("I", (match.start() for match in pattern.finditer(self.verdict)))
+
+    def matches(self, text, code):
+        """Rows passing a filter, in row order, or None when every row does."""
+        query = (text, code)
+        rows = self._queries.get(query)
+        if rows is not None:
+            return rows
+        if code is None:
+            rows = self.search(text) if text else None
+        elif not text:
+            rows = self.with_verdict(code)
+        else:
+            # Few rows with the verdict, as for infections: test just those, else search and keep the verdict
+            candidates = self.matches("", code)
+            if len(candidates) * 8 < self.count:
+                rows = array.array("I", (row for row in candidates if text in self.path(row).lower()))
+            else:
+                rows = array.array("I", (row for row in self.search(text) if self.verdict[row] == code))
+        self._remember(query, rows)
+        return rows
+
+    def match_count(self, text, code):
+        count = self._counts.get((text, code))
+        if count is None:
+            rows = self.matches(text, code)
+            count = self.count if rows is None else len(rows)
+            if self.sealed:
+                if len(self._counts) >= _CACHED_QUERIES * 8:
+                    self._counts.pop(next(iter(self._counts)))
+                self._counts[(text, code)] = count
+        return count
+
+    def sorted_matches(self, text, code, key, descending, query):
+        """Rows passing a filter ordered by key, ties in row order."""
+        rows = self._queries.get(query)
+        if rows is not None:
+            return rows
+        rows = self.matches(text, code)
+        rows = array.array("I", sorted(range(self.count) if rows is None else rows, key=key, reverse=descending))
+        self._remember(query, rows)
+        return rows
+
+    def _remember(self, query, rows):
+        """Keep rows for a sealed segment if the filter was selective enough to be cheap to hold."""
+        if not self.sealed or rows is None or len(rows) * _CACHE_FRACTION > self.count:
+            return
+        if len(self._queries) >= _CACHED_QUERIES:
+            self._queries.pop(next(iter(self._queries)))
+        self._queries[query] = rows
+
+    def sort_key(self, sort_column, engine_rank, verdict_rank):
+        """Key function over this segment's rows for a COLUMNS position."""
+        if sort_column == 0:
+            return self.path
+        if sort_column == 1:
+            return lambda row: engine_rank[self.engine[row]]
+        if sort_column == 2:
+            return lambda row: verdict_rank[self.verdict[row]]
+        return self.latency.__getitem__
+
+
+class ResultStore:
+    """Per-file, per-engine verdicts of a scan, kept column-wise in compact segments.
+
+    Rows are filled into an in-memory segment of typed arrays and, every
+    segment_rows rows, written to a segment file in directory (a private
+    temporary directory by default) that is mapped read-only from then on,
+    so resident memory stays at a few bytes per row whatever the scan size.
+
+    Views never hold the results themselves: they ask for counts and pages
+    with filtering and sorting applied here. Filters restricted to one
+    verdict, like the infected-files view, only look at that verdict's rows,
+    and selective filter results are remembered per segment. Sorted pages are
+    merged from the segments on demand, and paging forward continues the last
+    merge rather than starting over. Path filters are case-insensitive
+    substring matches, the same test matches() applies to rows in Python.
+    """
+
+    def __init__(self, directory=None, segment_rows=SEGMENT_ROWS):
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self.row_count = 0
+        self._temporary = None
+        self._sealed = []
+        self._active = _Segment()
+        self._engines = []
+        self._engine_codes = {}
+        self._verdicts = []
+        self._verdict_codes = {}
+        self._cursors = {}
+
+    def add_many(self, rows):
+        """Append (path, engine, verdict) or (path, engine, verdict, latency) rows."""
+        for row in rows:
+            directory, name = _split(row[0])
+            self._active.append(directory, name, self._code(self._engine_codes, self._engines, row[1]),
+                                self._code(self._verdict_codes, self._verdicts, row[2]),
+                                row[3] if len(row) > 3 else 0.0)
+            if self._active.count >= self.segment_rows:
+                self._seal()
+        self.row_count += len(rows)
+
+    def count(self, filter_text="", verdict=None):
+        text, code = self._filter(filter_text, verdict)
+        if code is False:
+            return 0
+        if not text and code is None:
+            return self.row_count
+        return sum(segment.match_count(text, code) for segment in self._segments())
+
+    def fetch(self, offset, limit, sort_column=None, descending=False, filter_text="", verdict=None):
+        """Return up to limit rows starting at offset, in the requested order."""
+        text, code = self._filter(filter_text, verdict)
+        if code is False or limit <= 0:
+            return []
+        if sort_column is not None:
+            return self._fetch_sorted(offset, limit, sort_column, descending, text, code)
+        if not descending:
+            return self._fetch_in_order(offset, limit, text, code)
+        total = self.count(filter_text, verdict)
+        start = max(0, total - offset - limit)
+        return self._fetch_in_order(start, total - offset - start, text, code)[::-1]
+
+    def clear(self):
+        for segment in self._sealed:
+            segment.close()
+        self._sealed = []
+        self._active = _Segment()
+        self._cursors.clear()
+        self.row_count = 0
+
+    def close(self):
+        self.clear()
+        if self._temporary is not None:
+            self._temporary.cleanup()
+            self._temporary = None
+            self.directory = None
+
+    @staticmethod
+    def matches(row, filter_text="", verdict=None):
+        """Return True if row passes the same filter count() and fetch() apply."""
+        if verdict is not None and row[2] != verdict:
+            return False
+        return not filter_text or filter_text.lower() in row[0].lower()
+
+    @staticmethod
+    def _code(codes, names, name):
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+
+    def _filter(self, filter_text, verdict):
+        """Return (lower-case text, verdict code); the code is False for a verdict never stored."""
+        if verdict is None:
+            return filter_text.lower(), None
+        return filter_text.lower(), self._verdict_codes.get(verdict, False)
+
+    def _seal(self):
+        if self.directory is None:
+            self._temporary = tempfile.TemporaryDirectory(prefix="av-results-")
+            self.directory = self._temporary.name
+        os.makedirs(self.directory, exist_ok=True)
+        self._active.seal(os.path.join(self.directory, f"{id(self):x}-{len(self._sealed):06d}.segment"))
+        self._sealed.append(self._active)
+        self._active = _Segment()
+
+    def _segments(self):
+        return self._sealed + [self._active] if self._active.count else self._sealed
+
+    def _row(self, segment, row):
+        return (segment.path(row), self._engines[segment.engine[row]], self._verdicts[segment.verdict[row]],
+                segment.latency[row])
+
+    def _fetch_in_order(self, offset, limit, text, code):
+        rows = []
+        for segment in self._segments():
+            size = segment.match_count(text, code)
+            if offset >= size:
+                offset -= size
+                continue
+            matches = segment.matches(text, code)
+            for position in range(offset, min(size, offset + limit - len(rows))):
+                rows.append(self._row(segment, position if matches is None else matches[position]))
+            offset = 0
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def _fetch_sorted(self, offset, limit, sort_column, descending, text, code):
+        query = (text, code, sort_column, descending)
+        cursor = self._cursors.pop(query, None)
+        if cursor is None or cursor[0] != self.row_count or cursor[1] > offset:
+            cursor = [self.row_count, 0, self._merge(query)]
+        elif len(self._cursors) >= _CURSORS:
+            self._cursors.pop(next(iter(self._cursors)))
+        skip = offset - cursor[1]
+        page = list(itertools.islice(cursor[2], skip, skip + limit))
+        cursor[1] = offset + len(page)
+        self._cursors[query] = cursor
+        return [self._row(segment, row) for _, segment, row in page]
+
+    def _merge(self, query):
+        """Iterate (key, segment, row) over every matching row in sorted order."""
+        text, code, sort_column, descending = query
+        engine_rank = self._ranks(self._engines)
+        verdict_rank = self._ranks(self._verdicts)
+        # Rank tables change when a new engine or verdict is stored, so they are part of the cached query
+        segment_query = query + (tuple(engine_rank), tuple(verdict_rank))
+
+        def ordered(segment):
+            key = segment.sort_key(sort_column, engine_rank, verdict_rank)
+            for row in segment.sorted_matches(text, code, key, descending, segment_query):
+                yield key(row), segment, row
+
+        return heapq.merge(*(ordered(segment) for segment in self._segments()),
+                           key=lambda item: item[0], reverse=descending)
+
+    @staticmethod
+    def _ranks(names):
+        ranks = [0] * len(names)
+        for rank, code in enumerate(sorted(range(len(names)), key=names.__getitem__)):
+            ranks[code] = rank
+        return ranks
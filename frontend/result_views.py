@@ -0,0 +1,110 @@
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+from archives import display_path
+from result_store import COLUMNS
+
+HEADERS = {"path": "File", "engine": "Engine", "verdict": "Verdict", "latency": "Latency"}
+
+
+class ResultTableModel(QAbstractTableModel):
+    """Lazily fetched table over a ResultStore.
+
+    Rows are exposed fetch_size at a time through canFetchMore()/fetchMore(),
+    and only the pages the view actually paints are loaded from the store.
+    Sorting and filtering are pushed down to the store.
+    """
+
+    def __init__(self, store, columns=COLUMNS, verdict=None, fetch_size=256, page_size=256, max_pages=8):
+        super().__init__()
+        self.store = store
+        self.columns = list(columns)
+        self.verdict = verdict
+        self.fetch_size = fetch_size
+        self.page_size = page_size
+        self.max_pages = max_pages
+
+        self.filter_text = ""
+        self.sort_column = None
+        self.descending = False
+        self.total = 0
+        self.fetched = 0
+        self._pages = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.fetched
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return HEADERS[self.columns[section]]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role not in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole):
+            return None
+        row = self._row(index.row())
+        if row is None:
+            return None
+        column = self.columns[index.column()]
+        value = row[COLUMNS.index(column)]
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == "path":
+                return display_path(value)  # Archive members read as "archive  ▸  member"
+            if column == "latency":
+                return f"{value * 1000:.1f} ms"
+        return value
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.fetched < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.fetch_size, self.total - self.fetched)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.fetched, self.fetched + count - 1)
+        self.fetched += count
+        self.endInsertRows()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sort_column = COLUMNS.index(self.columns[column]) if column >= 0 else None
+        self.descending = order == Qt.SortOrder.DescendingOrder
+        self.reload()
+
+    def set_filter(self, text):
+        self.filter_text = text
+        self.reload()
+
+    def reload(self):
+        """Recount matching rows in the store and start fetching from the top again."""
+        self.beginResetModel()
+        self._pages.clear()
+        self.total = self.store.count(self.filter_text, self.verdict)
+        self.fetched = min(self.fetch_size, self.total)
+        self.endResetModel()
+
+    def rows_added(self, rows):
+        """Account for rows just added to the store without recounting it."""
+        added = sum(1 for row in rows if self.store.matches(row, self.filter_text, self.verdict))
+        if not added:
+            return
+        self.total += added
+        self._pages.clear()  # New rows may sort into pages already loaded
+        if self.fetched:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.fetched - 1, len(self.columns) - 1))
+        if self.fetched < self.fetch_size:
+            self.fetchMore()
+
+    def _row(self, row):
+        page_number, offset = divmod(row, self.page_size)
+        page = self._pages.get(page_number)
+        if page is None:
+            if len(self._pages) >= self.max_pages:
+                self._pages.pop(next(iter(self._pages)))
+            page = self._pages[page_number] = self.store.fetch(
+                page_number * self.page_size, self.page_size, self.sort_column, self.descending,
+                self.filter_text, self.verdict)
+        return page[offset] if offset < len(page) else None
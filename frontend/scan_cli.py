@@ -0,0 +1,204 @@
+"""Headless scanner: runs the Scan page's pipeline over one or more folders without Qt.
+
+Exit status is 0 when nothing was detected, 1 when any engine flagged a
+file and 2 when a folder could not be scanned or the run was interrupted.
+"""
+import argparse
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from broker import ScanCoordinator
+from consensus import DEFAULT_HISTORY_PATH, EngineHistory, create_policy
+from engines import create_engines
+from file_index import FileIndex
+from metrics import METRICS_FILE_VARIABLE, start_textfile_writer
+from prefilter import DEFAULT_KNOWN_CLEAN_PATH, create_prefilter
+from report_writer import DEFAULT_REPORT_DIR, ReportWriter
+from scan_engine import ScanPipeline
+from scan_worker import spawn_local_workers
+from telemetry import TelemetryPoller, telemetry_targets
+from verdict_cache import DEFAULT_CACHE_PATH, WORKER_CACHE_DIR, VerdictCache
+
+EXIT_CLEAN = 0
+EXIT_DETECTIONS = 1
+EXIT_ERROR = 2
+
+
+def scan_root(root, cache, prefilter, consensus, history, telemetry, args, report_dir, pipelines, interrupted):
+    """Scan one folder and return its summary dict."""
+    engines = []
+    index = None
+    if args.broker:
+        # Worker processes do the hashing and engine work; this process only walks and collects
+        pipeline = ScanCoordinator(root, args.broker)
+    else:
+        engines = create_engines(args.engines)
+        index = FileIndex(root) if args.incremental else None
+        pipeline = ScanPipeline(root, engines, cache=cache, index=index, max_workers=args.workers,
+                                prefilter=prefilter, consensus=consensus, history=history,
+                                telemetry=telemetry)
+    pipelines.append(pipeline)
+    if interrupted.is_set():
+        pipeline.cancel()  # Interrupted while this folder was being set up
+    report = ReportWriter(root, directory=report_dir)
+    started = time.perf_counter()
+    try:
+        pipeline.run(on_verdict=report.add)
+    finally:
+        report.close()
+        if index is not None:
+            index.close()
+        for engine in engines:
+            engine.close()
+    files_total, _, _ = pipeline.progress()
+    return {
+        "root": root,
+        "files": files_total,
+        "detections": len(pipeline.detections),
+        "cancelled": pipeline.is_cancelled(),
+        "seconds": time.perf_counter() - started,
+        "cache_hit_rate": pipeline.cache_hit_rate(),
+        "consensus_saved": pipeline.consensus_saved,
+        "report": report.html_path,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("roots", nargs="+", help="folders to scan")
+    parser.add_argument("--engines", default=None,
+                        help='"local", "remote", "pool" or host:port of a stand-in engine '
+                             '(default: $AV_PIPELINE_ENGINES)')
+    parser.add_argument("--report-dir", default=None, help=f"where reports are written (default: {DEFAULT_REPORT_DIR})")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="verdict cache database")
+    parser.add_argument("--no-incremental", dest="incremental", action="store_false",
+                        help="hash every file instead of reusing hashes of unchanged files")
+    parser.add_argument("--workers", type=int, default=None, help="hashing threads per folder")
+    parser.add_argument("--parallel", type=int, default=4, help="folders scanned at the same time")
+    parser.add_argument("--known-clean", default=DEFAULT_KNOWN_CLEAN_PATH, help="known-clean digest set")
+    parser.add_argument("--no-prefilter", dest="prefilter", action="store_false",
+                        help="send every file to the engines, ignoring pre-filter rules and the known-clean set")
+    parser.add_argument("--skip-media", action="store_true",
+                        help="do not scan files whose magic bytes name an image, audio or video format")
+    parser.add_argument("--consensus", default=None,
+                        help='"all", "agree:N", "fast-clean" or "fast-clean+agree:N" (default: $AV_PIPELINE_CONSENSUS)')
+    parser.add_argument("--engine-history", default=DEFAULT_HISTORY_PATH,
+                        help="per file type engine latency and detection history used to order engines")
+    parser.add_argument("--load-aware", action="store_true",
+                        help="poll the engine VMs' agents and, with --consensus, ask less loaded engines first")
+    parser.add_argument("--broker", default=None,
+                        help='coordinate scan_worker.py processes at "unix:/path" or "host:port" instead of '
+                             'scanning in this process; folders are then scanned one at a time')
+    parser.add_argument("--spawn-workers", type=int, default=0,
+                        help="start this many local worker processes for --broker")
+    parser.add_argument("--metrics-file", default=None,
+                        help=f"export Prometheus metrics to this .prom file (default: ${METRICS_FILE_VARIABLE})")
+    parser.add_argument("--quiet", action="store_true", help="only print detections and errors")
+    args = parser.parse_args(argv)
+
+    roots = [os.path.abspath(root) for root in args.roots]
+    missing = [root for root in roots if not os.path.isdir(root)]
+    for root in missing:
+        print(f"error: not a folder: {root}", file=sys.stderr)
+    roots = [root for root in roots if root not in missing]
+
+    cache = VerdictCache(args.cache)
+    metrics_writer = start_textfile_writer(args.metrics_file)
+    # Shared by every folder so the savings are reported once for the whole run
+    prefilter = create_prefilter(args.known_clean, args.skip_media) if args.prefilter else None
+    try:
+        consensus = create_policy(args.consensus)
+    except ValueError as error:
+        parser.error(str(error))
+    history = EngineHistory(args.engine_history) if consensus is not None else None
+    telemetry = TelemetryPoller(telemetry_targets(args.engines)).start() if args.load_aware else None
+    if args.report_dir:
+        run_dir = args.report_dir
+    else:
+        # Runs started within the same second still get directories of their own
+        os.makedirs(DEFAULT_REPORT_DIR, exist_ok=True)
+        run_dir = tempfile.mkdtemp(prefix=time.strftime("%Y%m%d-%H%M%S-"), dir=DEFAULT_REPORT_DIR)
+    pipelines = []
+    summaries = []
+    lock = threading.Lock()
+    interrupted = threading.Event()
+    # Coordinators of different folders cannot share a broker address
+    slots = threading.BoundedSemaphore(1 if args.broker else max(1, args.parallel))
+    workers = []
+    if args.broker and args.spawn_workers:
+        worker_arguments = ["--engines", args.engines] if args.engines else []
+        if args.consensus:
+            worker_arguments += ["--consensus", args.consensus]
+        if not args.prefilter:
+            worker_arguments.append("--no-prefilter")
+        elif args.skip_media:
+            worker_arguments.append("--skip-media")
+        workers = spawn_local_workers(args.broker, args.spawn_workers, worker_arguments,
+                                      cache_dir=WORKER_CACHE_DIR)
+
+    def worker(number, root):
+        with slots:
+            if interrupted.is_set():
+                return
+            try:
+                summary = scan_root(root, cache, prefilter, consensus, history, telemetry, args,
+                                    os.path.join(run_dir, f"{number:03d}"), pipelines, interrupted)
+            except Exception as error:
+                # Anything that stops a folder is reported, so the run never exits clean without its summary
+                summary = {"root": root, "error": str(error) or type(error).__name__}
+            with lock:
+                summaries.append(summary)
+                if "error" in summary:
+                    print(f"error: {root}: {summary['error']}", file=sys.stderr)
+                elif summary["detections"] or not args.quiet:
+                    print(f"{root}: {summary['files']} files, {summary['detections']} detections, "
+                          f"{summary['seconds']:.1f}s, cache hit rate {summary['cache_hit_rate']:.1%}, "
+                          f"report {summary['report']}")
+
+    def interrupt(signum, frame):
+        interrupted.set()
+        for pipeline in pipelines:
+            pipeline.cancel()
+        print("interrupted, stopping scans", file=sys.stderr)
+
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, interrupt)
+
+    threads = [threading.Thread(target=worker, args=(number, root), name=f"root-{number}")
+               for number, root in enumerate(roots)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.2)  # Wake up regularly so signals are handled
+    for process in workers:
+        process.terminate()
+        process.wait()
+    cache.close()
+    if prefilter is not None:
+        saved = prefilter.saved()
+        if saved and not args.quiet:
+            print("pre-filter saved " + ", ".join(f"{count} submissions ({rule})" for rule, count in sorted(saved.items())))
+        prefilter.close()
+    saved = sum(summary.get("consensus_saved", 0) for summary in summaries)
+    if saved and not args.quiet:
+        print(f"consensus ({consensus.name}) saved {saved} submissions")
+    if telemetry is not None:
+        telemetry.stop()
+    if metrics_writer is not None:
+        metrics_writer.stop()
+
+    if missing or interrupted.is_set() or len(summaries) < len(roots) or \
+            any("error" in summary for summary in summaries):
+        return EXIT_ERROR
+    if any(summary["detections"] for summary in summaries):
+        return EXIT_DETECTIONS
+    return EXIT_CLEAN
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,651 @@
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from archives import MEMBER_SEPARATOR, ArchiveLimits, ByteBudget, is_archive_name, iter_members, outer_path
+from checkpoint import ResumableWalk
+from dispatcher import EngineDispatcher
+from engines import CLEAN, ERROR, INFECTED, SKIPPED
+from hashing import LARGE_FILE_THRESHOLD, HashStats, hash_large_file, hash_member, hash_small_files
+from metrics import metrics
+from progress_bus import ProgressCounter
+
+# Pre-filter rule name for files found in the known-clean digest set
+KNOWN_CLEAN = "known-clean"
+
+# Rule name recorded for engines a consensus decision left unasked
+CONSENSUS = "consensus"
+
+# Reason recorded with the ERROR verdicts of a file whose scan raised
+SCAN_FAILED = "scan-failed"
+
+# Where the scanner keeps its caches and indexes between runs
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".av_pipeline")
+
+# One engine's verdict on one file; latency is 0 for verdicts served from the cache or the
+# pre-filter, and prefilter names the pre-filter rule or archive limit that settled the file, if any
+VerdictRecord = namedtuple("VerdictRecord", "path engine verdict size latency cached prefilter", defaults=("",))
+
+
+class _MemberTicket:
+    """Bytes an archive member holds in the member budget and how many engines still have to scan it."""
+    __slots__ = ("size", "remaining")
+
+    def __init__(self, size, remaining):
+        self.size = size
+        self.remaining = remaining
+
+
+class _FileVotes:
+    """Consensus state of one file: engines still to ask, verdicts so far and the settled verdict."""
+    __slots__ = ("kind", "waiting", "verdicts", "outstanding", "decided", "data", "lock")
+
+    def __init__(self, kind, waiting, verdicts, data):
+        self.kind = kind
+        self.waiting = waiting
+        self.verdicts = verdicts
+        self.outstanding = 0
+        self.decided = None
+        self.data = data
+        self.lock = threading.Lock()
+
+
+def file_type(path):
+    """Return the lower-cased extension engines are ranked under for path."""
+    return os.path.splitext(path)[1].lower()
+
+
+def walk_files(root):
+    """Yield a DirEntry for every regular file below root, one directory at a time."""
+    pending_dirs = [root]
+    while pending_dirs:
+        directory = pending_dirs.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry
+                    except OSError:
+                        continue  # Entry vanished or is unreadable
+        except OSError:
+            continue  # Directory vanished or permission denied
+
+
+class ScanPipeline:
+    """Walks a folder and scans every file with every engine on a bounded thread pool.
+
+    The walker runs in the thread that calls run() and blocks once max_pending
+    files are queued, so memory stays flat no matter how large the tree is.
+    Progress counters can be read from any thread with progress().
+
+    When a VerdictCache is given, each file is hashed first and engines that
+    already have a verdict for that content and definition version are not
+    asked again; files cached for every engine are never submitted at all.
+
+    When a FileIndex is also given the scan is incremental: files whose stat
+    metadata is unchanged since the last run reuse their stored hash, and if
+    every verdict is cached they are settled in the walker without being read.
+
+    Files that still need verdicts are handed to an EngineDispatcher, which
+    feeds each engine from its own bounded queue; dispatcher_options are
+    passed through to its lanes (max_in_flight, queue_size, batch limits).
+
+    Small files are hashed in batches of up to batch_files files or batch_bytes
+    bytes from a reused buffer; large files are hashed one per task through
+    mmap. Throughput of both paths is collected in hash_stats.
+
+    When a PreFilter is given, files matching one of its policy rules are
+    settled before they are hashed, and files whose digest is in its
+    known-clean set are settled before the cache is consulted. Files are
+    hashed when there is a cache or a known-clean set to look them up in.
+
+    With scan_archives set, the members of zip, tar and gzip archives are
+    streamed out of them and scanned as well, under paths of the form
+    "archive.zip!/member"; archive_options are passed to ArchiveLimits.
+    Members wait for the engines in memory, at most member_budget bytes at a
+    time, and never touch the disk.
+
+    With a ScanCheckpoint, the walk position and every completed file are
+    saved every checkpoint_interval seconds; a pipeline given the checkpoint
+    of an interrupted run picks up from its last save and skips files that
+    were already complete. A file is complete once every engine has given a
+    verdict on it and on each of its archive members. pause() holds the
+    walker, the hashing workers and the engine lanes until resume().
+
+    With a ConsensusPolicy (see consensus.py), engines are asked a few at a
+    time instead of all at once, best first for the file's type according to
+    an EngineHistory if one is given, and with a TelemetryPoller the engines
+    whose VMs are less loaded go first. Once the policy settles a file,
+    queued submissions for it are withdrawn and the engines never asked are
+    recorded as SKIPPED under the "consensus" rule.
+
+    A source, such as a FolderWatcher, replaces the walk of root: run() then
+    scans the items it yields (anything with path and stat() like a
+    DirEntry) until it ends. A source yields None to have a partial batch
+    sent on without waiting for it to fill, and the file index is not pruned
+    afterwards, since a source sees only part of the tree.
+
+    Each stage (walk, hash, cache, engine round trip) reports to the shared
+    metrics registry, and per-engine queue depths are published as gauges
+    while run() is active.
+    """
+
+    def __init__(self, root, engines, cache=None, index=None, max_workers=None, max_pending=None,
+                 dispatcher_options=None, batch_files=64, batch_bytes=4 * 1024 * 1024, prefilter=None,
+                 scan_archives=True, archive_options=None, member_budget=256 * 1024 * 1024,
+                 checkpoint=None, checkpoint_interval=30.0, consensus=None, history=None, source=None,
+                 telemetry=None):
+        self.root = root
+        self.engines = engines
+        self.cache = cache
+        self.index = index
+        self.prefilter = prefilter
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.max_pending = max_pending or self.max_workers * 4
+        self.dispatcher_options = dispatcher_options or {}
+        self.dispatcher = None
+        self.batch_files = batch_files
+        self.batch_bytes = batch_bytes
+        self.hash_stats = HashStats()
+        self.scan_archives = scan_archives
+        self.archive_options = archive_options or {}
+        self.member_budget = ByteBudget(member_budget)
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.walk_state = None
+        self.consensus = consensus
+        self.history = history
+        self.telemetry = telemetry
+        self.source = source
+
+        # One counter per engine: files scanned out of files found so far
+        self.engine_progress = [ProgressCounter() for _ in engines]
+        self.walk_finished = False
+        self.detections = []
+        self.cache_lookups = 0
+        self.cache_hits = 0
+        self.files_skipped = 0
+        # Files a pre-filter rule kept from the engines without a verdict, such as oversized ones
+        self.files_not_scanned = 0
+        self.files_unchanged = 0
+        self.members_scanned = 0
+        # Engine submissions a consensus decision made unnecessary
+        self.consensus_saved = 0
+        # Files completed by earlier runs of a checkpointed scan
+        self.files_resumed = 0
+
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        # Verdicts still expected per file on disk, tracked only when checkpointing or asked to
+        self._outstanding = {}
+        self._track_files = checkpoint is not None
+        self._on_detection = None
+        self._on_verdict = None
+        self._on_file_done = None
+
+    def cancel(self):
+        """Stop walking and skip every file that has not started scanning yet."""
+        self._cancelled.set()
+        self._resumed.set()  # Paused threads wake up and see the cancellation
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def pause(self):
+        """Hold every stage before its next file; files already at an engine still finish."""
+        if not self._cancelled.is_set():
+            self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def is_paused(self):
+        return not self._resumed.is_set()
+
+    def progress(self):
+        """Return (files_total, files_done per engine, walk_finished)."""
+        snapshots = [counter.snapshot() for counter in self.engine_progress]
+        files_total = snapshots[0][1] if snapshots else 0
+        return files_total, [done for done, _ in snapshots], self.walk_finished
+
+    def cache_hit_rate(self):
+        """Return the fraction of engine verdicts served from the cache."""
+        with self._lock:
+            return self.cache_hits / self.cache_lookups if self.cache_lookups else 0.0
+
+    def engine_stats(self):
+        """Return [(queue depth, in flight, files per second)] in engine order."""
+        if self.dispatcher is None:
+            return [(0, 0, 0.0)] * len(self.engines)
+        return self.dispatcher.stats()
+
+    def _queue_depths(self):
+        return {(("engine", engine.name),): depth
+                for engine, (depth, _, _) in zip(self.engines, self.engine_stats())}
+
+    def _in_flight(self):
+        return {(("engine", engine.name),): in_flight
+                for engine, (_, in_flight, _) in zip(self.engines, self.engine_stats())}
+
+    def run(self, on_detection=None, on_verdict=None, on_file_done=None):
+        """Scan the whole tree.
+
+        on_detection(path, engine_name) is called for every hit and
+        on_verdict(record) with a VerdictRecord for every verdict, from
+        whichever pipeline thread produced it. on_file_done(path) is called
+        once a file has every verdict, its archive members' included.
+        """
+        self._on_detection = on_detection
+        self._on_verdict = on_verdict
+        self._on_file_done = on_file_done
+        self._track_files = self.checkpoint is not None or on_file_done is not None
+        slots = threading.BoundedSemaphore(self.max_pending)
+        withdrawn = self._withdrawn if self.consensus is not None else None
+        self.dispatcher = EngineDispatcher(self.engines, self._on_engine_verdict, self._cancelled,
+                                           resumed=self._resumed, withdrawn=withdrawn, **self.dispatcher_options)
+        metrics.add_gauge("av_engine_queue_depth", self._queue_depths)
+        metrics.add_gauge("av_engine_in_flight", self._in_flight)
+        saver = None
+        if self.checkpoint is not None:
+            self.walk_state = ResumableWalk(self.root, **(self.checkpoint.position() or {}))
+            self.files_resumed = self.checkpoint.completed_count()
+            saver_stopped = threading.Event()
+            saver = threading.Thread(target=self._save_checkpoints, args=(saver_stopped,), name="checkpoint",
+                                     daemon=True)
+            saver.start()
+        try:
+            self._walk(slots)
+        finally:
+            self.dispatcher.close()
+            if saver is not None:
+                saver_stopped.set()
+                saver.join()
+                self.checkpoint.save(self.walk_state.position())
+            metrics.remove_gauge("av_engine_queue_depth", self._queue_depths)
+            metrics.remove_gauge("av_engine_in_flight", self._in_flight)
+        if self.cache is not None:
+            self.cache.flush()
+        if self.index is not None:
+            self.index.finish(prune=not self._cancelled.is_set() and self.source is None)
+        if self.history is not None:
+            self.history.save()
+        return self.detections
+
+    def _walk(self, slots):
+        # hashlib releases the GIL while hashing, so the hashing stage scales across threads
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scan") as pool:
+
+            def submit(items):
+                slots.acquire()
+                future = pool.submit(self._scan_files, items)
+                future.add_done_callback(lambda _: slots.release())
+
+            batch = []
+            batch_bytes = 0
+            if self.source is not None:
+                entries = self.source
+            else:
+                entries = self.walk_state if self.walk_state is not None else walk_files(self.root)
+            for entry in entries:
+                if entry is None:
+                    # The source has nothing more for now, so don't hold back a partial batch
+                    if batch and not self._cancelled.is_set():
+                        submit(batch)
+                        batch = []
+                        batch_bytes = 0
+                    continue
+                self._resumed.wait()
+                if self._cancelled.is_set():
+                    break
+                if self.checkpoint is not None and self.checkpoint.is_completed(entry.path):
+                    # Scanned before the interruption; still seen by this run, so finish() must not prune it
+                    if self.index is not None:
+                        self.index.touch(entry.path)
+                    self.walk_state.file_done(entry.path)
+                    continue
+                self._expect(entry.path, 1)  # Held until a worker has dealt with the file
+                for counter in self.engine_progress:
+                    counter.add(total=1)
+                metrics.inc("av_files_walked_total")
+
+                started = metrics.clock()
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    stat = None
+                digest = None
+                if self.index is not None and stat is not None:
+                    digest = self.index.lookup(entry.path, stat)
+                metrics.observe("av_stage_seconds", started, stage="walk")
+                # Unchanged archives still go to a worker, which lists their members
+                if digest is not None and not (self.scan_archives and is_archive_name(entry.path)):
+                    if self.prefilter is not None and self.prefilter.is_known_clean(digest):
+                        self.index.touch(entry.path)
+                        self._settle_prefiltered(entry.path, stat.st_size, CLEAN, KNOWN_CLEAN)
+                        self._complete(entry.path)
+                        continue
+                    if self._settle_from_cache(entry.path, stat.st_size, digest):
+                        self.index.touch(entry.path)
+                        self._complete(entry.path)
+                        continue
+
+                # Large files get a task of their own; small ones are hashed in batches
+                if stat is not None and stat.st_size >= LARGE_FILE_THRESHOLD:
+                    submit([(entry.path, stat, digest)])
+                    continue
+                batch.append((entry.path, stat, digest))
+                batch_bytes += stat.st_size if stat is not None else 0
+                if len(batch) >= self.batch_files or batch_bytes >= self.batch_bytes:
+                    submit(batch)
+                    batch = []
+                    batch_bytes = 0
+            if batch and not self._cancelled.is_set():
+                submit(batch)
+            with self._lock:
+                self.walk_finished = True
+
+    def _save_checkpoints(self, stopped):
+        while not stopped.wait(self.checkpoint_interval):
+            self.checkpoint.save(self.walk_state.position())
+
+    def _expect(self, path, verdicts):
+        """Note that path (a file on disk) is not complete until verdicts more calls to _complete()."""
+        if not self._track_files:
+            return
+        with self._lock:
+            self._outstanding[path] = self._outstanding.get(path, 0) + verdicts
+
+    def _complete(self, path):
+        if not self._track_files:
+            return
+        with self._lock:
+            remaining = self._outstanding[path] - 1
+            if remaining:
+                self._outstanding[path] = remaining
+                return
+            del self._outstanding[path]
+        if self.checkpoint is not None:
+            self.walk_state.file_done(path)
+            self.checkpoint.file_done(path)
+        if self._on_file_done is not None:
+            self._on_file_done(path)
+
+    def _settle_from_cache(self, path, size, digest):
+        """Finish an unchanged file from cached verdicts alone; False if any engine is missing."""
+        if self.cache is None:
+            return False
+        cached = self.cache.get_many(digest, self.engines)
+        if len(cached) != len(self.engines):
+            return False
+        self._expect(path, len(self.engines))
+        with self._lock:
+            self.cache_lookups += len(self.engines)
+            self.cache_hits += len(cached)
+            self.files_skipped += 1
+            self.files_unchanged += 1
+        for index, engine in enumerate(self.engines):
+            self._record_verdict(index, engine, path, cached[engine.name], size, 0.0, True)
+        return True
+
+    def _scan_files(self, items):
+        self._resumed.wait()
+        if self._cancelled.is_set():
+            return
+        paths = [path for path, _, _ in items]
+        if self.prefilter is not None:
+            items = [(path, stat, digest) for path, stat, digest in items
+                     if stat is None or not self._settle_by_rule(path, stat.st_size)]
+        digests = [digest for _, _, digest in items]
+        if self._needs_digests():
+            started = metrics.clock()
+            hashed_before = self.hash_stats.bytes_hashed() if metrics.enabled else 0
+            small = [n for n, (_, stat, digest) in enumerate(items)
+                     if digest is None and (stat is None or stat.st_size < LARGE_FILE_THRESHOLD)]
+            for n, digest in zip(small, hash_small_files([items[n][0] for n in small], self.hash_stats)):
+                digests[n] = digest
+            small = set(small)
+            for n, (path, stat, digest) in enumerate(items):
+                if digest is None and n not in small:
+                    digests[n] = hash_large_file(path, self.hash_stats)
+            if metrics.enabled:
+                metrics.observe("av_stage_seconds", started, stage="hash")
+                metrics.inc("av_bytes_hashed_total", self.hash_stats.bytes_hashed() - hashed_before)
+
+        for (path, stat, known_digest), digest in zip(items, digests):
+            # One file that fails unexpectedly must not cost the rest of the batch their verdicts
+            failed_path = path
+            try:
+                self._scan_file(path, stat, digest, known_digest is not None)
+                failed_path = path + MEMBER_SEPARATOR
+                if self.scan_archives and is_archive_name(path):
+                    self._scan_members(path)
+            except Exception:
+                self._expect(path, len(self.engines))
+                for index, engine in enumerate(self.engines):
+                    self._record_verdict(index, engine, failed_path, ERROR, 0, 0.0, False, SCAN_FAILED)
+        for path in paths:
+            self._complete(path)
+
+    def _needs_digests(self):
+        return self.cache is not None or (self.prefilter is not None and self.prefilter.known_clean is not None)
+
+    def _scan_members(self, path):
+        """Stream every member out of the archive at path and submit it like a file."""
+        limits = ArchiveLimits(**self.archive_options)
+        for member in iter_members(path, limits):
+            self._resumed.wait()
+            if self._cancelled.is_set():
+                return
+            for counter in self.engine_progress:
+                counter.add(total=1)
+            with self._lock:
+                self.members_scanned += 1
+            if member.data is None:
+                self._expect(path, len(self.engines))
+                for index, engine in enumerate(self.engines):
+                    self._record_verdict(index, engine, member.path, ERROR, 0, 0.0, False, member.reason)
+                continue
+            size = len(member.data)
+            if self.prefilter is not None and self._settle_by_rule(member.path, size, member.data):
+                continue
+            digest = None
+            if self._needs_digests():
+                started = metrics.clock()
+                digest = hash_member(member.data, self.hash_stats)
+                metrics.observe("av_stage_seconds", started, stage="hash")
+                metrics.inc("av_bytes_hashed_total", size)
+            self._submit(member.path, size, digest, member.data)
+
+    def _settle_by_rule(self, path, size, data=None):
+        """Finish a file from the first matching pre-filter rule; False if none matches."""
+        if size is None:
+            return False
+        started = metrics.clock()
+        rule = self.prefilter.match_rule(path, size, head=data)
+        metrics.observe("av_stage_seconds", started, stage="prefilter")
+        if rule is None:
+            return False
+        self._settle_prefiltered(path, size, rule.verdict, rule.name)
+        return True
+
+    def _settle_prefiltered(self, path, size, verdict, rule_name):
+        self._expect(outer_path(path), len(self.engines))
+        if verdict == ERROR:
+            # Left unscanned by policy: reported as such, not as a saving
+            metrics.inc("av_files_not_scanned_total", rule=rule_name)
+            with self._lock:
+                self.files_not_scanned += 1
+        else:
+            self.prefilter.record(rule_name, len(self.engines))
+            with self._lock:
+                self.files_skipped += 1
+        for index, engine in enumerate(self.engines):
+            self._record_verdict(index, engine, path, verdict, size, 0.0, False, rule_name)
+
+    def _scan_file(self, path, stat, digest, known):
+        size = stat.st_size if stat is not None else 0
+        if self.index is not None and digest is not None:
+            if known:
+                self.index.touch(path)
+            elif stat is not None:
+                self.index.record(path, stat, digest)
+
+        self._submit(path, size, digest)
+
+    def _submit(self, path, size, digest, data=None):
+        """Settle a file from the known-clean set or the cache, and send it to the engines still missing."""
+        if self.prefilter is not None and self.prefilter.is_known_clean(digest):
+            self._settle_prefiltered(path, size, CLEAN, KNOWN_CLEAN)
+            return
+        self._expect(outer_path(path), len(self.engines))
+
+        cached = {}
+        if self.cache is not None:
+            if digest is not None:
+                started = metrics.clock()
+                cached = self.cache.get_many(digest, self.engines)
+                metrics.observe("av_stage_seconds", started, stage="cache")
+                metrics.inc("av_cache_lookups_total", len(self.engines))
+                metrics.inc("av_cache_hits_total", len(cached))
+            with self._lock:
+                self.cache_lookups += len(self.engines)
+                self.cache_hits += len(cached)
+                if len(cached) == len(self.engines):
+                    self.files_skipped += 1
+
+        if self.consensus is not None:
+            self._submit_ranked(path, size, digest, data, cached)
+            return
+        ticket = None
+        if data is not None:
+            missing = len(self.engines) - len(cached)
+            if missing:
+                if not self.member_budget.acquire(size, self._cancelled):
+                    return
+                ticket = _MemberTicket(size, missing)
+        for index, engine in enumerate(self.engines):
+            verdict = cached.get(engine.name)
+            if verdict is None:
+                self.dispatcher.submit(index, path, (digest, size, ticket, None), data)
+            else:
+                self._record_verdict(index, engine, path, verdict, size, 0.0, True)
+
+    def _submit_ranked(self, path, size, digest, data, cached):
+        """Ask the engines missing from cached a few at a time, in ranked order, until the policy settles."""
+        kind = file_type(path)
+        names = [engine.name for engine in self.engines]
+        order = list(range(len(self.engines)))
+        loads = self.telemetry.loads() if self.telemetry is not None else None
+        if self.history is not None:
+            order = self.history.rank(kind, names, loads)
+        elif loads:
+            order.sort(key=lambda index: loads.get(names[index], 0.0))
+        votes = _FileVotes(kind, [index for index in order if self.engines[index].name not in cached], [], data)
+        for index in order:
+            verdict = cached.get(self.engines[index].name)
+            if verdict is not None:
+                votes.verdicts.append(verdict)
+                self._record_verdict(index, self.engines[index], path, verdict, size, 0.0, True)
+        if not votes.waiting:
+            return
+        decided = self.consensus.decide(votes.verdicts, kind) if votes.verdicts else None
+        if decided is not None:
+            votes.decided = decided
+            self._skip_unasked(votes, path, size)
+            return
+
+        ticket = None
+        if data is not None:
+            if not self.member_budget.acquire(size, self._cancelled):
+                return
+            ticket = _MemberTicket(size, 0)
+        fanout = self.consensus.fanout_for(kind) or len(self.engines)
+        self._ask(votes, max(1, fanout - len(votes.verdicts)), path, (digest, size, ticket, votes), True)
+
+    def _ask(self, votes, count, path, context, block):
+        """Submit the file to the next count engines in line."""
+        ticket = context[2]
+        with votes.lock:
+            asked, votes.waiting = votes.waiting[:count], votes.waiting[count:]
+            votes.outstanding += len(asked)
+        if ticket is not None:
+            with self._lock:
+                ticket.remaining += len(asked)
+        for index in asked:
+            self.dispatcher.submit(index, path, context, votes.data, block)
+
+    def _skip_unasked(self, votes, path, size):
+        with votes.lock:
+            skipped, votes.waiting = votes.waiting, []
+            votes.data = None
+        if not skipped:
+            return
+        metrics.inc("av_consensus_saved_total", len(skipped))
+        with self._lock:
+            self.consensus_saved += len(skipped)
+        for index in skipped:
+            self._record_verdict(index, self.engines[index], path, SKIPPED, size, 0.0, False, CONSENSUS)
+
+    @staticmethod
+    def _withdrawn(context):
+        votes = context[3]
+        return votes is not None and votes.decided is not None
+
+    def _on_engine_verdict(self, index, path, context, verdict, latency):
+        digest, size, ticket, votes = context
+        engine = self.engines[index]
+        if votes is not None and verdict == SKIPPED:
+            # Withdrawn by the lane after the file was settled
+            metrics.inc("av_consensus_saved_total")
+            with self._lock:
+                self.consensus_saved += 1
+            self._record_verdict(index, engine, path, SKIPPED, size, 0.0, False, CONSENSUS)
+        else:
+            if self.cache is not None and digest is not None and verdict != ERROR:
+                self.cache.put(digest, engine, verdict)
+            if self.history is not None and verdict != ERROR:
+                self.history.record(votes.kind if votes is not None else file_type(path), engine.name,
+                                    latency, verdict == INFECTED)
+            self._record_verdict(index, engine, path, verdict, size, latency, False)
+            if votes is not None:
+                self._count_vote(votes, path, context, verdict)
+        if ticket is not None:
+            with self._lock:
+                ticket.remaining -= 1
+                done = not ticket.remaining
+            if done:
+                self.member_budget.release(ticket.size)
+
+    def _count_vote(self, votes, path, context, verdict):
+        """Add an engine's verdict to the file's votes; settle it or ask the next engine."""
+        with votes.lock:
+            votes.outstanding -= 1
+            if votes.decided is not None:
+                return  # Answered after the file was settled
+            votes.verdicts.append(verdict)
+            votes.decided = self.consensus.decide(votes.verdicts, votes.kind)
+            ask_next = votes.decided is None and not votes.outstanding and votes.waiting
+        if votes.decided is not None:
+            self._skip_unasked(votes, path, context[1])
+        elif ask_next:
+            # Runs on a lane worker, so the follow-up must not block on a full lane
+            self._ask(votes, 1, path, context, False)
+
+    def _record_verdict(self, index, engine, path, verdict, size, latency, cached, prefilter=""):
+        self.engine_progress[index].add(done=1)
+        metrics.inc("av_verdicts_total", engine=engine.name, verdict=verdict)
+        if verdict == INFECTED:
+            with self._lock:
+                self.detections.append((path, engine.name))
+        if self._on_verdict is not None:
+            self._on_verdict(VerdictRecord(path, engine.name, verdict, size, latency, cached, prefilter))
+        if verdict == INFECTED and self._on_detection is not None:
+            self._on_detection(path, engine.name)
+        # Last, so a file is only complete once its verdict has been passed on
+        self._complete(outer_path(path))
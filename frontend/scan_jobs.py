@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from checkpoint import ScanCheckpoint, remove_checkpoint
+from scan_engine import DATA_DIR
+
+DEFAULT_JOBS_DIR = os.path.join(DATA_DIR, "jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+
+# Jobs in these states still have work left and survive a restart
+UNFINISHED = (QUEUED, RUNNING, PAUSED)
+
+ScanJob = namedtuple("ScanJob", "job_id root priority state created incremental")
+
+
+class JobQueue:
+    """Persistent queue of folder scans, highest priority first, then oldest first.
+
+    Jobs live in a small SQLite database next to their checkpoints, so a job
+    that was running when the app or host died is found again on the next
+    start and resumes from its last checkpoint. Only the owner of the queue
+    runs jobs; it calls next_job() to take the next one and finish() when it
+    ends.
+    """
+
+    def __init__(self, directory=DEFAULT_JOBS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(directory, "jobs.sqlite3"), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (job_id INTEGER PRIMARY KEY, root TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, state TEXT NOT NULL, created REAL NOT NULL, incremental INTEGER NOT NULL)")
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            # Whatever was running when the process died is waiting to be resumed
+            self._connection.execute("UPDATE jobs SET state = ? WHERE state = ?", (QUEUED, RUNNING))
+
+    def add(self, root, priority=0, incremental=True):
+        """Queue a scan of root and return its ScanJob."""
+        created = time.time()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (root, priority, state, created, incremental) VALUES (?, ?, ?, ?, ?)",
+                (root, priority, QUEUED, created, int(incremental)))
+        return ScanJob(cursor.lastrowid, root, priority, QUEUED, created, incremental)
+
+    def jobs(self, states=UNFINISHED):
+        """Return the jobs in the given states, in the order they will run."""
+        marks = ", ".join("?" * len(states))
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT job_id, root, priority, state, created, incremental FROM jobs WHERE state IN ({marks}) "
+                "ORDER BY state != ?, priority DESC, created", (*states, RUNNING)).fetchall()
+        return [ScanJob(*row[:5], bool(row[5])) for row in rows]
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT job_id, root, priority, state, created, incremental FROM jobs WHERE job_id = ?",
+                (job_id,)).fetchone()
+        return ScanJob(*row[:5], bool(row[5])) if row else None
+
+    def next_job(self):
+        """Mark the highest priority queued job as running and return it, or None if none is queued."""
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT job_id, root, priority, state, created, incremental FROM jobs WHERE state = ? "
+                "ORDER BY priority DESC, created LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE jobs SET state = ? WHERE job_id = ?", (RUNNING, row[0]))
+        return ScanJob(row[0], row[1], row[2], RUNNING, row[4], bool(row[5]))
+
+    def set_state(self, job_id, state):
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE jobs SET state = ? WHERE job_id = ?", (state, job_id))
+
+    def set_priority(self, job_id, priority):
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE jobs SET priority = ? WHERE job_id = ?", (priority, job_id))
+
+    def checkpoint(self, job_id):
+        """Open the job's checkpoint, which holds its progress from any earlier run."""
+        return ScanCheckpoint(self.checkpoint_path(job_id))
+
+    def checkpoint_path(self, job_id):
+        return os.path.join(self.directory, f"job-{job_id}.checkpoint.sqlite3")
+
+    def finish(self, job_id, state):
+        """Record that a job ended as DONE or CANCELLED and delete its checkpoint."""
+        self.set_state(job_id, state)
+        remove_checkpoint(self.checkpoint_path(job_id))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
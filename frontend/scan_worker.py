@@ -0,0 +1,291 @@
+"""Scan worker: leases file batches from a ScanCoordinator and scans them with a local pipeline.
+
+Run one or more per host, e.g. python scan_worker.py --broker unix:/tmp/av.sock
+or --broker coordinator-host:7600. Workers keep reconnecting until stopped,
+so one set of workers serves every scan the coordinator runs.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from archives import outer_path
+from broker import parse_address
+from consensus import EngineHistory, create_policy
+from engines import create_engines
+from prefilter import create_prefilter
+from scan_engine import ScanPipeline
+from verdict_cache import VerdictCache
+
+# Pushed to the outbox to stop the sender thread
+_STOP = object()
+
+
+class _LeasedFile:
+    """A leased path handed to ScanPipeline in place of a DirEntry."""
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+    def stat(self, follow_symlinks=True):
+        return os.stat(self.path, follow_symlinks=follow_symlinks)
+
+
+class BrokerWorker:
+    """Connects to a coordinator and scans the batches it leases until it says it is done.
+
+    Files go through an ordinary ScanPipeline whose source is the stream of
+    leases, so hashing, the pre-filter, the cache, consensus and the engine
+    lanes all work as in a local scan. Verdicts are streamed back as they
+    arrive, a batch is acknowledged once all of its files are complete, and
+    leases on unfinished batches are renewed every third of the lease time.
+    At most prefetch batches are held at once, so batches spread over all
+    workers instead of piling up at the first to connect.
+    """
+
+    def __init__(self, address, engines=None, cache=None, prefilter=None, consensus=None, history=None,
+                 max_workers=None, dispatcher_options=None, name=None, prefetch=2):
+        self.address = address
+        self.engines_mode = engines
+        self.cache = cache
+        self.prefilter = prefilter
+        self.consensus = consensus
+        self.history = history
+        self.max_workers = max_workers
+        self.dispatcher_options = dispatcher_options
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.prefetch = prefetch
+        self.files_done = 0
+        self.batches_done = 0
+
+        self._lock = threading.Lock()
+        self._batch_done = threading.Condition(self._lock)
+        self._sock = None
+        self._reader = None
+        self._outbox = None
+        self._pipeline = None
+        # Batch id -> files not complete yet; path -> ids of the batches it was leased in
+        self._remaining = {}
+        self._batches_of = {}
+        self._renew_interval = 10.0
+
+    def serve(self, once=False, retry_interval=1.0):
+        """Scan for coordinators until interrupted; with once, return after the first one."""
+        while True:
+            try:
+                self.run_once()
+            except OSError:
+                pass  # No coordinator listening yet, or it went away
+            if once:
+                return
+            time.sleep(retry_interval)
+
+    def run_once(self):
+        """Connect, scan every batch leased until the coordinator is done, and disconnect."""
+        family, address = parse_address(self.address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(address)
+            self._reader = self._sock.makefile("rb")
+            self._outbox = queue.Queue()
+            self._remaining = {}
+            self._batches_of = {}
+            sender = threading.Thread(target=self._send_loop, name="worker-sender", daemon=True)
+            sender.start()
+            self._outbox.put({"op": "hello", "worker": self.name})
+            first = self._lease()
+            if first is not None:
+                engines = create_engines(self.engines_mode)
+                self._pipeline = ScanPipeline(first["root"], engines, cache=self.cache, prefilter=self.prefilter,
+                                              max_workers=self.max_workers,
+                                              dispatcher_options=self.dispatcher_options,
+                                              consensus=self.consensus, history=self.history,
+                                              source=self._files(first))
+                try:
+                    self._pipeline.run(on_verdict=self._on_verdict, on_file_done=self._on_file_done)
+                finally:
+                    for engine in engines:
+                        engine.close()
+            self._outbox.put(_STOP)
+            sender.join()
+        finally:
+            self._pipeline = None
+            self._sock.close()
+
+    def _lease(self):
+        """Ask for the next batch and wait for it; None once the coordinator is done or gone.
+
+        A reply that is not a well-formed batch or done message ends the
+        connection, like a coordinator that went away.
+        """
+        self._outbox.put({"op": "lease"})
+        line = self._reader.readline()
+        if not line:
+            return None
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = None
+        if isinstance(message, dict) and message.get("op") == "done":
+            return None
+        if not _is_batch(message):
+            if self._pipeline is not None:
+                self._pipeline.cancel()
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Already gone
+            return None
+        self._renew_interval = message["lease"] / 3
+        return message
+
+    def _files(self, batch):
+        while batch is not None:
+            with self._lock:
+                self._remaining[batch["id"]] = len(batch["paths"])
+                for path in batch["paths"]:
+                    self._batches_of.setdefault(path, []).append(batch["id"])
+            for path in batch["paths"]:
+                yield _LeasedFile(path)
+            yield None  # Scan what this batch left in a partial hashing batch without waiting
+            with self._batch_done:
+                while len(self._remaining) >= self.prefetch and not self._pipeline.is_cancelled():
+                    self._batch_done.wait(1.0)
+            batch = self._lease()
+
+    def _on_verdict(self, record):
+        with self._lock:
+            batch_ids = self._batches_of.get(outer_path(record.path))
+        if batch_ids:
+            self._outbox.put([batch_ids[0], *record])
+
+    def _on_file_done(self, path):
+        with self._lock:
+            batch_ids = self._batches_of[path]
+            batch_id = batch_ids.pop(0)
+            if not batch_ids:
+                del self._batches_of[path]
+            self._remaining[batch_id] -= 1
+            self.files_done += 1
+            if self._remaining[batch_id]:
+                return
+            del self._remaining[batch_id]
+            self.batches_done += 1
+            self._batch_done.notify()
+        self._outbox.put({"op": "ack", "id": batch_id})
+
+    def _send_loop(self):
+        """Send queued messages, merging verdicts queued together into one results message."""
+        stopping = False
+        renew_at = time.monotonic() + self._renew_interval
+        while not stopping:
+            try:
+                items = [self._outbox.get(timeout=max(0.0, renew_at - time.monotonic()))]
+            except queue.Empty:
+                items = []
+            if time.monotonic() >= renew_at:
+                renew_at = time.monotonic() + self._renew_interval
+                with self._lock:
+                    batch_ids = list(self._remaining)
+                if batch_ids:
+                    items.append({"op": "renew", "ids": batch_ids})
+            while True:
+                try:
+                    items.append(self._outbox.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            records = []
+            for item in items:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, list):
+                    records.append(item)
+                else:
+                    if records:
+                        lines.append(_encode({"op": "results", "records": records}))
+                        records = []
+                    lines.append(_encode(item))
+            if records:
+                lines.append(_encode({"op": "results", "records": records}))
+            if not lines:
+                continue
+            try:
+                self._sock.sendall(b"".join(lines))
+            except OSError:
+                # The coordinator is gone; its leases will be retried elsewhere
+                if self._pipeline is not None:
+                    self._pipeline.cancel()
+                self._sock.close()
+                return
+
+
+def _is_batch(message):
+    return (isinstance(message, dict) and message.get("op") == "batch" and isinstance(message.get("id"), int)
+            and isinstance(message.get("root"), str) and isinstance(message.get("paths"), list)
+            and all(isinstance(path, str) for path in message["paths"])
+            and isinstance(message.get("lease"), (int, float)) and message["lease"] > 0)
+
+
+def _encode(message):
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def spawn_local_workers(address, count, arguments=(), cache_dir=None):
+    """Start count worker processes on this host connected to address; returns their Popen objects.
+
+    With cache_dir, each worker gets a verdict cache of its own there, reused by the same slot next time.
+    """
+    processes = []
+    for slot in range(count):
+        command = [sys.executable, os.path.abspath(__file__), "--broker", address, *arguments]
+        if cache_dir is not None:
+            command += ["--cache", os.path.join(cache_dir, f"verdict_cache.worker-{slot}.sqlite3")]
+        processes.append(subprocess.Popen(command))
+    return processes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--broker", required=True, help='coordinator address, "unix:/path" or "host:port"')
+    parser.add_argument("--engines", default=None,
+                        help='"local", "remote", "pool" or host:port of a stand-in engine '
+                             '(default: $AV_PIPELINE_ENGINES)')
+    parser.add_argument("--cache", default=None,
+                        help="verdict cache database of this worker; workers must not share one")
+    parser.add_argument("--no-prefilter", dest="prefilter", action="store_false",
+                        help="send every file to the engines, ignoring pre-filter rules and the known-clean set")
+    parser.add_argument("--skip-media", action="store_true",
+                        help="do not scan files whose magic bytes name an image, audio or video format")
+    parser.add_argument("--consensus", default=None,
+                        help='"all", "agree:N", "fast-clean" or "fast-clean+agree:N" (default: $AV_PIPELINE_CONSENSUS)')
+    parser.add_argument("--workers", type=int, default=None, help="hashing threads")
+    parser.add_argument("--once", action="store_true", help="exit after the first coordinator is done")
+    args = parser.parse_args(argv)
+
+    try:
+        consensus = create_policy(args.consensus)
+    except ValueError as error:
+        parser.error(str(error))
+    cache = VerdictCache(args.cache) if args.cache else None
+    prefilter = create_prefilter(skip_media=args.skip_media) if args.prefilter else None
+    worker = BrokerWorker(args.broker, engines=args.engines, cache=cache, prefilter=prefilter, consensus=consensus,
+                          history=EngineHistory() if consensus is not None else None, max_workers=args.workers)
+    try:
+        worker.serve(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,61 @@
+import os
 import sys
+import time
+from collections import deque
 from PyQt6.QtWidgets import QApplication, QMainWindow, QLabel, QPushButton, QLineEdit, QHBoxLayout, QVBoxLayout, \
-    QProgressBar, QFileDialog, QWidget, QFrame
-from PyQt6.QtGui import QFont, QIcon, QPixmap
-from PyQt6.QtCore import Qt, QTimer, QSize
+    QProgressBar, QFileDialog, QWidget, QFrame, QCheckBox, QTableView, QHeaderView, QAbstractItemView, QPlainTextEdit, \
+    QSpinBox, QListWidget, QListWidgetItem, QComboBox
+from PyQt6.QtGui import QFont, QDesktopServices
+from PyQt6.QtCore import Qt, QTimer, QSize, QObject, QThread, QUrl, pyqtSignal
+
+import assets
+from consensus import EngineHistory, create_policy
+from file_index import FileIndex
+from hashing import LARGE, SMALL
+from metrics import metrics, start_textfile_writer
+from prefilter import create_prefilter
+from progress_pump import FRAMES_PER_SECOND, shared_pump
+from engines import ENGINE_NAMES, INFECTED, create_engines
+from report_writer import ReportWriter
+from result_store import ResultStore
+from result_views import ResultTableModel
+from scan_engine import ScanPipeline
+from scan_jobs import CANCELLED, DONE, PAUSED, QUEUED, RUNNING, JobQueue
+from telemetry import shared_poller
+from verdict_cache import VerdictCache
+from watcher import FolderWatcher, WatchLatency
+
+# Longest the GUI thread may spend moving results into the views per timer tick
+RESULT_DRAIN_BUDGET = 0.008
+RESULT_DRAIN_CHUNK = 1000
+
+# How often the open metrics panel is refreshed, in milliseconds
+METRICS_REFRESH_INTERVAL = 500
+
+
+class ScanWorker(QObject):
+    """Runs a ScanPipeline on a background thread and reports back with signals.
+
+    finished is emitted however the run ends; a run that raised emits failed
+    with the error first.
+    """
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, pipeline, on_verdict):
+        super().__init__()
+        self.pipeline = pipeline
+        self.on_verdict = on_verdict
+
+    def run(self):
+        """Scan the whole tree; called from the worker thread."""
+        try:
+            self.pipeline.run(on_verdict=self.on_verdict)
+        except Exception as error:
+            self.pipeline.cancel()
+            self.failed.emit(str(error) or type(error).__name__)
+        finally:
+            self.finished.emit()
 
 
 class ScanWindow(QMainWindow):
@@ -21,7 +74,7 @@ class ScanWindow(QMainWindow):
 
         # Back button with an icon instead of text
         back_button = QPushButton()
-        back_button.setIcon(QIcon("../assets/main_menu/back.png"))
+        back_button.setIcon(assets.icon("../assets/main_menu/back.png"))
         back_button.setIconSize(QSize(40, 40))
         back_button.setStyleSheet("background-color: transparent; border: none;")
         back_button.clicked.connect(self.go_back)
@@ -38,7 +91,7 @@ class ScanWindow(QMainWindow):
 
         # Icon above the header
         icon_label = QLabel()
-        icon_pixmap = QPixmap("../assets/main_menu/Scan.png").scaled(50, 50, Qt.AspectRatioMode.KeepAspectRatio)
+        icon_pixmap = assets.pixmap("../assets/main_menu/Scan.png", 50, 50)
         icon_label.setPixmap(icon_pixmap)
         icon_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         main_layout.addWidget(icon_label)
@@ -81,45 +134,145 @@ class ScanWindow(QMainWindow):
         # Antivirus scanning progress
         scanning_layout = QHBoxLayout()
         self.progress_bars = []
-        scanning_layout.addLayout(self.create_scan_progress("Microsoft Defender", 0))
-        scanning_layout.addLayout(self.create_scan_progress("Trend Micro Security", 0))
-        scanning_layout.addLayout(self.create_scan_progress("Eset Internet Security", 0))
+        for engine_name in ENGINE_NAMES:
+            scanning_layout.addLayout(self.create_scan_progress(engine_name, 0))
         main_layout.addLayout(scanning_layout)
 
-        # Add "Scan" button
+        # Add "Scan" button; it queues the folder as a job that runs when the jobs ahead of it are done
         scan_button = QPushButton("Scan")
         scan_button.setStyleSheet("background-color: #1565C0; color: white; font-size: 14px; padding: 10px;")
         scan_button.clicked.connect(self.start_scanning)
-        main_layout.addWidget(scan_button, alignment=Qt.AlignmentFlag.AlignCenter)
+
+        # Watch mode scans files in the folder as they are created or changed, until switched off
+        self.watch_button = QPushButton("Watch")
+        self.watch_button.setCheckable(True)
+        self.watch_button.setStyleSheet("background-color: #1565C0; color: white; font-size: 14px; padding: 10px;")
+        self.watch_button.toggled.connect(self.toggle_watch)
+
+        # Incremental mode reuses hashes of files unchanged since the last scan of this folder
+        self.incremental_checkbox = QCheckBox("Incremental")
+        self.incremental_checkbox.setChecked(True)
+        self.incremental_checkbox.setFont(QFont("Palatino Linotype", 12))
+
+        # Jobs with a higher priority run first
+        priority_label = QLabel("Priority:")
+        priority_label.setFont(QFont("Palatino Linotype", 12))
+        self.priority_input = QSpinBox()
+        self.priority_input.setRange(-10, 10)
+
+        # When to stop asking further engines about a file
+        consensus_label = QLabel("Consensus:")
+        consensus_label.setFont(QFont("Palatino Linotype", 12))
+        self.consensus_input = QComboBox()
+        for text, spec in (("All engines", "all"), ("2 engines agree", "agree:2"),
+                           ("Fast clean", "fast-clean"), ("Fast clean, else 2 agree", "fast-clean+agree:2")):
+            self.consensus_input.addItem(text, spec)
+        self.consensus_input.setCurrentIndex(max(0, self.consensus_input.findData(
+            os.environ.get("AV_PIPELINE_CONSENSUS", "all"))))
+
+        scan_button_layout = QHBoxLayout()
+        scan_button_layout.addStretch()
+        scan_button_layout.addWidget(scan_button)
+        scan_button_layout.addWidget(self.watch_button)
+        scan_button_layout.addWidget(self.incremental_checkbox)
+        scan_button_layout.addWidget(priority_label)
+        scan_button_layout.addWidget(self.priority_input)
+        scan_button_layout.addWidget(consensus_label)
+        scan_button_layout.addWidget(self.consensus_input)
+        scan_button_layout.addStretch()
+        main_layout.addLayout(scan_button_layout)
+
+        # Scan jobs: the running one first, then the queue in the order it will run
+        self.jobs_list = QListWidget()
+        self.jobs_list.setMaximumHeight(60)
+        self.jobs_list.setStyleSheet("background-color: white; font-size: 12px;")
+        self.pause_button = QPushButton("Pause / Resume")
+        self.pause_button.setStyleSheet("background-color: #1565C0; color: white; font-size: 12px; padding: 5px;")
+        self.pause_button.clicked.connect(self.toggle_pause_job)
+        cancel_button = QPushButton("Cancel Job")
+        cancel_button.setStyleSheet("background-color: #1565C0; color: white; font-size: 12px; padding: 5px;")
+        cancel_button.clicked.connect(self.cancel_job)
+        job_buttons_layout = QVBoxLayout()
+        job_buttons_layout.addWidget(self.pause_button)
+        job_buttons_layout.addWidget(cancel_button)
+        jobs_layout = QHBoxLayout()
+        jobs_layout.addWidget(self.jobs_list)
+        jobs_layout.addLayout(job_buttons_layout)
+        main_layout.addLayout(jobs_layout)
 
         # Infected files section
         infected_label = QLabel("INFECTED FILES")
         infected_label.setFont(QFont("Palatino Linotype", 14, QFont.Weight.Bold))
         infected_label.setStyleSheet("color: black;")
-        main_layout.addWidget(infected_label)
+        # Scan jobs and watch mode keep separate results; this picks which the views show
+        self.results_input = QComboBox()
+        self.results_input.addItem("Scan results", "scan")
+        self.results_input.addItem("Watch results", "watch")
+        self.results_input.currentIndexChanged.connect(self.show_results)
+        results_layout = QHBoxLayout()
+        results_layout.addWidget(infected_label)
+        results_layout.addStretch()
+        results_layout.addWidget(self.results_input)
+        main_layout.addLayout(results_layout)
 
         # Blue background box for infected files and AV report
         blue_box_frame = QFrame()
         blue_box_frame.setStyleSheet("background-color: #1565C0;")
         blue_box_layout = QHBoxLayout(blue_box_frame)
 
+        # Results of the current scan, paged into the views on demand
+        self.result_store = ResultStore()
+        self.pending_results = deque()
+        # Results of watch mode, kept apart so starting a scan job does not clear them
+        self.watch_store = ResultStore()
+        self.pending_watch_results = deque()
+
+        # Infected files and AV report (one row per file and engine) over either store
+        self.files_model = ResultTableModel(self.result_store, columns=("path", "engine"), verdict=INFECTED)
+        self.report_model = ResultTableModel(self.result_store)
+        self.watch_files_model = ResultTableModel(self.watch_store, columns=("path", "engine"), verdict=INFECTED)
+        self.watch_report_model = ResultTableModel(self.watch_store)
+
         # Infected files display
-        self.files_display = QLabel("Files ...")
-        self.files_display.setStyleSheet(
-            "background-color: white; font-size: 14px; padding: 5px; border: 2px solid black;")
-        self.files_display.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.files_display = self.create_result_view(self.files_model)
+        # Sorting by path lists archive members straight after their archive
+        self.files_display.sortByColumn(0, Qt.SortOrder.AscendingOrder)
 
         # AV report display
-        self.report_display = QLabel("AV Report ...")
-        self.report_display.setStyleSheet(
-            "background-color: white; font-size: 14px; padding: 5px; border: 2px solid black;")
-        self.report_display.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.report_display = self.create_result_view(self.report_model)
 
         blue_box_layout.addWidget(self.files_display)
         blue_box_layout.addWidget(self.report_display)
 
         main_layout.addWidget(blue_box_frame)  # Add the blue box to the main layout
 
+        # Filter for both result views, applied by the result store
+        self.files_filter = QLineEdit()
+        self.files_filter.setPlaceholderText("Filter files ...")
+        self.files_filter.setStyleSheet("background-color: #ADD8E6; font-size: 12px; padding-left: 5px;")
+        self.files_filter.textChanged.connect(self.filter_results)
+
+        # Scan summary
+        self.status_label = QLabel("AV Report ...")
+        self.status_label.setFont(QFont("Palatino Linotype", 10))
+        self.status_label.setWordWrap(True)
+
+        # Collapsible per-stage metrics; metrics are only collected while it is open or exported
+        self.metrics_button = QPushButton("Metrics \u25b8")
+        self.metrics_button.setCheckable(True)
+        self.metrics_button.setStyleSheet("background-color: transparent; border: none; font-size: 12px;")
+        self.metrics_button.toggled.connect(self.toggle_metrics)
+        self.metrics_panel = QPlainTextEdit()
+        self.metrics_panel.setReadOnly(True)
+        self.metrics_panel.setMaximumHeight(120)
+        self.metrics_panel.setStyleSheet("background-color: white; font-family: monospace; font-size: 11px;")
+        self.metrics_panel.hide()
+
+        main_layout.addWidget(self.files_filter)
+        main_layout.addWidget(self.status_label)
+        main_layout.addWidget(self.metrics_button, alignment=Qt.AlignmentFlag.AlignLeft)
+        main_layout.addWidget(self.metrics_panel)
+
         # Action buttons (moved to the bottom-right)
         action_button_layout = QHBoxLayout()
         action_button_layout.addStretch()  # Push buttons to the right
@@ -138,9 +291,46 @@ class ScanWindow(QMainWindow):
         action_button_layout.addWidget(report_button)
         main_layout.addLayout(action_button_layout)
 
-        # Timer for simulating progress bar updates
+        # Verdict cache shared by every scan from this window
+        self.verdict_cache = VerdictCache()
+        self.engine_history = EngineHistory()
+
+        # Queued scans survive restarts; an interrupted job resumes from its checkpoint
+        self.job_queue = JobQueue()
+        self.current_job = None
+        self.cancel_requested = False
+
+        # Current scan, if any
+        self.pipeline = None
+        self.scan_thread = None
+        self.scan_worker = None
+        self.report_writer = None
+        self.last_report = None
+        self.metrics_writer = None
+        self.quarantine_window = None
+        self.detections_quarantined = False
+        # Why the current scan or watch stopped early, if it raised
+        self.scan_error = None
+        self.watch_error = None
+
+        # Watch mode, if on
+        self.watcher = None
+        self.watch_pipeline = None
+        self.watch_thread = None
+        self.watch_worker = None
+        self.watch_latency = None
+        self.watch_report_writer = None
+        self.last_watch_report = None
+
+        # Timer for streaming results into the views; progress bars are refreshed by the shared pump
         self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_progress_bars)
+        self.timer.timeout.connect(self.update_results)
+
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metrics)
+
+        self.refresh_jobs()
+        QTimer.singleShot(0, self.start_next_job)  # Resume whatever an earlier session left unfinished
 
     def create_scan_progress(self, name, progress_value):
         """Create a layout with antivirus name and progress bar."""
@@ -171,6 +361,76 @@ class ScanWindow(QMainWindow):
         self.progress_bars.append(progress_bar)
         return scan_layout
 
+    def create_result_view(self, model):
+        """Create a table view over a lazily fetched result model."""
+        view = QTableView()
+        view.setModel(model)
+        view.setSortingEnabled(True)
+        view.sortByColumn(-1, Qt.SortOrder.AscendingOrder)  # Keep scan order until a header is clicked
+        view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        view.setWordWrap(False)
+        view.verticalHeader().hide()
+        view.verticalHeader().setDefaultSectionSize(20)
+        view.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        view.setStyleSheet("background-color: white; font-size: 12px; border: 2px solid black;")
+        return view
+
+    def filter_results(self, text):
+        """Show only results whose path contains text."""
+        for model in (self.files_model, self.report_model, self.watch_files_model, self.watch_report_model):
+            model.set_filter(text)
+
+    def showing_watch_results(self):
+        return self.results_input.currentData() == "watch"
+
+    def show_results(self):
+        """Point both views at the scan's or watch mode's results, whichever is selected."""
+        if self.showing_watch_results():
+            self.files_display.setModel(self.watch_files_model)
+            self.report_display.setModel(self.watch_report_model)
+        else:
+            self.files_display.setModel(self.files_model)
+            self.report_display.setModel(self.report_model)
+
+    def record_verdict(self, record):
+        """Stream a verdict to the report and queue it for the views; called from scan threads."""
+        self.report_writer.add(record)
+        self.pending_results.append((record.path, record.engine, record.verdict, record.latency))
+
+    def drain_results(self):
+        """Move verdicts from the scan threads into the result stores, within a per-tick time budget."""
+        if not self.pending_results and not self.pending_watch_results:
+            return
+        started = metrics.clock()
+        deadline = time.perf_counter() + RESULT_DRAIN_BUDGET
+        for pending, store, models in (
+                (self.pending_results, self.result_store, (self.files_model, self.report_model)),
+                (self.pending_watch_results, self.watch_store, (self.watch_files_model, self.watch_report_model))):
+            while pending and time.perf_counter() < deadline:
+                rows = []
+                while pending and len(rows) < RESULT_DRAIN_CHUNK:
+                    rows.append(pending.popleft())
+                store.add_many(rows)
+                for model in models:
+                    model.rows_added(rows)
+        metrics.observe("av_stage_seconds", started, stage="gui_drain")
+
+    def toggle_metrics(self, shown):
+        """Expand or collapse the metrics panel, collecting metrics only while it is needed."""
+        self.metrics_button.setText("Metrics \u25be" if shown else "Metrics \u25b8")
+        self.metrics_panel.setVisible(shown)
+        metrics.enabled = shown or self.metrics_writer is not None
+        if shown:
+            self.update_metrics()
+            self.metrics_timer.start(METRICS_REFRESH_INTERVAL)
+        else:
+            self.metrics_timer.stop()
+
+    def update_metrics(self):
+        """Show the current counters, stage latencies and engine queue depths in the panel."""
+        self.metrics_panel.setPlainText(metrics.render_summary())
+
     def browse_folder(self):
         """Open file dialog to select folder."""
         folder_path = QFileDialog.getExistingDirectory(self, "Select Folder")
@@ -178,29 +438,306 @@ class ScanWindow(QMainWindow):
             self.folder_input.setText(folder_path)
 
     def open_infected_folder(self):
-        """Dummy function to open infected folder."""
-        print("Infected Folder button clicked")
+        """Open the quarantine, offering the last finished scan's detections for quarantine."""
+        if self.quarantine_window is None:
+            from quarantine_window import QuarantineWindow
+            self.quarantine_window = QuarantineWindow(self)
+        detections = []
+        if self.pipeline is not None and self.scan_thread is None and not self.detections_quarantined:
+            detections = self.pipeline.detections
+            self.detections_quarantined = True  # Offered once; the window keeps them until quarantined
+        self.quarantine_window.show_detections(detections)
 
     def generate_report(self):
-        """Dummy function to generate the report."""
-        print("Report button clicked")
+        """Open the HTML report of the last finished scan, or of the last watch if its results are shown."""
+        if self.showing_watch_results():
+            if self.last_watch_report is None:
+                self.status_label.setText("Stop watching to write the watch report" if self.watch_thread is not None
+                                          else "Watch a folder first; its report is written while it runs")
+                return
+            QDesktopServices.openUrl(QUrl.fromLocalFile(self.last_watch_report))
+            return
+        if self.last_report is None:
+            self.status_label.setText("Run a scan first; its report is written while it runs")
+            return
+        QDesktopServices.openUrl(QUrl.fromLocalFile(self.last_report))
 
     def start_scanning(self):
-        """Start the scanning process."""
-        self.timer.start(100)  # Update progress bars every 100ms
-
-    def update_progress_bars(self):
-        """Update the progress bars by increasing their values."""
-        all_finished = True
+        """Queue a scan of the selected folder and start it if no other job is running."""
+        folder_path = self.folder_input.text().strip()
+        if not os.path.isdir(folder_path):
+            self.status_label.setText("Select a folder to scan")
+            return
+        self.job_queue.add(os.path.abspath(folder_path), self.priority_input.value(),
+                           self.incremental_checkbox.isChecked())
+        self.results_input.setCurrentIndex(self.results_input.findData("scan"))
+        self.refresh_jobs()
+        self.start_next_job()
+
+    def refresh_jobs(self):
+        """Show every unfinished job with its state and priority."""
+        self.jobs_list.clear()
+        for job in self.job_queue.jobs():
+            item = QListWidgetItem(f"#{job.job_id}  {job.state}  priority {job.priority}  {job.root}")
+            item.setData(Qt.ItemDataRole.UserRole, job.job_id)
+            self.jobs_list.addItem(item)
+
+    def selected_job(self):
+        """Return the job selected in the list, or the running job if none is selected."""
+        item = self.jobs_list.currentItem()
+        if item is not None:
+            return self.job_queue.get(item.data(Qt.ItemDataRole.UserRole))
+        return self.current_job
+
+    def toggle_pause_job(self):
+        """Pause the selected job, or resume it if it is paused."""
+        job = self.selected_job()
+        if job is None:
+            return
+        if self.current_job is not None and job.job_id == self.current_job.job_id:
+            if self.pipeline.is_paused():
+                self.pipeline.resume()
+                self.job_queue.set_state(job.job_id, RUNNING)
+                self.status_label.setText("Scanning ...")
+            else:
+                self.pipeline.pause()
+                self.job_queue.set_state(job.job_id, PAUSED)
+                self.status_label.setText("Scan paused")
+        elif job.state == PAUSED:
+            self.job_queue.set_state(job.job_id, QUEUED)
+            self.start_next_job()
+        elif job.state == QUEUED:
+            self.job_queue.set_state(job.job_id, PAUSED)
+        self.refresh_jobs()
+
+    def cancel_job(self):
+        """Cancel the selected job; a running job stops as soon as its in-flight files return."""
+        job = self.selected_job()
+        if job is None:
+            return
+        if self.current_job is not None and job.job_id == self.current_job.job_id:
+            self.cancel_requested = True
+            self.pipeline.cancel()
+            self.status_label.setText("Cancelling ...")
+        else:
+            self.job_queue.finish(job.job_id, CANCELLED)
+        self.refresh_jobs()
+
+    def start_next_job(self):
+        """Start the highest priority queued job on a background thread, unless one is running."""
+        if self.scan_thread is not None:
+            return
+        job = self.job_queue.next_job()
+        if job is None:
+            return
+        if not os.path.isdir(job.root):
+            self.job_queue.finish(job.job_id, CANCELLED)
+            self.status_label.setText(f"Skipped job #{job.job_id}: {job.root} is not a folder")
+            self.refresh_jobs()
+            self.start_next_job()
+            return
+        self.current_job = job
+        self.cancel_requested = False
+        self.scan_error = None
+        self.detections_quarantined = False
+        self.refresh_jobs()
+
+        engines = create_engines()
+        index = FileIndex(job.root) if job.incremental else None
+        self.pipeline = ScanPipeline(job.root, engines, cache=self.verdict_cache, index=index,
+                                     prefilter=create_prefilter(), checkpoint=self.job_queue.checkpoint(job.job_id),
+                                     consensus=create_policy(self.consensus_input.currentData()),
+                                     history=self.engine_history, telemetry=shared_poller())
+        self.pending_results.clear()
+        self.result_store.clear()
+        self.files_model.reload()
+        self.report_model.reload()
+        self.status_label.setText(f"Scanning {job.root} ...")
+        for index, progress_bar in enumerate(self.progress_bars):
+            progress_bar.setMaximum(1)
+            progress_bar.setValue(0)
+            shared_pump().bind(progress_bar, self.engine_progress_reader(index))
+
+        self.metrics_writer = start_textfile_writer()
+        self.scan_thread = QThread(self)
+        self.report_writer = ReportWriter(job.root)
+        self.scan_worker = ScanWorker(self.pipeline, self.record_verdict)
+        self.scan_worker.moveToThread(self.scan_thread)
+        self.scan_thread.started.connect(self.scan_worker.run)
+        self.scan_worker.failed.connect(self.scan_failed)
+        self.scan_worker.finished.connect(self.scan_finished)
+        self.scan_worker.finished.connect(self.scan_thread.quit)
+        self.scan_worker.finished.connect(self.scan_worker.deleteLater)
+        self.scan_thread.finished.connect(self.scan_thread.deleteLater)
+        self.scan_thread.start()
+
+        self.timer.start(int(1000 / FRAMES_PER_SECOND))
+
+    def engine_progress_reader(self, index):
+        """Return a pump reader showing files done out of files found so far for one engine."""
+        pipeline = self.pipeline
+
+        def read():
+            done, total = pipeline.engine_progress[index].snapshot()
+            queue_depth, in_flight, files_per_second = pipeline.engine_stats()[index]
+            return done, max(total, 1), f"%v/%m  queued {queue_depth}  {files_per_second:.0f} files/s"
+        return read
+
+    def update_results(self):
+        """Stream new results into the views until the scan is over and all are shown."""
+        self.drain_results()
+        if self.watch_thread is not None and self.scan_thread is None:
+            self.status_label.setText(self.watch_status())
+        if self.scan_thread is None and self.watch_thread is None and not self.pending_results \
+                and not self.pending_watch_results:
+            self.timer.stop()
+
+    def toggle_watch(self, watching):
+        if watching:
+            self.start_watch()
+        elif self.watcher is not None:
+            self.watcher.stop()  # The pipeline finishes the files already seen, then watch_finished() runs
+
+    def start_watch(self):
+        """Watch the selected folder and scan files as they are created or changed."""
+        folder_path = self.folder_input.text().strip()
+        if not os.path.isdir(folder_path) or self.watch_thread is not None:
+            self.status_label.setText("Select a folder to watch")
+            self.watch_button.setChecked(False)
+            return
+        root = os.path.abspath(folder_path)
+        engines = create_engines()
+        self.watch_latency = WatchLatency(len(engines))
+        try:
+            self.watcher = FolderWatcher(root, latency=self.watch_latency)
+        except OSError as error:
+            for engine in engines:
+                engine.close()
+            self.status_label.setText(f"Cannot watch {root}: {error.strerror}")
+            self.watch_button.setChecked(False)
+            return
+        self.watch_pipeline = ScanPipeline(root, engines, cache=self.verdict_cache, index=FileIndex(root),
+                                           prefilter=create_prefilter(),
+                                           consensus=create_policy(self.consensus_input.currentData()),
+                                           history=self.engine_history, source=self.watcher,
+                                           telemetry=shared_poller())
+        self.pending_watch_results.clear()
+        self.watch_store.clear()
+        self.watch_files_model.reload()
+        self.watch_report_model.reload()
+        self.results_input.setCurrentIndex(self.results_input.findData("watch"))
+        self.watch_report_writer = ReportWriter(root)
+        self.watch_error = None
+        self.watch_thread = QThread(self)
+        self.watch_worker = ScanWorker(self.watch_pipeline, self.record_watch_verdict)
+        self.watch_worker.moveToThread(self.watch_thread)
+        self.watch_thread.started.connect(self.watch_worker.run)
+        self.watch_worker.failed.connect(self.watch_failed)
+        self.watch_worker.finished.connect(self.watch_finished)
+        self.watch_worker.finished.connect(self.watch_thread.quit)
+        self.watch_worker.finished.connect(self.watch_worker.deleteLater)
+        self.watch_thread.finished.connect(self.watch_thread.deleteLater)
+        self.watch_thread.start()
+        self.status_label.setText(self.watch_status())
+        self.timer.start(int(1000 / FRAMES_PER_SECOND))
+
+    def watch_status(self):
+        files, median, slowest, detections, detection_median = self.watch_latency.summary()
+        status = (f"Watching {self.watcher.root} ({self.watcher.watched_directories()} folders) | "
+                  f"Files scanned: {files} | Change to verdict: median {median * 1000:.0f} ms, "
+                  f"95% {slowest * 1000:.0f} ms | Detections: {detections}")
+        if detections:
+            status += f", median {detection_median * 1000:.0f} ms after the change"
+        if self.watcher.unwatched:
+            status += f" | {self.watcher.unwatched} folders not watched (inotify watch limit reached)"
+        return status
+
+    def record_watch_verdict(self, record):
+        """Stream a watch mode verdict to its report, queue it for the views and time it; called from scan threads."""
+        self.watch_latency.verdict(record)
+        self.watch_report_writer.add(record)
+        self.pending_watch_results.append((record.path, record.engine, record.verdict, record.latency))
+
+    def watch_failed(self, error):
+        self.watch_error = error
+
+    def watch_finished(self):
+        self.watch_thread = None
+        self.watch_worker = None
+        status = self.watch_status().replace("Watching", "Stopped watching", 1)
+        if self.watch_error is not None:
+            self.watcher.stop()
+            status = f"Watch failed: {self.watch_error} | " + status
+        self.last_watch_report = self.watch_report_writer.close()
+        self.watch_report_writer = None
+        self.watch_pipeline.index.close()
+        self.watch_pipeline.prefilter.close()
+        for engine in self.watch_pipeline.engines:
+            engine.close()
+        self.watcher = None
+        self.watch_pipeline = None
+        self.watch_button.setChecked(False)
+        if self.scan_thread is None:
+            self.status_label.setText(status)
+
+    def scan_failed(self, error):
+        self.scan_error = error
+
+    def scan_finished(self):
+        """Summarise the finished scan; the timer keeps draining results until none are left."""
+        self.scan_thread = None
+        self.scan_worker = None
+        pump = shared_pump()
+        pump.refresh()
         for progress_bar in self.progress_bars:
-            if progress_bar.value() < 100:
-                progress_bar.setValue(progress_bar.value() + 1)  # Increment by 1
-                all_finished = False
-
-        if all_finished:
-            self.timer.stop()  # Stop updating when all progress bars reach 100
+            pump.unbind(progress_bar)
+        files_total, files_done, walk_finished = self.pipeline.progress()
+        if self.pipeline.index is not None:
+            self.pipeline.index.close()
+        saved = self.pipeline.prefilter.saved()
+        self.pipeline.prefilter.close()
+        self.pipeline.checkpoint.close()
+        failed = self.scan_error is not None
+        interrupted = self.pipeline.is_cancelled() and not self.cancel_requested and not failed
+        if not self.pipeline.is_cancelled():
+            self.job_queue.finish(self.current_job.job_id, DONE)
+        elif self.cancel_requested or failed:
+            # A job that raised would most likely raise again, so it is not queued to resume
+            self.job_queue.finish(self.current_job.job_id, CANCELLED)
+        else:
+            self.job_queue.set_state(self.current_job.job_id, QUEUED)  # Keeps its checkpoint to resume from
+        self.current_job = None
+        for engine in self.pipeline.engines:
+            engine.close()
+        self.last_report = self.report_writer.close()
+        if self.metrics_writer is not None:
+            self.metrics_writer.stop()
+            self.metrics_writer = None
+            metrics.enabled = self.metrics_button.isChecked()
+        if failed:
+            status = f"Scan failed: {self.scan_error}"
+        else:
+            status = "Scan cancelled" if self.pipeline.is_cancelled() else "Scan complete"
+        self.status_label.setText(
+            f"{status} | "
+            f"Files scanned: {files_total} | "
+            f"Files completed before resuming: {self.pipeline.files_resumed} | "
+            f"Detections: {len(self.pipeline.detections)} | "
+            f"Cache hit rate: {self.pipeline.cache_hit_rate():.1%} | "
+            f"Files skipped (fully cached): {self.pipeline.files_skipped} | "
+            f"Files not scanned (pre-filter policy): {self.pipeline.files_not_scanned} | "
+            f"Files unchanged since last scan: {self.pipeline.files_unchanged} | "
+            f"Archive members scanned: {self.pipeline.members_scanned} | "
+            f"Hashing large files: {self.pipeline.hash_stats.throughput(LARGE):.1f} MB/s | "
+            f"Hashing small files: {self.pipeline.hash_stats.throughput(SMALL):.1f} MB/s | "
+            f"Submissions saved by pre-filter: {sum(saved.values())}"
+            + "".join(f", {count} {rule}" for rule, count in sorted(saved.items()))
+            + f" | Submissions saved by consensus: {self.pipeline.consensus_saved}")
+        self.refresh_jobs()
+        if not interrupted:
+            self.start_next_job()
 
     def go_back(self):
-        """Go back to the main application window."""
+        """Go back to the main application window; queued jobs keep running in the background."""
         self.parent.show()
         self.close()
@@ -0,0 +1,148 @@
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import tarfile
+import zipfile
+
+from archives import MEMBER_SEPARATOR
+from engines import EICAR_SIGNATURE
+
+MANIFEST_NAME = "manifest.json"
+
+# Tiny files are spread over directories of this many files each
+FILES_PER_DIR = 1000
+
+DEFAULT_PARAMETERS = {
+    "seed": 0,
+    "tiny_files": 20000,
+    "max_tiny_size": 512,
+    "huge_files": 2,
+    "huge_size": 256 * 1024 * 1024,
+    "depth": 64,
+    "archives": 20,
+    "eicar_files": 10,
+}
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def generate_corpus(root, **parameters):
+    """Create a reproducible synthetic tree under root and return its manifest.
+
+    The same parameters always give byte-identical trees, so results can be
+    compared between commits. The tree holds many tiny files, a few huge
+    files, one deeply nested chain of folders, zip and tar.gz archives and
+    planted EICAR samples (including one inside an archive). If root already
+    holds a corpus with the same parameters it is reused as is; a corpus
+    made with other parameters, or left unfinished, is removed first. A
+    non-empty root that holds no corpus is refused with ValueError.
+
+    The manifest's infected list holds every path a scan should report,
+    archive members included.
+    """
+    parameters = {**DEFAULT_PARAMETERS, **parameters}
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest["parameters"] == parameters and "files" in manifest:
+            return manifest
+        shutil.rmtree(root)
+    elif os.path.isdir(root) and os.listdir(root):
+        raise ValueError(f"{root} is not empty and holds no synthetic corpus")
+    # Written before anything else, so an interrupted run leaves a tree that is known to be a corpus
+    _write(manifest_path, json.dumps({"parameters": parameters}).encode("utf-8"))
+
+    rng = random.Random(parameters["seed"])
+    files = 0
+    total_bytes = 0
+    infected = []
+
+    tiny_paths = []
+    for number in range(parameters["tiny_files"]):
+        path = os.path.join(root, "tiny", f"d{number // FILES_PER_DIR:05d}", f"f{number:08d}.bin")
+        data = rng.randbytes(rng.randint(0, parameters["max_tiny_size"]))
+        _write(path, data)
+        tiny_paths.append(path)
+        files += 1
+        total_bytes += len(data)
+
+    # Overwrite a random selection of tiny files with the EICAR test string
+    for path in rng.sample(tiny_paths, min(parameters["eicar_files"], len(tiny_paths))):
+        total_bytes += len(EICAR_SIGNATURE) - os.path.getsize(path)
+        _write(path, EICAR_SIGNATURE)
+        infected.append(path)
+
+    chunk_size = 4 * 1024 * 1024
+    for number in range(parameters["huge_files"]):
+        path = os.path.join(root, "huge", f"image{number:02d}.img")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            remaining = parameters["huge_size"]
+            while remaining:
+                chunk = rng.randbytes(min(chunk_size, remaining))
+                file.write(chunk)
+                remaining -= len(chunk)
+        files += 1
+        total_bytes += parameters["huge_size"]
+
+    deep_dir = os.path.join(root, "deep", *[f"level{level:03d}" for level in range(parameters["depth"])])
+    deep_data = rng.randbytes(256)
+    _write(os.path.join(deep_dir, "bottom.bin"), deep_data)
+    files += 1
+    total_bytes += len(deep_data)
+
+    for number in range(parameters["archives"]):
+        members = {f"member{member:02d}.bin": rng.randbytes(rng.randint(64, 64 * 1024)) for member in range(8)}
+        if number == 0:
+            members["nested/eicar.com"] = EICAR_SIGNATURE
+        buffer = io.BytesIO()
+        if number % 2 == 0:
+            name = f"archive{number:03d}.zip"
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+                for member, data in members.items():
+                    archive.writestr(member, data)
+        else:
+            name = f"archive{number:03d}.tar.gz"
+            with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+                for member, data in members.items():
+                    info = tarfile.TarInfo(member)
+                    info.size = len(data)
+                    info.mtime = 0
+                    archive.addfile(info, io.BytesIO(data))
+        path = os.path.join(root, "archives", name)
+        _write(path, buffer.getvalue())
+        if number == 0:
+            infected.append(path + MEMBER_SEPARATOR + "nested/eicar.com")
+        files += 1
+        total_bytes += len(buffer.getvalue())
+
+    manifest = {
+        "parameters": parameters,
+        "files": files,
+        "bytes": total_bytes,
+        "infected": sorted(infected),
+        "infected_archive": os.path.join(root, "archives", "archive000.zip") if parameters["archives"] else None,
+    }
+    with open(manifest_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a reproducible synthetic scan corpus.")
+    parser.add_argument("root")
+    for name, default in DEFAULT_PARAMETERS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+    root = args.root
+    parameters = {name: getattr(args, name) for name in DEFAULT_PARAMETERS}
+    manifest = generate_corpus(root, **parameters)
+    print(f"{manifest['files']} files, {manifest['bytes'] / 1e6:.1f} MB, {len(manifest['infected'])} EICAR samples")
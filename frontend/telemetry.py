@@ -0,0 +1,367 @@
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from engines import ENGINE_HOSTS, ENGINE_NAMES
+from metrics import metrics
+
+# Seconds between polls of a busy host, and at most between polls of an idle or unreachable one
+MIN_POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 10.0
+
+# CPU use from which a host counts as busy and is polled faster
+BUSY_CPU = 0.5
+
+# Files queued at an engine agent that weigh as much as a fully used CPU in a host's load
+QUEUE_PER_LOAD = 64
+
+# Load of a host whose agent does not answer, so load-aware dispatch asks it last
+UNREACHABLE_LOAD = 10.0
+
+# HostTelemetry.address of an engine without an agent, whose figures are sampled from this machine
+LOCAL_ADDRESS = "local"
+
+_SECTOR_SIZE = 512
+
+
+class HostTelemetry(namedtuple("HostTelemetry", "name address cpu cores memory_used memory_total disk_read "
+                                                "disk_write queue updated error")):
+    """Latest numbers from one engine VM's agent.
+
+    cpu is the busy fraction over all cores, memory is in bytes, disk_read and
+    disk_write are bytes per second and queue is the files waiting at the
+    engine. Figures the agent could not measure are None. error is set while
+    the agent does not answer; the other fields then keep their last values.
+    """
+    __slots__ = ()
+
+    @property
+    def load(self):
+        if self.error is not None:
+            return UNREACHABLE_LOAD
+        return (self.cpu or 0.0) + (self.queue or 0) / QUEUE_PER_LOAD
+
+
+class HostSampler:
+    """Reads this host's CPU, memory and disk I/O from /proc; CPU and disk are averaged since the last sample."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = None
+
+    def sample(self):
+        """Return the stats dict an agent answers STATS with, queue excluded."""
+        now = time.monotonic()
+        cpu_busy, cpu_total = _read_cpu()
+        sectors_read, sectors_written = _read_disks()
+        memory_used, memory_total = _read_memory()
+        with self._lock:
+            last, self._last = self._last, (now, cpu_busy, cpu_total, sectors_read, sectors_written)
+        cpu = disk_read = disk_write = None
+        if last is not None:
+            elapsed = now - last[0]
+            if cpu_total is not None and cpu_total > last[2]:
+                cpu = (cpu_busy - last[1]) / (cpu_total - last[2])
+            if sectors_read is not None and elapsed > 0:
+                disk_read = (sectors_read - last[3]) * _SECTOR_SIZE / elapsed
+                disk_write = (sectors_written - last[4]) * _SECTOR_SIZE / elapsed
+        return {"cpu": cpu, "cores": os.cpu_count(), "memory_used": memory_used, "memory_total": memory_total,
+                "disk_read": disk_read, "disk_write": disk_write}
+
+
+def _read_cpu():
+    try:
+        with open("/proc/stat") as file:
+            fields = [int(value) for value in file.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None, None
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+    return sum(fields) - idle, sum(fields)
+
+
+def _read_memory():
+    values = {}
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                key, _, rest = line.partition(":")
+                values[key] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None, None
+    total = values.get("MemTotal")
+    available = values.get("MemAvailable", values.get("MemFree"))
+    if total is None or available is None:
+        return None, total
+    return total - available, total
+
+
+def _read_disks():
+    """Sectors read and written by whole disks; partitions are left out so nothing is counted twice."""
+    read = written = 0
+    try:
+        with open("/proc/diskstats") as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) > 9 and os.path.exists(f"/sys/block/{fields[2]}"):
+                    read += int(fields[5])
+                    written += int(fields[9])
+    except (OSError, ValueError):
+        return None, None
+    return read, written
+
+
+def telemetry_targets(mode=None):
+    """Return (engine name, host, port) of each engine's agent for an engine mode as create_engines() takes it.
+
+    The in-process "local" engines have no agent, and the pool's VMs come
+    and go; for both the host is None and this machine is sampled instead,
+    for load-aware dispatch only: card_lines() shows no figures for them.
+    """
+    mode = mode or os.environ.get("AV_PIPELINE_ENGINES", "local")
+    if mode in ("local", "pool"):
+        return [(name, None, None) for name in ENGINE_NAMES]
+    if mode == "remote":
+        return list(ENGINE_HOSTS)
+    host, _, port = mode.rpartition(":")
+    return [(name, host, int(port)) for name in ENGINE_NAMES]
+
+
+class _AgentPool:
+    """Up to size connections to one agent, kept open and reused from poll to poll."""
+
+    def __init__(self, host, port, size, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []
+        self._ids = itertools.count(1)
+
+    async def stats(self):
+        async with self._slots:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                self.connections_opened += 1
+            try:
+                request_id = next(self._ids)
+                writer.write(f"STATS {request_id}\n".encode())
+                await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not line:
+                    raise ConnectionError("agent closed the connection")
+                reply_id, _, body = line.decode().partition(" ")
+                if int(reply_id) != request_id:
+                    raise ValueError(f"reply {reply_id} to request {request_id}")
+                stats = json.loads(body)
+                if not isinstance(stats, dict):
+                    raise ValueError(f"stats reply is not an object: {body[:80]!r}")
+            except BaseException:
+                writer.close()
+                raise
+            self._idle.append((reader, writer))
+            return stats
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+class TelemetryPoller:
+    """Polls every engine VM's agent for CPU, memory, disk I/O and engine queue length.
+
+    Polling runs on a background asyncio loop, one task per agent, each with
+    a small pool of connections that stay open between polls. Engines with
+    no agent share one task that samples this machine once per poll, so they
+    all get the same reading. The interval
+    adapts per host: it halves while the host is busy (CPU above BUSY_CPU or
+    files queued) down to min_interval, and grows by half while it is idle up
+    to max_interval; an agent that does not answer is retried every
+    max_interval. snapshot() and loads() only read the latest results, so
+    the GUI and the scan threads never wait on the network.
+    """
+
+    def __init__(self, targets=None, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL, pool_size=2,
+                 timeout=2.0):
+        self.targets = telemetry_targets() if targets is None else list(targets)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.polls = 0
+
+        # Replaced, never changed in place, so readers need no lock
+        self._latest = {}
+        self._intervals = {}
+        self._pools = []
+        self._loop = None
+        self._thread = None
+        self._wake = None
+
+    def start(self):
+        """Start polling on a background event loop; returns self."""
+        if self._thread is not None:
+            return self
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._wake = asyncio.Event()
+            local = [name for name, host, _ in self.targets if host is None]
+            tasks = [self._loop.create_task(self._poll([name], host, port))
+                     for name, host, port in self.targets if host is not None]
+            if local:
+                tasks.append(self._loop.create_task(self._poll(local, None, None)))
+            started.set()
+            try:
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            finally:
+                for pool in self._pools:
+                    pool.close()
+                self._loop.run_until_complete(asyncio.sleep(0))  # Let the transports close
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="telemetry", daemon=True)
+        self._thread.start()
+        started.wait()
+        metrics.add_gauge("av_vm_cpu_ratio", self._cpu_gauge)
+        metrics.add_gauge("av_vm_engine_queue_length", self._queue_gauge)
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        metrics.remove_gauge("av_vm_cpu_ratio", self._cpu_gauge)
+        metrics.remove_gauge("av_vm_engine_queue_length", self._queue_gauge)
+
+        def cancel():
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+
+        self._loop.call_soon_threadsafe(cancel)
+        self._thread.join()
+        self._thread = None
+
+    def poll_now(self):
+        """Poll every agent at once instead of waiting for its next turn."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake_all)
+
+    def snapshot(self):
+        """Return {engine name: HostTelemetry} for every agent polled so far."""
+        return self._latest
+
+    def loads(self):
+        """Return {engine name: load}: CPU use plus queued files, UNREACHABLE_LOAD for a silent agent."""
+        return {name: telemetry.load for name, telemetry in self._latest.items()}
+
+    def interval(self, name):
+        return self._intervals.get(name, self.min_interval)
+
+    def _wake_all(self):
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    async def _poll(self, names, host, port):
+        """Poll the agent at host:port, or sample this machine if host is None, for every engine in names."""
+        pool = sampler = None
+        if host is not None:
+            pool = _AgentPool(host, port, self.pool_size, self.timeout)
+            self._pools.append(pool)
+        else:
+            sampler = HostSampler()
+        address = f"{host}:{port}" if host is not None else LOCAL_ADDRESS
+        interval = self.min_interval
+        while True:
+            latest = {}
+            try:
+                if pool is None:
+                    stats = dict(sampler.sample(), queue=0)
+                else:
+                    stats = await pool.stats()
+                telemetry = HostTelemetry(None, address, stats.get("cpu"), stats.get("cores"),
+                                          stats.get("memory_used"), stats.get("memory_total"),
+                                          stats.get("disk_read"), stats.get("disk_write"), stats.get("queue", 0),
+                                          time.time(), None)
+                if (telemetry.cpu or 0.0) >= BUSY_CPU or telemetry.queue:
+                    interval = max(self.min_interval, interval / 2)
+                else:
+                    interval = min(self.max_interval, interval * 1.5)
+                latest = {name: telemetry._replace(name=name) for name in names}
+            except (OSError, ValueError, TypeError, asyncio.TimeoutError) as error:
+                message = str(error) or type(error).__name__
+                for name in names:
+                    previous = self._latest.get(name)
+                    if previous is None:
+                        latest[name] = HostTelemetry(name, address, None, None, None, None, None, None, None,
+                                                     time.time(), message)
+                    else:
+                        latest[name] = previous._replace(error=message)
+                interval = self.max_interval
+            self._latest = {**self._latest, **latest}
+            self._intervals = {**self._intervals, **dict.fromkeys(names, interval)}
+            self.polls += 1
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _cpu_gauge(self):
+        return {(("engine", name),): telemetry.cpu for name, telemetry in self._latest.items()
+                if telemetry.cpu is not None}
+
+    def _queue_gauge(self):
+        return {(("engine", name),): telemetry.queue for name, telemetry in self._latest.items()
+                if telemetry.queue is not None}
+
+
+_shared_poller = None
+_shared_lock = threading.Lock()
+
+
+def shared_poller():
+    """Return the poller of the configured engines' agents shared by every window, started on first use."""
+    global _shared_poller
+    with _shared_lock:
+        if _shared_poller is None:
+            _shared_poller = TelemetryPoller().start()
+        return _shared_poller
+
+
+def _gigabytes(value):
+    return "?" if value is None else f"{value / 1024 ** 3:.1f}"
+
+
+def _rate(value):
+    if value is None:
+        return "?"
+    if value < 1024 * 1024:
+        return f"{value / 1024:.0f} KB/s"
+    return f"{value / 1024 ** 2:.1f} MB/s"
+
+
+def card_lines(telemetry):
+    """Return the RAM, P-cores, CPU and disk lines of a VM or AV card for one agent's telemetry."""
+    if telemetry.address == LOCAL_ADDRESS:
+        # In-process engines have no VM; this machine's figures would be shown on every card
+        return {"ram": "RAM: n/a", "cores": "P-cores: n/a", "load": "CPU: n/a", "disk": "Disk I/O: n/a"}
+    if telemetry.error is not None and telemetry.cpu is None:
+        return {"ram": "RAM: ?", "cores": "P-cores: ?", "load": "CPU: agent offline", "disk": "Disk I/O: ?"}
+    cpu = "?" if telemetry.cpu is None else f"{telemetry.cpu:.0%}"
+    return {
+        "ram": f"RAM: {_gigabytes(telemetry.memory_used)} / {_gigabytes(telemetry.memory_total)} GB",
+        "cores": f"P-cores: {telemetry.cores or '?'}",
+        "load": f"CPU: {cpu} | Queue: {telemetry.queue}" + (" (offline)" if telemetry.error else ""),
+        "disk": f"Disk I/O: {_rate(telemetry.disk_read)} in, {_rate(telemetry.disk_write)} out",
+    }
+
+
+metrics.describe("av_vm_cpu_ratio", "CPU use of each engine VM reported by its agent.")
+metrics.describe("av_vm_engine_queue_length", "Files waiting at each engine VM's agent.")
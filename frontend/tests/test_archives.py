@@ -0,0 +1,122 @@
+import io
+import os
+import struct
+import zipfile
+
+import pytest
+
+from archives import CORRUPT, MAX_DEPTH, DEPTH_LIMIT, MEMBER_LIMIT, RATIO_LIMIT, SIZE_LIMIT, ArchiveLimits, \
+    iter_members
+from engines import EICAR_SIGNATURE, ERROR, INFECTED, SignatureEngine
+from scan_engine import ScanPipeline
+
+
+def _zip(members, compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _encrypted(data):
+    """Set the encrypted flag on every member of a zip, in the local headers and the central directory."""
+    data = bytearray(data)
+    for signature, flag_offset in ((b"PK\x03\x04", 6), (b"PK\x01\x02", 8)):
+        start = 0
+        while (start := data.find(signature, start)) != -1:
+            flags, = struct.unpack_from("<H", data, start + flag_offset)
+            struct.pack_into("<H", data, start + flag_offset, flags | 1)
+            start += 4
+    return bytes(data)
+
+
+def _members(data, limits=None):
+    return list(iter_members("a.zip", limits or ArchiveLimits(), io.BytesIO(data)))
+
+
+def test_members_are_read_in_memory():
+    members = _members(_zip({"x.txt": b"hello", "dir/y.bin": EICAR_SIGNATURE}))
+    assert {member.path: member.data for member in members} == {
+        "a.zip!/x.txt": b"hello", "a.zip!/dir/y.bin": EICAR_SIGNATURE}
+
+
+def test_nested_archives_stop_at_the_depth_limit():
+    data = _zip({"leaf.txt": b"x"})
+    for level in range(MAX_DEPTH + 1):
+        data = _zip({f"level{level}.zip": data})
+    assert [member for member in _members(data) if member.reason == DEPTH_LIMIT]
+
+
+def test_compression_ratio_limit():
+    members = _members(_zip({"bomb.txt": b"\0" * (10 * 1024 * 1024)}))
+    assert [member.reason for member in members] == [RATIO_LIMIT]
+
+
+def test_expanded_size_limit():
+    limits = ArchiveLimits(max_expanded_size=1000)
+    members = _members(_zip({"a": os.urandom(800), "b": os.urandom(800)}, zipfile.ZIP_STORED), limits)
+    assert SIZE_LIMIT in [member.reason for member in members]
+
+
+def test_member_size_limit_skips_only_that_member():
+    limits = ArchiveLimits(max_member_size=100)
+    members = _members(_zip({"big": os.urandom(200), "small": b"ok"}, zipfile.ZIP_STORED), limits)
+    assert [(member.path, member.reason) for member in members] == [("a.zip!/big", MEMBER_LIMIT),
+                                                                     ("a.zip!/small", None)]
+
+
+@pytest.mark.parametrize("damage", ["encrypted", "truncated", "bad-deflate", "unknown-method"])
+def test_corrupt_archives_are_reported_not_raised(damage):
+    data = _zip({"x.txt": os.urandom(4096)})
+    if damage == "encrypted":
+        data = _encrypted(data)
+    elif damage == "truncated":
+        data = data[:len(data) // 2]
+    elif damage == "bad-deflate":
+        start = data.find(b"x.txt") + len(b"x.txt")
+        data = data[:start] + bytes(64) + data[start + 64:]
+    else:
+        data = bytearray(data)
+        for signature, offset in ((b"PK\x03\x04", 8), (b"PK\x01\x02", 10)):
+            struct.pack_into("<H", data, data.find(signature) + offset, 99)
+        data = bytes(data)
+    assert _members(data)[-1].reason == CORRUPT
+
+
+def test_an_encrypted_zip_does_not_cost_its_batch_their_verdicts(tmp_path):
+    for n in range(20):
+        (tmp_path / f"clean{n}.txt").write_bytes(b"clean %d" % n)
+    for n in range(5):
+        (tmp_path / f"eicar{n}.com").write_bytes(EICAR_SIGNATURE)
+    (tmp_path / "locked.zip").write_bytes(_encrypted(_zip({"inner.txt": b"secret"})))
+
+    verdicts = []
+    pipeline = ScanPipeline(str(tmp_path), [SignatureEngine("test")])
+    pipeline.run(on_verdict=verdicts.append)
+
+    by_path = {record.path[len(str(tmp_path)) + 1:]: record.verdict for record in verdicts}
+    assert {f"clean{n}.txt" for n in range(20)} | {f"eicar{n}.com" for n in range(5)} <= set(by_path)
+    assert sorted(path for path, verdict in by_path.items() if verdict == INFECTED) == [
+        f"eicar{n}.com" for n in range(5)]
+    assert by_path["locked.zip!/"] == ERROR
+
+
+def test_a_file_whose_scan_raises_gets_error_and_the_batch_finishes(tmp_path, monkeypatch):
+    import scan_engine
+
+    def broken(path, limits):
+        raise MemoryError("simulated")
+        yield
+
+    monkeypatch.setattr(scan_engine, "iter_members", broken)
+    (tmp_path / "any.zip").write_bytes(_zip({"x": b"x"}))
+    (tmp_path / "eicar.com").write_bytes(EICAR_SIGNATURE)
+    verdicts = []
+    done = []
+    ScanPipeline(str(tmp_path), [SignatureEngine("test")]).run(on_verdict=verdicts.append, on_file_done=done.append)
+
+    by_path = {record.path[len(str(tmp_path)) + 1:]: record.verdict for record in verdicts}
+    assert by_path["eicar.com"] == INFECTED
+    assert by_path["any.zip!/"] == ERROR
+    assert sorted(os.path.basename(path) for path in done) == ["any.zip", "eicar.com"]
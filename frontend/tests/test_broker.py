@@ -0,0 +1,118 @@
+import json
+import socket
+import threading
+
+import pytest
+
+from broker import ScanCoordinator, check_worker_message, parse_address
+from engines import CLEAN
+from scan_worker import BrokerWorker
+
+
+class _Client:
+    """A worker speaking the broker's JSON lines by hand."""
+
+    def __init__(self, address, name):
+        self.sock = socket.create_connection(parse_address(address)[1], timeout=10)
+        self.lines = self.sock.makefile("rb")
+        self.send({"op": "hello", "worker": name})
+
+    def send(self, message):
+        self.sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def lease(self):
+        self.send({"op": "lease"})
+        return json.loads(self.lines.readline())
+
+    def close(self):
+        self.lines.close()
+        self.sock.close()
+
+
+def test_expired_lease_is_given_to_another_worker(tmp_path):
+    for n in range(3):
+        (tmp_path / f"file{n}.txt").write_bytes(b"content")
+    coordinator = ScanCoordinator(str(tmp_path), "127.0.0.1:0", engine_names=["Engine"], lease_seconds=0.2)
+    coordinator.listen()
+    records = []
+    scan = threading.Thread(target=coordinator.run, kwargs={"on_verdict": records.append})
+    scan.start()
+
+    stalled = _Client(coordinator.address, "stalled")
+    first = stalled.lease()
+    # The stalled worker keeps its connection but never renews, so only the lease deadline frees the batch
+    second_worker = _Client(coordinator.address, "second")
+    second = second_worker.lease()
+    assert second["id"] == first["id"] and sorted(second["paths"]) == sorted(first["paths"])
+    # Late results from the worker that lost the lease count once with the new holder's
+    stalled.send({"op": "results", "records": [[first["id"], path, "Engine", CLEAN, 7, 0.0, False, ""]
+                                               for path in first["paths"]]})
+    second_worker.send({"op": "results", "records": [[second["id"], path, "Engine", CLEAN, 7, 0.0, False, ""]
+                                                     for path in second["paths"]]})
+    second_worker.send({"op": "ack", "id": second["id"]})
+    scan.join(10)
+    assert not scan.is_alive()
+    stalled.close()
+    second_worker.close()
+
+    assert coordinator.batches_retried == 1
+    assert sorted(record.path for record in records) == sorted(first["paths"])
+    assert coordinator.progress() == (3, [3], True)
+
+
+@pytest.mark.parametrize("message", [
+    [], "lease", {"op": "ack"}, {"op": "ack", "id": "1"}, {"op": "renew", "ids": 3},
+    {"op": "results", "records": [[1, "path", "Engine"]]},
+    {"op": "results", "records": [[1, "path", "Engine", CLEAN, "7", 0.0, False, ""]]},
+    {"op": "unknown"},
+], ids=repr)
+def test_malformed_worker_messages_are_rejected(message):
+    with pytest.raises(ValueError):
+        check_worker_message(message)
+
+
+def test_malformed_message_drops_the_worker_and_requeues_its_batch(tmp_path):
+    (tmp_path / "file.txt").write_bytes(b"content")
+    # A lease long enough that only the dropped connection can free the batch in time
+    coordinator = ScanCoordinator(str(tmp_path), "127.0.0.1:0", engine_names=["Engine"], lease_seconds=60.0)
+    coordinator.listen()
+    scan = threading.Thread(target=coordinator.run)
+    scan.start()
+
+    broken = _Client(coordinator.address, "broken")
+    first = broken.lease()
+    broken.send({"op": "ack"})
+    assert broken.lines.readline() == b""  # Disconnected
+    broken.close()
+
+    second_worker = _Client(coordinator.address, "second")
+    second = second_worker.lease()
+    assert second["id"] == first["id"]
+    second_worker.send({"op": "results", "records": [[second["id"], second["paths"][0], "Engine", CLEAN, 7, 0.0,
+                                                      False, ""]]})
+    second_worker.send({"op": "ack", "id": second["id"]})
+    scan.join(10)
+    assert not scan.is_alive()
+    second_worker.close()
+    assert coordinator.batches_retried == 1
+
+
+def test_worker_leaves_a_coordinator_that_sends_garbage():
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def coordinator():
+        connection, _ = listener.accept()
+        with connection, connection.makefile("rb") as lines:
+            lines.readline()  # hello
+            lines.readline()  # lease
+            connection.sendall(b'["not", "a", "batch"]\n')
+            lines.read()  # Until the worker hangs up
+
+    thread = threading.Thread(target=coordinator, daemon=True)
+    thread.start()
+    worker = BrokerWorker("127.0.0.1:%d" % listener.getsockname()[1], engines="local")
+    worker.run_once()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert worker.files_done == 0
+    listener.close()
@@ -0,0 +1,37 @@
+import pytest
+
+from consensus import Agreement, AllEngines, FastClean, create_policy
+from engines import CLEAN, ENGINE_NAMES, SKIPPED, SignatureEngine
+from scan_engine import ScanPipeline
+
+
+def test_fast_clean_fanout_follows_fallback_for_risky_types():
+    assert FastClean().fanout_for(".txt") == 1
+    assert FastClean().fanout_for(".exe") == AllEngines().fanout_for(".exe") is None
+    assert FastClean(Agreement(2)).fanout_for(".exe") == 2
+
+
+@pytest.mark.parametrize("spec", ["agree:0", f"agree:{len(ENGINE_NAMES) + 1}", "agree:-1", "agree:two",
+                                  "fast-clean+agree:0", "majority"])
+def test_create_policy_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        create_policy(spec)
+
+
+def test_create_policy_accepts_every_engine_count():
+    for count in range(1, len(ENGINE_NAMES) + 1):
+        assert create_policy(f"agree:{count}").count == count
+    assert create_policy("fast-clean+agree:2").name == "fast-clean+agree:2"
+
+
+def test_fast_clean_skips_engines_only_for_low_risk_files(tmp_path):
+    (tmp_path / "notes.txt").write_bytes(b"notes")
+    (tmp_path / "setup.exe").write_bytes(b"MZ program")
+    records = []
+    engines = [SignatureEngine(name) for name in ENGINE_NAMES]
+    ScanPipeline(str(tmp_path), engines, consensus=FastClean()).run(on_verdict=records.append)
+    verdicts = {}
+    for record in records:
+        verdicts.setdefault(record.path[len(str(tmp_path)) + 1:], []).append(record.verdict)
+    assert sorted(verdicts["notes.txt"]) == sorted([CLEAN] + [SKIPPED] * (len(ENGINE_NAMES) - 1))
+    assert verdicts["setup.exe"] == [CLEAN] * len(ENGINE_NAMES)
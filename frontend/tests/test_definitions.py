@@ -0,0 +1,101 @@
+import hashlib
+import random
+import struct
+import zlib
+
+import pytest
+
+from definitions import apply_delta, make_delta
+from engine_server import StandInEngineServer
+from engines import CLEAN, RemoteEngine, SignatureEngine
+from verdict_cache import VerdictCache, invalidate_worker_caches
+
+
+def _definitions(seed, records):
+    """Return signature records like an engine's definitions: one name, digest and flags per line."""
+    generator = random.Random(seed)
+    return b"".join(b"sig%07d %s %d\n" % (n, hashlib.sha256(b"%d-%d" % (seed, n)).hexdigest().encode(),
+                                           generator.randrange(1000)) for n in range(records))
+
+
+def _edited(data, seed):
+    """Return data with some records added, removed and replaced here and there."""
+    generator = random.Random(seed)
+    lines = data.splitlines(keepends=True)
+    for _ in range(20):
+        at = generator.randrange(len(lines))
+        lines[at:at + generator.randrange(3)] = [b"sig%07d new %d\n" % (at, generator.randrange(10 ** 9))
+                                                 for _ in range(generator.randrange(3))]
+    return b"".join(lines)
+
+
+def test_delta_round_trip():
+    old = _definitions(1, 5000)
+    new = _edited(old, 2)
+    delta = make_delta(old, new)
+    assert apply_delta(old, delta) == new
+    # Most of new is copied from old, so the delta is a fraction of the full definitions
+    assert len(delta) < len(make_delta(b"", new)) // 4
+
+
+def test_delta_from_nothing_replaces_anything():
+    new = _definitions(3, 1000)
+    delta = make_delta(b"", new)
+    assert apply_delta(b"", delta) == new
+    assert apply_delta(b"whatever the VM had", delta) == new
+
+
+def test_delta_from_other_definitions_is_rejected():
+    old = _definitions(4, 1000)
+    delta = make_delta(old, _edited(old, 5))
+    with pytest.raises(ValueError):
+        apply_delta(_edited(old, 6), delta)
+
+
+@pytest.mark.parametrize("delta", [
+    b"",
+    b"AVD1" + b"not zlib",
+    b"AVD1" + zlib.compress(b"short header"),
+    b"AVD1" + zlib.compress(b"\0" * 72 + b"C" + b"\0" * 4),
+], ids=["no-magic", "not-zlib", "short-header", "short-op"])
+def test_damaged_delta_raises_value_error(delta):
+    with pytest.raises(ValueError):
+        apply_delta(b"old", delta)
+
+
+def test_agent_rejects_short_delta(tmp_path):
+    server = StandInEngineServer(upload_dir=str(tmp_path))
+    digest = "0" * 64
+    (tmp_path / digest).write_bytes(b"AVD1" + zlib.compress(struct.pack(">8s", b"short")))
+    assert not server._update_definitions(digest, "standin-2")
+    assert server.definition_version == "standin-1"
+
+
+def test_invalidate_worker_caches(tmp_path):
+    old, new = SignatureEngine("Engine", "v1"), SignatureEngine("Engine", "v2")
+    for slot in range(3):
+        cache = VerdictCache(str(tmp_path / f"verdict_cache.worker-{slot}.sqlite3"))
+        cache.put("a", old, CLEAN)
+        cache.put("b", new, CLEAN)
+        cache.close()
+
+    assert invalidate_worker_caches("Engine", "v2", str(tmp_path)) == []
+    for slot in range(3):
+        cache = VerdictCache(str(tmp_path / f"verdict_cache.worker-{slot}.sqlite3"))
+        assert cache.get_many("a", [old]) == {}
+        assert cache.get_many("b", [new]) == {"Engine": CLEAN}
+        cache.close()
+    assert invalidate_worker_caches("Engine", "v2", str(tmp_path / "missing")) == []
+
+
+def test_adapter_sees_version_changed_by_another_process():
+    server = StandInEngineServer()
+    server.serve_in_thread()
+    try:
+        engine = RemoteEngine("Engine", server.host, server.port, version_ttl=0.0)
+        assert engine.definition_version == "standin-1"
+        server.definition_version = "standin-2"  # Updated without this process calling note_definitions_changed
+        assert engine.definition_version == "standin-2"
+        engine.close()
+    finally:
+        server.stop()
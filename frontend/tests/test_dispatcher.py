@@ -0,0 +1,48 @@
+import threading
+
+from dispatcher import EngineDispatcher
+from engines import CLEAN, ERROR
+
+
+class FlakyEngine:
+    """Raises on every batch holding a path that starts with "bad"."""
+
+    name = "Flaky"
+
+    def scan_batch(self, paths):
+        if any(path.startswith("bad") for path in paths):
+            raise RuntimeError("engine crashed")
+        return [CLEAN] * len(paths)
+
+
+def test_raising_engine_fails_its_batch_and_keeps_workers():
+    verdicts = {}
+    lock = threading.Lock()
+
+    def on_verdict(index, path, context, verdict, latency):
+        with lock:
+            verdicts[path] = verdict
+
+    dispatcher = EngineDispatcher([FlakyEngine()], on_verdict, max_in_flight=1, max_batch=1)
+    paths = [f"bad{n}" if n % 3 == 0 else f"good{n}" for n in range(30)]
+    for path in paths:
+        dispatcher.submit(0, path)
+    dispatcher.close()
+
+    assert verdicts == {path: ERROR if path.startswith("bad") else CLEAN for path in paths}
+
+
+def test_raising_callback_does_not_cost_the_rest_of_its_batch():
+    seen = []
+    lock = threading.Lock()
+
+    def on_verdict(index, path, context, verdict, latency):
+        with lock:
+            seen.append(path)
+        raise ValueError(path)
+
+    dispatcher = EngineDispatcher([FlakyEngine()], on_verdict, max_in_flight=2, min_batch=8, max_batch=8)
+    for n in range(10):
+        dispatcher.submit(0, f"good{n}")
+    dispatcher.close()
+    assert sorted(seen) == sorted(f"good{n}" for n in range(10))
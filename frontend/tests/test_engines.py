@@ -0,0 +1,152 @@
+import socket
+import threading
+import time
+
+from engine_server import StandInEngineServer
+from engines import CLEAN, ERROR, UNKNOWN_VERSION, RemoteEngine, SignatureEngine
+from verdict_cache import VerdictCache
+from vm_pool import PooledEngine, VMPool
+
+
+class ScriptedHost:
+    """Engine host that answers each request line with reply(request line), for protocol tests."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.connections = 0
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._answer, args=(connection,), daemon=True).start()
+
+    def _answer(self, connection):
+        with connection, connection.makefile("rb") as reader:
+            while line := reader.readline():
+                parts = line.split()
+                if parts[0] == b"SCAN":
+                    reader.read(int(parts[2]))
+                connection.sendall(self.reply(parts))
+
+    def close(self):
+        self._listener.close()
+
+
+def test_unexpected_reply_id_drops_connection(tmp_path):
+    sample = tmp_path / "sample.bin"
+    sample.write_bytes(b"data")
+    host = ScriptedHost(lambda parts: b"999 clean\n")
+    engine = RemoteEngine("Scripted", "127.0.0.1", host.port, timeout=5.0)
+    try:
+        assert engine.scan_batch([str(sample)]) == [ERROR]
+        assert engine.scan_batch([str(sample)]) == [ERROR]
+        # The out of step connection is never reused
+        assert host.connections == 2
+    finally:
+        engine.close()
+        host.close()
+
+
+def test_malformed_version_reply_is_unknown():
+    host = ScriptedHost(lambda parts: b"\n")
+    engine = RemoteEngine("Scripted", "127.0.0.1", host.port, timeout=5.0)
+    try:
+        assert engine.definition_version == UNKNOWN_VERSION
+    finally:
+        host.close()
+
+
+def test_verdicts_not_cached_under_unknown_version():
+    cache = VerdictCache(":memory:")
+    unknown = SignatureEngine("Engine", definition_version=UNKNOWN_VERSION)
+    known = SignatureEngine("Engine")
+    cache.put("digest", unknown, CLEAN)
+    assert len(cache) == 0
+    cache.put("digest", known, CLEAN)
+    assert cache.get_many("digest", [unknown]) == {}
+    assert cache.get_many("digest", [known]) == {"Engine": CLEAN}
+    cache.close()
+
+
+def test_unanswered_version_request_is_not_repeated_by_every_lookup():
+    # Accepts connections into its backlog but never reads or answers them
+    listener = socket.create_server(("127.0.0.1", 0))
+    engine = RemoteEngine("Silent", "127.0.0.1", listener.getsockname()[1], timeout=0.5)
+    cache = VerdictCache(":memory:")
+    try:
+        started = time.monotonic()
+        for _ in range(3):
+            assert cache.get_many("digest", [engine]) == {}
+            cache.put("digest", engine, CLEAN)
+        assert time.monotonic() - started < 1.0  # One timeout, not six
+        assert len(cache) == 0
+    finally:
+        engine.close()
+        cache.close()
+        listener.close()
+
+
+def test_busy_pool_version_is_unknown_for_the_retry_period():
+    pool = VMPool(None, ["Engine"])  # Never started, so no VM is ever free
+    engine = PooledEngine("Engine", pool, timeout=0.3)
+    try:
+        started = time.monotonic()
+        assert engine.definition_version == UNKNOWN_VERSION
+        assert engine.definition_version == UNKNOWN_VERSION
+        assert time.monotonic() - started < 0.6
+        assert pool.waits == 1
+    finally:
+        pool.close()
+
+
+def test_lookup_does_not_hold_the_cache_lock_while_asking_for_a_version():
+    cache = VerdictCache(":memory:")
+    known = SignatureEngine("Known")
+    cache.put("digest", known, CLEAN)
+    asked = threading.Event()
+    release = threading.Event()
+
+    class SlowEngine(SignatureEngine):
+        @property
+        def definition_version(self):
+            asked.set()
+            release.wait(5)
+            return "slow-1"
+
+        @definition_version.setter
+        def definition_version(self, value):
+            pass
+
+    lookup = threading.Thread(target=cache.get_many, args=("digest", [SlowEngine("Slow")]))
+    lookup.start()
+    try:
+        assert asked.wait(5)
+        # Other lookups are answered while the slow engine is still being asked
+        assert cache.get_many("digest", [known]) == {"Known": CLEAN}
+    finally:
+        release.set()
+        lookup.join()
+        cache.close()
+
+
+def test_stand_in_server_answers_malformed_size_with_error():
+    server = StandInEngineServer()
+    server.serve_in_thread()
+    try:
+        for request in [b"SCAN 7 lots\n", b"SCAN 7 -5\n", b"CHUNK 7 " + b"0" * 64 + b" x 4 checksum\n"]:
+            with socket.create_connection((server.host, server.port), timeout=5) as connection:
+                connection.sendall(request)
+                assert connection.makefile("rb").readline() == b"7 " + ERROR.encode() + b"\n"
+        # The server is still answering
+        engine = RemoteEngine("Engine", server.host, server.port, timeout=5.0)
+        assert engine.definition_version == "standin-1"
+        engine.close()
+    finally:
+        server.stop()
@@ -0,0 +1,57 @@
+import hashlib
+
+from engines import CLEAN, EICAR_SIGNATURE, ERROR, INFECTED, SKIPPED, SignatureEngine
+from prefilter import DEFAULT_RULES, INERT_MEDIA_RULE, KnownCleanSet, PolicyRule, PreFilter
+from scan_engine import KNOWN_CLEAN, ScanPipeline
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+
+def _scan(root, prefilter):
+    records = []
+    pipeline = ScanPipeline(str(root), [SignatureEngine("Engine")], prefilter=prefilter)
+    pipeline.run(on_verdict=records.append)
+    return pipeline, {record.path[len(str(root)) + 1:]: record for record in records}
+
+
+def test_media_magic_is_scanned_by_default(tmp_path):
+    (tmp_path / "holiday.png").write_bytes(PNG_MAGIC + EICAR_SIGNATURE)
+    prefilter = PreFilter()
+    _, records = _scan(tmp_path, prefilter)
+    assert records["holiday.png"].verdict == INFECTED
+    assert prefilter.saved() == {}
+
+
+def test_media_rule_is_opt_in(tmp_path):
+    (tmp_path / "holiday.png").write_bytes(PNG_MAGIC + b"pixels")
+    prefilter = PreFilter(DEFAULT_RULES + [INERT_MEDIA_RULE])
+    _, records = _scan(tmp_path, prefilter)
+    assert (records["holiday.png"].verdict, records["holiday.png"].prefilter) == (SKIPPED, "inert-media")
+    assert prefilter.saved() == {"inert-media": 1}
+
+
+def test_oversize_files_are_reported_not_scanned(tmp_path):
+    (tmp_path / "large.bin").write_bytes(b"x" * 2048)
+    (tmp_path / "empty.bin").write_bytes(b"")
+    # The default oversize rule with a limit small enough for a test
+    rules = [rule._replace(min_size=1024) if rule.name == "oversize" else rule for rule in DEFAULT_RULES]
+    assert PolicyRule("oversize", ERROR, None, 1024, None) in rules
+    prefilter = PreFilter(rules)
+    pipeline, records = _scan(tmp_path, prefilter)
+    assert (records["large.bin"].verdict, records["large.bin"].prefilter) == (ERROR, "oversize")
+    assert records["empty.bin"].verdict == CLEAN
+    assert prefilter.saved() == {"empty-file": 1}
+    assert (pipeline.files_not_scanned, pipeline.files_skipped) == (1, 1)
+
+
+def test_known_clean_set_applies_without_a_cache(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "tool.exe").write_bytes(b"MZ known tool")
+    (root / "other.exe").write_bytes(b"MZ something else")
+    KnownCleanSet.build(str(tmp_path / "known_clean.sha256"), [hashlib.sha256(b"MZ known tool").hexdigest()])
+    prefilter = PreFilter(DEFAULT_RULES, KnownCleanSet(str(tmp_path / "known_clean.sha256")))
+    _, records = _scan(root, prefilter)
+    assert (records["tool.exe"].verdict, records["tool.exe"].prefilter) == (CLEAN, KNOWN_CLEAN)
+    assert (records["other.exe"].verdict, records["other.exe"].prefilter) == (CLEAN, "")
+    prefilter.close()
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from quarantine import QuarantineStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = QuarantineStore(str(tmp_path / "quarantine"))
+    yield store
+    store.close()
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+    return str(path)
+
+
+def _read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def test_restore_round_trip(store, tmp_path):
+    paths = [_write(tmp_path / "scan" / f"sample{index}.bin", b"payload %d" % index * 1000) for index in range(3)]
+    added, failed = store.quarantine_many((path, "Engine") for path in paths)
+    assert (added, failed) == (3, [])
+    assert not any(os.path.exists(path) for path in paths)
+
+    restored = dict(store.restore(entry.entry_id for entry in store.entries()))
+    assert sorted(restored.values()) == sorted(paths)
+    for index, path in enumerate(paths):
+        assert _read(path) == b"payload %d" % index * 1000
+    assert store.stats() == (0, 0, 0, 0)
+    # No temporary files are left next to the restored ones
+    assert sorted(os.listdir(tmp_path / "scan")) == ["sample0.bin", "sample1.bin", "sample2.bin"]
+
+
+def test_restore_never_overwrites(store, tmp_path):
+    path = _write(tmp_path / "scan" / "sample.bin", b"quarantined")
+    store.quarantine_many([(path, "Engine")])
+    _write(path, b"user data")
+
+    [(entry_id, restored)] = store.restore(entry.entry_id for entry in store.entries())
+    assert restored is None
+    assert _read(path) == b"user data"
+    # The entry stays quarantined so it can be restored elsewhere
+    assert [entry.entry_id for entry in store.entries()] == [entry_id]
+
+
+def test_restore_same_target_once_per_batch(store, tmp_path):
+    first = _write(tmp_path / "scan" / "sample.bin", b"first")
+    store.quarantine_many([(first, "Engine")])
+    second = _write(tmp_path / "scan" / "sample.bin", b"second")
+    store.quarantine_many([(second, "Engine")])
+    other = _write(tmp_path / "elsewhere" / "sample.bin", b"other")
+    store.quarantine_many([(other, "Engine")])
+
+    destination = str(tmp_path / "restored")
+    results = list(store.restore([entry.entry_id for entry in store.entries()], destination))
+    written = [path for _, path in results if path is not None]
+    assert written == [os.path.join(destination, "sample.bin")]
+    assert _read(written[0]) in (b"first", b"second", b"other")
+    assert os.listdir(destination) == ["sample.bin"]
+    # Only the entry that was written is gone; the two that lost keep their objects
+    assert len(store.entries()) == 2
+    for entry in store.entries():
+        assert os.path.exists(store.object_path(entry.digest))
+
+    # A later restore to a free spot still works for them
+    again = dict(store.restore([entry.entry_id for entry in store.entries()], str(tmp_path / "again")))
+    assert list(again.values()).count(None) == 1
+
+
+def test_restore_keeps_permission_bits(store, tmp_path):
+    tool = _write(tmp_path / "scan" / "tool.sh", b"#!/bin/sh\n")
+    shared = _write(tmp_path / "scan" / "shared.txt", b"#!/bin/sh\n")  # Same content, so the same object
+    os.chmod(tool, 0o750)
+    os.chmod(shared, 0o644)
+    store.quarantine_many([(tool, "Engine"), (shared, "Engine")])
+
+    restored = dict(store.restore(entry.entry_id for entry in store.entries()))
+    assert sorted(restored.values()) == sorted([tool, shared])
+    assert os.stat(tool).st_mode & 0o777 == 0o750
+    assert os.stat(shared).st_mode & 0o777 == 0o644
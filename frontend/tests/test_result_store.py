@@ -0,0 +1,52 @@
+import os
+
+from engines import CLEAN, INFECTED
+from result_store import ResultStore
+
+
+def _rows():
+    rows = []
+    for folder in range(5):
+        for n in range(9):
+            path = os.path.join("/scan", f"folder{folder}", f"File{n}.txt")
+            for engine in ("Alpha", "Beta"):
+                verdict = INFECTED if (folder, n, engine) == (3, 4, "Beta") or n == 8 else CLEAN
+                rows.append((path, engine, verdict, float(folder * 10 + n)))
+    return rows
+
+
+def test_rows_read_back_after_spilling_to_segment_files(tmp_path):
+    rows = _rows()
+    store = ResultStore(str(tmp_path), segment_rows=16)
+    store.add_many(rows[:40])
+    store.add_many(rows[40:])
+    assert len(os.listdir(tmp_path)) == len(rows) // 16  # Sealed segments; the rest is still in memory
+
+    assert store.count() == len(rows)
+    assert store.fetch(0, len(rows)) == rows
+    assert store.fetch(30, 10) == rows[30:40]
+    assert store.fetch(0, 5, descending=True) == rows[::-1][:5]
+
+    for filter_text, verdict in [("FOLDER3", None), ("", INFECTED), ("file8", INFECTED), ("nowhere", None),
+                                 ("", "not a verdict")]:
+        expected = [row for row in rows if ResultStore.matches(row, filter_text, verdict)]
+        assert store.count(filter_text, verdict) == len(expected)
+        assert store.fetch(0, len(rows), filter_text=filter_text, verdict=verdict) == expected
+
+    by_latency = sorted(rows, key=lambda row: row[3], reverse=True)
+    pages = [store.fetch(offset, 7, sort_column=3, descending=True) for offset in range(0, len(rows), 7)]
+    assert [row[3] for page in pages for row in page] == [row[3] for row in by_latency]
+    by_path = store.fetch(0, len(rows), sort_column=0)
+    assert [row[0] for row in by_path] == sorted(row[0] for row in rows)
+
+    store.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_default_directory_is_removed_on_close():
+    store = ResultStore(segment_rows=4)
+    store.add_many(_rows()[:10])
+    directory = store.directory
+    assert len(os.listdir(directory)) == 2
+    store.close()
+    assert not os.path.exists(directory)
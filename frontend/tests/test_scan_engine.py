@@ -0,0 +1,62 @@
+from checkpoint import ScanCheckpoint
+from engines import CLEAN, SignatureEngine
+from file_index import FileIndex
+from scan_engine import ScanPipeline
+from verdict_cache import VerdictCache
+
+
+def _indexed_paths(index):
+    with index._lock:
+        return {row[0] for row in index._connection.execute("SELECT path FROM files")}
+
+
+def test_resumed_scan_keeps_index_rows_of_completed_files(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    paths = []
+    for n in range(10):
+        path = root / f"file{n}.txt"
+        path.write_bytes(b"content %d" % n)
+        paths.append(str(path))
+
+    # Files are only hashed, and so indexed, when there is a cache to look them up in
+    cache = VerdictCache(":memory:")
+    index = FileIndex(str(root), str(tmp_path / "index"))
+    ScanPipeline(str(root), [SignatureEngine("Engine")], cache=cache, index=index).run()
+    assert _indexed_paths(index) == set(paths)
+    index.close()
+
+    # An interrupted run had finished half of the files before it stopped
+    checkpoint = ScanCheckpoint(str(tmp_path / "job.checkpoint"))
+    for path in paths[:5]:
+        checkpoint.file_done(path)
+    checkpoint.save(None)
+
+    index = FileIndex(str(root), str(tmp_path / "index"))
+    pipeline = ScanPipeline(str(root), [SignatureEngine("Engine")], cache=cache, index=index,
+                            checkpoint=checkpoint)
+    pipeline.run()
+    checkpoint.close()
+    assert _indexed_paths(index) == set(paths)
+    index.close()
+    cache.close()
+
+
+def test_index_digests_without_a_cache(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    for n in range(5):
+        (root / f"file{n}.txt").write_bytes(b"content %d" % n)
+    cache = VerdictCache(":memory:")
+    index = FileIndex(str(root), str(tmp_path / "index"))
+    ScanPipeline(str(root), [SignatureEngine("Engine")], cache=cache, index=index).run()
+    index.close()
+    cache.close()
+
+    # The index knows every digest, but there is no cache to store verdicts in
+    records = []
+    index = FileIndex(str(root), str(tmp_path / "index"))
+    ScanPipeline(str(root), [SignatureEngine("Engine")], index=index).run(on_verdict=records.append)
+    index.close()
+    assert sorted((record.path, record.verdict) for record in records) == \
+        sorted((str(root / f"file{n}.txt"), CLEAN) for n in range(5))
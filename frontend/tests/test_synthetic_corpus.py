@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from archives import MEMBER_SEPARATOR
+from engines import SignatureEngine
+from scan_engine import ScanPipeline
+from synthetic_corpus import MANIFEST_NAME, generate_corpus
+
+SMALL = {"tiny_files": 300, "huge_files": 1, "huge_size": 4096, "depth": 3, "archives": 2, "eicar_files": 3}
+
+
+def _files_on_disk(root):
+    return sum(len(names) for _, _, names in os.walk(root)) - 1  # Not counting the manifest
+
+
+def test_regenerating_with_other_parameters_replaces_the_tree(tmp_path):
+    root = str(tmp_path / "corpus")
+    generate_corpus(root, **SMALL)
+    manifest = generate_corpus(root, **dict(SMALL, tiny_files=50))
+    assert manifest["files"] == _files_on_disk(root) == 50 + 1 + 1 + 2
+    assert all(os.path.exists(path.split(MEMBER_SEPARATOR)[0]) for path in manifest["infected"])
+
+
+def test_refuses_a_folder_that_is_not_a_corpus(tmp_path):
+    (tmp_path / "keep.txt").write_bytes(b"not ours")
+    with pytest.raises(ValueError):
+        generate_corpus(str(tmp_path), **SMALL)
+    assert os.listdir(tmp_path) == ["keep.txt"]
+
+
+def test_expected_detections_match_a_scan(tmp_path):
+    root = str(tmp_path / "corpus")
+    manifest = generate_corpus(root, **SMALL)
+    assert os.path.exists(os.path.join(root, MANIFEST_NAME))
+    pipeline = ScanPipeline(root, [SignatureEngine("Engine")])
+    pipeline.run()
+    assert sorted({path for path, _ in pipeline.detections}) == manifest["infected"]
+    assert len(manifest["infected"]) == SMALL["eicar_files"] + 1  # Plus the sample inside an archive
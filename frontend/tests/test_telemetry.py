@@ -0,0 +1,75 @@
+import socket
+import threading
+import time
+
+from engine_server import StandInEngineServer
+from telemetry import LOCAL_ADDRESS, MIN_POLL_INTERVAL, TelemetryPoller, card_lines, telemetry_targets
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_local_engines_show_no_figures():
+    poller = TelemetryPoller(telemetry_targets("local"), max_interval=0.05).start()
+    try:
+        _wait_for(lambda: len(poller.snapshot()) == len(poller.targets))
+        # This machine is sampled once per poll for all of them, so their figures never differ
+        readings = {telemetry._replace(name=None) for telemetry in poller.snapshot().values()}
+        assert len(readings) == 1
+        for telemetry in poller.snapshot().values():
+            assert telemetry.address == LOCAL_ADDRESS
+            assert set(card_lines(telemetry).values()) == {"RAM: n/a", "P-cores: n/a", "CPU: n/a", "Disk I/O: n/a"}
+        # Still sampled, so load-aware dispatch has a figure for them
+        assert set(poller.loads()) == {name for name, _, _ in poller.targets}
+    finally:
+        poller.stop()
+
+
+def test_busy_agent_is_polled_at_the_minimum_interval():
+    server = StandInEngineServer()
+    server.serve_in_thread()
+    server.queue_length = 200  # As if 200 files were waiting for a verdict
+    poller = TelemetryPoller([("Engine", server.host, server.port)]).start()
+    try:
+        _wait_for(lambda: poller.polls >= 3)
+        assert poller.interval("Engine") == MIN_POLL_INTERVAL
+        telemetry = poller.snapshot()["Engine"]
+        assert (telemetry.queue, telemetry.error) == (200, None)
+        assert card_lines(telemetry)["load"].endswith("Queue: 200")
+    finally:
+        poller.stop()
+        server.stop()
+
+
+def test_reply_that_is_not_an_object_is_a_failed_sample():
+    listener = socket.create_server(("127.0.0.1", 0))
+    replies = iter([b"[]", b'"busy"'] + [b'{"cpu": 0.1, "queue": 0}'] * 1000)
+
+    def answer(connection):
+        with connection, connection.makefile("rb") as lines:
+            while line := lines.readline():
+                connection.sendall(line.split()[1] + b" " + next(replies) + b"\n")
+
+    def serve():
+        # A failed sample closes its connection, so the poller comes back on a new one
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=answer, args=(connection,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    poller = TelemetryPoller([("Engine", "127.0.0.1", listener.getsockname()[1])], pool_size=1,
+                             max_interval=0.05).start()
+    try:
+        # The first two replies fail the sample but do not end the host's polling
+        _wait_for(lambda: poller.polls >= 4 and poller.snapshot()["Engine"].error is None)
+        assert poller.snapshot()["Engine"].cpu == 0.1
+    finally:
+        poller.stop()
+        listener.close()
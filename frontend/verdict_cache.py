@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+import time
+
+from engines import UNKNOWN_VERSION
+from scan_engine import DATA_DIR
+
+DEFAULT_CACHE_PATH = os.path.join(DATA_DIR, "verdict_cache.sqlite3")
+
+# Where the caches of local scan_worker.py processes are kept, one per worker slot
+WORKER_CACHE_DIR = os.path.join(DATA_DIR, "workers")
+
+
+class VerdictCache:
+    """On-disk cache of engine verdicts keyed by content hash, engine and definition version.
+
+    Backed by SQLite in WAL mode so readers never block the writer. Writes and
+    last-used updates are batched and committed every commit_every operations;
+    once the cache holds more than max_entries rows the least recently used
+    ones are evicted. Nothing is stored or looked up for an engine whose
+    definition version is UNKNOWN_VERSION.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=5_000_000, commit_every=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                digest TEXT NOT NULL,
+                engine TEXT NOT NULL,
+                definition_version TEXT NOT NULL,
+                verdict TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (digest, engine, definition_version)
+            ) WITHOUT ROWID
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        self._connection.commit()
+        self._pending = 0
+
+    def get_many(self, digest, engines):
+        """Return {engine name: verdict} for every engine with a cached verdict for digest."""
+        now = time.time()
+        found = {}
+        # Asking an engine for its version may wait on the network, so it is done before taking the lock
+        versions = [(engine.name, engine.definition_version) for engine in engines]
+        with self._lock:
+            for name, version in versions:
+                if version == UNKNOWN_VERSION:
+                    continue
+                row = self._connection.execute(
+                    "SELECT verdict FROM verdicts WHERE digest = ? AND engine = ? AND definition_version = ?",
+                    (digest, name, version)).fetchone()
+                if row is not None:
+                    found[name] = row[0]
+                    self._connection.execute(
+                        "UPDATE verdicts SET last_used = ? WHERE digest = ? AND engine = ? AND definition_version = ?",
+                        (now, digest, name, version))
+                    self._note_write()
+        return found
+
+    def put(self, digest, engine, verdict):
+        """Remember the verdict engine gave for digest, unless its definition version is unknown."""
+        version = engine.definition_version
+        if version == UNKNOWN_VERSION:
+            return
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                (digest, engine.name, version, verdict, time.time()))
+            self._note_write()
+
+    def invalidate(self, engine_name, keep_version=None):
+        """Drop every verdict for engine_name except those made with keep_version."""
+        with self._lock:
+            if keep_version is None:
+                self._connection.execute("DELETE FROM verdicts WHERE engine = ?", (engine_name,))
+            else:
+                self._connection.execute(
+                    "DELETE FROM verdicts WHERE engine = ? AND definition_version != ?", (engine_name, keep_version))
+            self._connection.commit()
+            self._pending = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def flush(self):
+        """Commit pending writes and evict entries over the size limit."""
+        with self._lock:
+            self._evict()
+            self._connection.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def _note_write(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._evict()
+            self._connection.commit()
+            self._pending = 0
+
+    def _evict(self):
+        count = self._connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM verdicts WHERE (digest, engine, definition_version) IN "
+                "(SELECT digest, engine, definition_version FROM verdicts ORDER BY last_used LIMIT ?)",
+                (excess,))
+
+
+def invalidate_worker_caches(engine_name, keep_version=None, directory=WORKER_CACHE_DIR):
+    """Run invalidate() on every worker cache in directory; returns the paths that could not be opened."""
+    failed = []
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".sqlite3"))
+    except FileNotFoundError:
+        return failed
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            cache = VerdictCache(path)
+            try:
+                cache.invalidate(engine_name, keep_version)
+            finally:
+                cache.close()
+        except (OSError, sqlite3.Error):
+            failed.append(path)
+    return failed
@@ -1,7 +1,16 @@
 import sys
 from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QProgressBar, QPushButton
 from PyQt6.QtCore import Qt, QTimer, QSize
-from PyQt6.QtGui import QFont, QPixmap, QIcon
+from PyQt6.QtGui import QFont
+
+import assets
+from engines import ENGINE_HOSTS
+from progress_pump import shared_pump
+from telemetry import card_lines, shared_poller
+from vm_pool import shared_pool
+
+# How often the cards are refreshed from the latest telemetry, in milliseconds
+TELEMETRY_REFRESH_INTERVAL = 1000
 
 
 class VMWindow(QMainWindow):
@@ -21,7 +30,7 @@ class VMWindow(QMainWindow):
 
         # Back button with icon
         back_button = QPushButton()
-        back_button.setIcon(QIcon("../assets/main_menu/back.png"))  # Set the back arrow image path here
+        back_button.setIcon(assets.icon("../assets/main_menu/back.png"))  # Set the back arrow image path here
         back_button.setIconSize(QSize(40, 40))  # Set icon size
         back_button.setStyleSheet("background-color: transparent; border: none;")  # Remove background and borders
         back_button.clicked.connect(self.go_back)  # Connect the button to the back function
@@ -32,7 +41,7 @@ class VMWindow(QMainWindow):
 
         # Add icon above the title
         icon_label = QLabel()
-        icon_pixmap = QPixmap("../assets/main_menu/VMs.png").scaled(50, 50, Qt.AspectRatioMode.KeepAspectRatio)
+        icon_pixmap = assets.pixmap("../assets/main_menu/VMs.png", 50, 50)
         icon_label.setPixmap(icon_pixmap)
         icon_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         icon_title_layout.addWidget(icon_label, alignment=Qt.AlignmentFlag.AlignCenter)
@@ -67,13 +76,16 @@ class VMWindow(QMainWindow):
         install_button.clicked.connect(self.start_installation)
         main_layout.addWidget(install_button, alignment=Qt.AlignmentFlag.AlignCenter)
 
-        # Timer for simulating progress bars
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_progress)
-
-        # List of all progress bars to update
+        # Each card stands for the VMs of the engine at its address
+        for vm in (self.vm1, self.vm2, self.vm3):
+            vm["engine_name"] = next((name for name, ip_address, _ in ENGINE_HOSTS if ip_address == vm["ip_address"]),
+                                     None)
         self.progress_bars = [self.vm1["progress_bar"], self.vm2["progress_bar"], self.vm3["progress_bar"]]
 
+        # Live RAM, CPU, disk and queue figures from each VM's agent, refreshed while the page is shown
+        self.telemetry_timer = QTimer(self)
+        self.telemetry_timer.timeout.connect(self.update_telemetry)
+
     def wrap_in_widget(self, layout):
         """Wraps a layout in a QWidget so it can be added to another layout."""
         widget = QWidget()
@@ -94,7 +106,7 @@ class VMWindow(QMainWindow):
 
         # Icon
         icon_label = QLabel()
-        pixmap = QPixmap(icon_path).scaled(80, 80, Qt.AspectRatioMode.KeepAspectRatio)
+        pixmap = assets.pixmap(icon_path, 80, 80)
         icon_label.setPixmap(pixmap)
         icon_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         black_box_layout.addWidget(icon_label)
@@ -112,8 +124,15 @@ class VMWindow(QMainWindow):
         info_layout = QVBoxLayout()
         info_layout.addWidget(self.create_info_label(f"OS: {os_name}"))
         info_layout.addWidget(self.create_info_label(f"Size: {os_size}"))
-        info_layout.addWidget(self.create_info_label(f"RAM: {os_ram}"))
-        info_layout.addWidget(self.create_info_label(f"P-cores: {p_cores}"))
+        # Until the agent answers these show the configured figures
+        telemetry_labels = {
+            "ram": self.create_info_label(f"RAM: {os_ram}"),
+            "cores": self.create_info_label(f"P-cores: {p_cores}"),
+            "load": self.create_info_label("CPU: ..."),
+            "disk": self.create_info_label("Disk I/O: ..."),
+        }
+        for label in telemetry_labels.values():
+            info_layout.addWidget(label)
         info_layout.addWidget(self.create_info_label(f"IP: {ip_address}"))
         vm_layout.addLayout(info_layout)
 
@@ -134,7 +153,8 @@ class VMWindow(QMainWindow):
         """)
         vm_layout.addWidget(progress_bar)
 
-        return {"layout": vm_layout, "progress_bar": progress_bar}
+        return {"layout": vm_layout, "progress_bar": progress_bar, "ip_address": ip_address,
+                "telemetry_labels": telemetry_labels}
 
 
     def create_info_label(self, text):
@@ -144,20 +164,42 @@ class VMWindow(QMainWindow):
         label.setStyleSheet("color: white; background-color: #1565C0; padding: 5px;")
         return label
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.update_telemetry()
+        self.telemetry_timer.start(TELEMETRY_REFRESH_INTERVAL)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.telemetry_timer.stop()
+
+    def update_telemetry(self):
+        """Show the latest figures the telemetry poller has for each VM; never waits on the network."""
+        snapshot = shared_poller().snapshot()
+        for vm in (self.vm1, self.vm2, self.vm3):
+            telemetry = snapshot.get(vm["engine_name"])
+            if telemetry is None:
+                continue
+            for key, text in card_lines(telemetry).items():
+                vm["telemetry_labels"][key].setText(text)
+
     def start_installation(self):
-        """Start the installation process and progress bars."""
-        self.timer.start(100)  # Start the timer to update progress every 100ms
-
-    def update_progress(self):
-        """Update the progress bars for all VMs."""
-        all_finished = True
-        for progress_bar in self.progress_bars:
-            if progress_bar.value() < 100:
-                progress_bar.setValue(progress_bar.value() + 1)
-                all_finished = False
-
-        if all_finished:
-            self.timer.stop()  # Stop the timer when all bars reach 100%
+        """Warm up the pool of snapshotted scan VMs; each bar shows how many of its engine's VMs are up."""
+        pool = shared_pool()
+        for vm in (self.vm1, self.vm2, self.vm3):
+            if vm["engine_name"] is not None:
+                shared_pump().bind(vm["progress_bar"], lambda name=vm["engine_name"]: self.pool_progress(pool, name))
+
+    @staticmethod
+    def pool_progress(pool, engine_name):
+        """Return (value, maximum, text) for a bar: booted VMs out of the pool size, and what they are doing."""
+        ready, in_use, reverting, booting = pool.stats()[engine_name]
+        text = f"{ready} ready, {in_use} scanning"
+        if reverting:
+            text += f", {reverting} reverting"
+        if booting:
+            text += f", {booting} booting"
+        return ready + in_use + reverting, pool.size, text
 
     def go_back(self):
         """Go back to the main application window."""
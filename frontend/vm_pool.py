@@ -0,0 +1,414 @@
+import itertools
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from engine_server import StandInEngineServer
+from engines import ENGINE_NAMES, ERROR, INFECTED, UNKNOWN_VERSION, VERSION_RETRY, VERSION_TTL, EngineAdapter, \
+    RemoteEngine, definitions_generation
+from metrics import metrics
+
+# VMs kept per engine unless AV_PIPELINE_POOL_SIZE says otherwise
+DEFAULT_POOL_SIZE = 2
+
+# Seconds before booting again after a boot failed
+BOOT_RETRY_SECONDS = 5.0
+
+
+class Hypervisor:
+    """Interface the VM pool drives; a backend for a real hypervisor implements these methods.
+
+    Calls block for as long as the operation takes and raise OSError when
+    it fails. The pool only makes them from its own background threads.
+    """
+
+    def boot(self, engine_name):
+        """Create and boot a VM with engine_name installed and its agent running; return the VM's id."""
+        raise NotImplementedError
+
+    def snapshot(self, vm_id):
+        """Snapshot the running VM; return the snapshot's id."""
+        raise NotImplementedError
+
+    def revert(self, vm_id, snapshot_id):
+        """Return the VM to snapshot_id, discarding everything that happened since."""
+        raise NotImplementedError
+
+    def agent_address(self, vm_id):
+        """Return (host, port) of the engine agent inside the VM."""
+        raise NotImplementedError
+
+    def destroy(self, vm_id):
+        raise NotImplementedError
+
+
+class _FakeVM:
+    __slots__ = ("engine_name", "server", "snapshots", "reverts")
+
+    def __init__(self, engine_name, server):
+        self.engine_name = engine_name
+        self.server = server
+        self.snapshots = set()
+        self.reverts = 0
+
+
+class FakeHypervisor(Hypervisor):
+    """In-process hypervisor for testing on a plain Linux box.
+
+    Every VM is a StandInEngineServer on a loopback port, so scans through
+    the pool really reach an agent; booting, snapshotting and reverting just
+    take the configured number of seconds.
+    """
+
+    def __init__(self, boot_seconds=3.0, snapshot_seconds=0.2, revert_seconds=0.5, engine_latency=0.0):
+        self.boot_seconds = boot_seconds
+        self.snapshot_seconds = snapshot_seconds
+        self.revert_seconds = revert_seconds
+        self.engine_latency = engine_latency
+        self.booted = 0
+        self.reverted = 0
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._vms = {}
+
+    def boot(self, engine_name):
+        time.sleep(self.boot_seconds)
+        server = StandInEngineServer(latency=self.engine_latency)
+        server.serve_in_thread()
+        with self._lock:
+            vm_id = f"fake-{next(self._ids)}"
+            self._vms[vm_id] = _FakeVM(engine_name, server)
+            self.booted += 1
+        return vm_id
+
+    def snapshot(self, vm_id):
+        time.sleep(self.snapshot_seconds)
+        vm = self._vm(vm_id)
+        snapshot_id = f"{vm_id}-clean-{len(vm.snapshots) + 1}"
+        vm.snapshots.add(snapshot_id)
+        return snapshot_id
+
+    def revert(self, vm_id, snapshot_id):
+        vm = self._vm(vm_id)
+        if snapshot_id not in vm.snapshots:
+            raise OSError(f"{vm_id} has no snapshot {snapshot_id}")
+        time.sleep(self.revert_seconds)
+        with self._lock:
+            vm.reverts += 1
+            self.reverted += 1
+
+    def agent_address(self, vm_id):
+        server = self._vm(vm_id).server
+        return server.host, server.port
+
+    def destroy(self, vm_id):
+        with self._lock:
+            vm = self._vms.pop(vm_id, None)
+        if vm is not None:
+            vm.server.stop()
+
+    def _vm(self, vm_id):
+        with self._lock:
+            vm = self._vms.get(vm_id)
+        if vm is None:
+            raise OSError(f"no such VM: {vm_id}")
+        return vm
+
+
+def create_hypervisor(spec=None):
+    """Build the hypervisor backend named by spec (default: $AV_PIPELINE_HYPERVISOR).
+
+    Only "fake" exists so far; "fake:SECONDS" sets its boot time.
+    """
+    spec = spec or os.environ.get("AV_PIPELINE_HYPERVISOR", "fake")
+    name, _, argument = spec.partition(":")
+    if name == "fake":
+        return FakeHypervisor(float(argument)) if argument else FakeHypervisor()
+    raise ValueError(f"unknown hypervisor: {spec}")
+
+
+class PooledVM:
+    """A booted VM of the pool, with the clean snapshot it goes back to after a detection."""
+    __slots__ = ("vm_id", "engine_name", "snapshot_id", "address")
+
+    def __init__(self, vm_id, engine_name, snapshot_id, address):
+        self.vm_id = vm_id
+        self.engine_name = engine_name
+        self.snapshot_id = snapshot_id
+        self.address = address
+
+
+class VMPool:
+    """Keeps size booted, snapshotted scanning VMs per engine.
+
+    acquire() hands out a ready VM and release() takes it back: straight to
+    the ready list while it stays clean, or, once a file it scanned was
+    detected, after reverting it to its clean snapshot on a background
+    thread. A VM that fails to revert, or is released as broken, is
+    destroyed and a fresh one booted in the background, as are the VMs of
+    the initial warm-up, so acquire() only ever waits for a VM to come
+    back, never for a cold boot in its own path.
+    """
+
+    def __init__(self, hypervisor, engine_names=ENGINE_NAMES, size=DEFAULT_POOL_SIZE, max_parallel_boots=4):
+        self.hypervisor = hypervisor
+        self.engine_names = list(engine_names)
+        self.size = size
+        self.boots = 0
+        self.reverts = 0
+        self.waits = 0
+
+        self._condition = threading.Condition()
+        self._ready = {name: deque() for name in self.engine_names}
+        self._in_use = dict.fromkeys(self.engine_names, 0)
+        self._reverting = dict.fromkeys(self.engine_names, 0)
+        self._booting = dict.fromkeys(self.engine_names, 0)
+        # Boots and reverts run here, never on a scanning thread
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel_boots + len(self.engine_names),
+                                            thread_name_prefix="vm-pool")
+        self._closed = False
+        self._closing = threading.Event()
+        self._started = False
+
+    def start(self):
+        """Boot the VMs of every engine in the background; returns self."""
+        with self._condition:
+            if not self._started:
+                self._started = True
+                metrics.add_gauge("av_vm_pool_ready", self._ready_gauge)
+                for name in self.engine_names:
+                    self._refill(name)
+        return self
+
+    def acquire(self, engine_name, timeout=None):
+        """Return a ready VM of engine_name, waiting for one if all are busy; None if closed or timed out."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            ready = self._ready[engine_name]
+            if not ready and not self._closed:
+                self.waits += 1
+                metrics.inc("av_vm_pool_waits_total", engine=engine_name)
+            while not ready and not self._closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            if self._closed:
+                return None
+            self._in_use[engine_name] += 1
+            return ready.popleft()
+
+    def release(self, vm, tainted=False, broken=False):
+        """Give vm back; a tainted VM is reverted and a broken one replaced, both in the background."""
+        with self._condition:
+            self._in_use[vm.engine_name] -= 1
+            closed = self._closed
+            if not closed:
+                if broken:
+                    self._executor.submit(self._replace, vm)
+                elif tainted:
+                    self._reverting[vm.engine_name] += 1
+                    self._executor.submit(self._revert, vm)
+                else:
+                    self._ready[vm.engine_name].append(vm)
+                    self._condition.notify_all()
+        if closed:
+            self.hypervisor.destroy(vm.vm_id)
+
+    def stats(self):
+        """Return {engine name: (ready, in use, reverting, booting)}."""
+        with self._condition:
+            return {name: (len(self._ready[name]), self._in_use[name], self._reverting[name], self._booting[name])
+                    for name in self.engine_names}
+
+    def close(self):
+        """Stop refilling and destroy every VM once the boots and reverts under way are done."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._closing.set()
+        self._executor.shutdown(wait=True)
+        with self._condition:
+            vms = [vm for ready in self._ready.values() for vm in ready]
+            for ready in self._ready.values():
+                ready.clear()
+        for vm in vms:
+            self.hypervisor.destroy(vm.vm_id)
+        if self._started:
+            metrics.remove_gauge("av_vm_pool_ready", self._ready_gauge)
+
+    def _refill(self, name):
+        """Boot VMs until name has size of them; called with the condition held."""
+        while not self._closed and (len(self._ready[name]) + self._in_use[name] + self._reverting[name]
+                                    + self._booting[name]) < self.size:
+            self._booting[name] += 1
+            self._executor.submit(self._boot, name)
+
+    def _boot(self, name):
+        try:
+            vm_id = self.hypervisor.boot(name)
+            try:
+                vm = PooledVM(vm_id, name, self.hypervisor.snapshot(vm_id), self.hypervisor.agent_address(vm_id))
+            except OSError:
+                self.hypervisor.destroy(vm_id)
+                raise
+        except OSError:
+            self._closing.wait(BOOT_RETRY_SECONDS)
+            with self._condition:
+                self._booting[name] -= 1
+                self._refill(name)
+            return
+        with self._condition:
+            self._booting[name] -= 1
+            if self._closed:
+                vm_id = vm.vm_id
+            else:
+                vm_id = None
+                self.boots += 1
+                metrics.inc("av_vm_boots_total", engine=name)
+                self._ready[name].append(vm)
+                self._condition.notify_all()
+        if vm_id is not None:
+            self.hypervisor.destroy(vm_id)
+
+    def _revert(self, vm):
+        try:
+            self.hypervisor.revert(vm.vm_id, vm.snapshot_id)
+        except OSError:
+            with self._condition:
+                self._reverting[vm.engine_name] -= 1
+            self._replace(vm)
+            return
+        with self._condition:
+            self._reverting[vm.engine_name] -= 1
+            if not self._closed:
+                self.reverts += 1
+                metrics.inc("av_vm_reverts_total", engine=vm.engine_name)
+                self._ready[vm.engine_name].append(vm)
+                self._condition.notify_all()
+                return
+        self.hypervisor.destroy(vm.vm_id)
+
+    def _replace(self, vm):
+        self.hypervisor.destroy(vm.vm_id)
+        with self._condition:
+            self._refill(vm.engine_name)
+
+    def _ready_gauge(self):
+        return {(("engine", name),): len(ready) for name, ready in self._ready.items()}
+
+
+class PooledEngine(EngineAdapter):
+    """Scans each batch on a VM borrowed from a VMPool.
+
+    The VM goes back to the pool after the batch; when the batch had a
+    detection it is reverted to its clean snapshot first, and when its agent
+    could not be reached it is replaced and the batch tried once more on
+    another VM.
+    """
+
+    def __init__(self, name, pool, timeout=30.0, version_ttl=VERSION_TTL, version_retry=VERSION_RETRY):
+        self.name = name
+        self.pool = pool
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self.version_retry = version_retry
+        self._definition_version = None
+        self._definitions_generation = None
+        self._version_expires = 0.0
+        self._lock = threading.Lock()
+        # One adapter per VM address, so connections to a VM are reused across its loans
+        self._agents = {}
+
+    @property
+    def definition_version(self):
+        """Definition version of the pool's VMs, asked again as RemoteEngine.definition_version is."""
+        generation = definitions_generation(self.name)
+        if self._definition_version is None or self._definitions_generation != generation or \
+                time.monotonic() >= self._version_expires:
+            vm = self.pool.acquire(self.name, self.timeout)
+            if vm is None:
+                version = UNKNOWN_VERSION
+            else:
+                try:
+                    version = self._agent(vm).definition_version
+                finally:
+                    self.pool.release(vm)
+            # A busy pool or an unreachable agent is remembered only briefly, then asked again
+            self._definition_version = version
+            self._definitions_generation = generation
+            self._version_expires = time.monotonic() + (
+                self.version_retry if version == UNKNOWN_VERSION else self.version_ttl)
+        return self._definition_version
+
+    def scan_batch(self, paths):
+        verdicts = [ERROR] * len(paths)
+        for _ in range(2):  # A batch that met a broken VM gets one more try on another
+            vm = self.pool.acquire(self.name, self.timeout)
+            if vm is None:
+                break
+            broken = True
+            try:
+                verdicts = self._agent(vm).scan_batch(paths)
+                # Nothing but errors may just be unreadable files; only a silent agent means a broken VM
+                broken = all(verdict == ERROR for verdict in verdicts) and not self._reachable(vm)
+            finally:
+                tainted = INFECTED in verdicts
+                if tainted or broken:
+                    self._forget(vm)  # A revert or replacement drops the connections to it
+                self.pool.release(vm, tainted=tainted, broken=broken)
+            if not broken:
+                break
+        return verdicts
+
+    def close(self):
+        with self._lock:
+            agents = list(self._agents.values())
+            self._agents.clear()
+        for agent in agents:
+            agent.close()
+
+    def _forget(self, vm):
+        with self._lock:
+            agent = self._agents.pop(vm.address, None)
+        if agent is not None:
+            agent.close()
+
+    @staticmethod
+    def _reachable(vm):
+        try:
+            socket.create_connection(vm.address, timeout=1.0).close()
+        except OSError:
+            return False
+        return True
+
+    def _agent(self, vm):
+        with self._lock:
+            agent = self._agents.get(vm.address)
+            if agent is None:
+                agent = self._agents[vm.address] = RemoteEngine(self.name, *vm.address, timeout=self.timeout)
+            return agent
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool():
+    """Return the process-wide pool of the engines' VMs, warming it up on first use."""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            size = int(os.environ.get("AV_PIPELINE_POOL_SIZE", DEFAULT_POOL_SIZE))
+            _shared_pool = VMPool(create_hypervisor(), size=size).start()
+        return _shared_pool
+
+
+metrics.describe("av_vm_pool_ready", "Booted, clean VMs waiting for a scan, per engine.")
+metrics.describe("av_vm_pool_waits_total", "Scans that found no VM of their engine ready.")
+metrics.describe("av_vm_boots_total", "VMs booted and snapshotted into the pool.")
+metrics.describe("av_vm_reverts_total", "VMs reverted to their clean snapshot after a detection.")
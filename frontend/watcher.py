@@ -0,0 +1,418 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+from archives import outer_path
+from engines import INFECTED
+from metrics import metrics
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+              | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+# Parent recorded for the root watch and for watch descriptors not in use
+_ROOT = -1
+_FREE = -2
+
+# Pushed to the ready queue to end iteration
+_STOP = object()
+
+_libc = None
+
+
+def _inotify():
+    """Return libc with the inotify calls, or raise OSError where inotify does not exist."""
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "watch mode needs inotify, which is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+class ChangedFile:
+    """A created or modified file handed to ScanPipeline in place of a DirEntry."""
+    __slots__ = ("path", "changed_at")
+
+    def __init__(self, path, changed_at):
+        self.path = path
+        self.changed_at = changed_at
+
+    def stat(self, follow_symlinks=True):
+        return os.stat(self.path, follow_symlinks=follow_symlinks)
+
+
+class _WatchTable:
+    """Every watched directory as (parent watch, name) in flat arrays indexed by watch descriptor.
+
+    inotify hands out small, increasing descriptors, so a directory costs
+    16 bytes plus its name, with no Python object per directory; paths are
+    rebuilt by following parents. Lookups by name are linear scans, which
+    only directory moves and deletes need.
+    """
+
+    def __init__(self):
+        self.parents = array("i")
+        self.offsets = array("q")
+        self.lengths = array("i")
+        self.names = bytearray()
+        self.count = 0
+        self._garbage = 0
+
+    def add(self, wd, parent, name):
+        while len(self.parents) <= wd:
+            self.parents.append(_FREE)
+            self.offsets.append(0)
+            self.lengths.append(0)
+        if self.parents[wd] == _FREE:
+            self.count += 1
+        else:
+            self._garbage += self.lengths[wd]  # Same directory under a new name
+        self.parents[wd] = parent
+        self.offsets[wd] = len(self.names)
+        self.lengths[wd] = len(name)
+        self.names += name
+
+    def __contains__(self, wd):
+        return 0 <= wd < len(self.parents) and self.parents[wd] != _FREE
+
+    def path(self, wd):
+        parts = []
+        while wd != _ROOT:
+            offset = self.offsets[wd]
+            parts.append(bytes(self.names[offset:offset + self.lengths[wd]]))
+            wd = self.parents[wd]
+        return b"/".join(reversed(parts))
+
+    def child(self, parent, name):
+        """Return the watch of the directory called name inside parent, or None."""
+        for wd, owner in enumerate(self.parents):
+            if owner == parent:
+                offset = self.offsets[wd]
+                if self.names[offset:offset + self.lengths[wd]] == name:
+                    return wd
+        return None
+
+    def subtree(self, top):
+        """Return top and every watch below it."""
+        found = {top}
+        grew = True
+        while grew:
+            grew = False
+            for wd, parent in enumerate(self.parents):
+                if parent in found and wd not in found:
+                    found.add(wd)
+                    grew = True
+        return found
+
+    def remove(self, wd):
+        if wd not in self:
+            return
+        self.parents[wd] = _FREE
+        self._garbage += self.lengths[wd]
+        self.count -= 1
+        if self._garbage > 1024 * 1024 and self._garbage > len(self.names) // 2:
+            self._compact()
+
+    def _compact(self):
+        names = bytearray()
+        for wd, parent in enumerate(self.parents):
+            if parent != _FREE:
+                offset = self.offsets[wd]
+                self.offsets[wd] = len(names)
+                names += self.names[offset:offset + self.lengths[wd]]
+        self.names = names
+        self._garbage = 0
+
+
+class FolderWatcher:
+    """Watches a folder tree with inotify and yields files once they have stopped changing.
+
+    Every directory below root gets a watch. Writes, closes after writing,
+    renames into the tree and new directories mark a file as changed; a file
+    is yielded once it has been quiet for quiet seconds, or max_delay seconds
+    after its first event if it keeps changing, so a burst of writes to one
+    file produces a single scan. When the kernel queue overflows every file
+    in the tree is yielded again and the incremental index filters out the
+    unchanged ones.
+
+    Iterate the watcher as a ScanPipeline source: it yields ChangedFile items,
+    and None whenever it runs dry so the pipeline flushes a partial batch.
+    Iteration ends after stop().
+    """
+
+    def __init__(self, root, quiet=0.2, max_delay=2.0, latency=None):
+        self.root = os.path.abspath(root)
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.latency = latency
+        self.unwatched = 0  # Directories left out because the watch limit was reached
+        self.overflows = 0
+
+        libc = _inotify()
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._wake_read, self._wake_write = os.pipe()
+        self._table = _WatchTable()
+        # Path -> [first event, last event], oldest last event first
+        self._pending = OrderedDict()
+        # (first event, path) in arrival order, for the max_delay deadline
+        self._first_seen = deque()
+        self._ready = queue.Queue()
+        self._stopped = threading.Event()
+
+        self._watch_tree(os.fsencode(self.root), _ROOT, os.fsencode(self.root), mark=False)
+        self._thread = threading.Thread(target=self._run, name="folder-watcher", daemon=True)
+        self._thread.start()
+
+    def watched_directories(self):
+        return self._table.count
+
+    def stop(self):
+        if self._stopped.is_set():
+            return  # Already stopped, and the descriptors are closed
+        self._stopped.set()
+        os.write(self._wake_write, b"x")
+        self._thread.join()
+        self._ready.put(_STOP)
+        for fd in (self._fd, self._wake_read, self._wake_write):
+            os.close(fd)
+
+    def __iter__(self):
+        flushed = True
+        while True:
+            try:
+                item = self._ready.get_nowait()
+            except queue.Empty:
+                if not flushed:
+                    flushed = True
+                    yield None
+                    continue
+                item = self._ready.get()
+            if item is _STOP:
+                return
+            flushed = False
+            yield item
+
+    def _watch_tree(self, top, parent, name, mark):
+        """Watch top and every directory below it; with mark, treat their files as changed."""
+        now = time.monotonic()
+        stack = [(top, parent, name)]
+        while stack:
+            directory, parent, name = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, directory, WATCH_MASK)
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOSPC:
+                    self.unwatched += 1  # fs.inotify.max_user_watches reached
+                continue
+            self._table.add(wd, parent, name)
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((entry.path, wd, entry.name))
+                            elif mark and entry.is_file(follow_symlinks=False):
+                                self._mark(entry.path, now)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def _unwatch_tree(self, top):
+        for wd in self._table.subtree(top):
+            self._libc.inotify_rm_watch(self._fd, wd)
+            self._table.remove(wd)
+
+    def _mark(self, path, now):
+        times = self._pending.get(path)
+        if times is None:
+            self._pending[path] = [now, now]
+            self._first_seen.append((now, path))
+        else:
+            times[1] = now
+            self._pending.move_to_end(path)
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        poller.register(self._wake_read, select.POLLIN)
+        while not self._stopped.is_set():
+            timeout = None
+            if self._pending:
+                now = time.monotonic()
+                quiet_due = next(iter(self._pending.values()))[1] + self.quiet
+                delay_due = self._first_seen[0][0] + self.max_delay
+                timeout = max(0, int((min(quiet_due, delay_due) - now) * 1000) + 1)
+            ready = poller.poll(timeout)
+            if any(fd == self._fd for fd, _ in ready):
+                self._read_events()
+            self._release_due()
+
+    def _read_events(self):
+        now = time.monotonic()
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                self._handle(wd, mask, name, now)
+
+    def _handle(self, wd, mask, name, now):
+        if mask & IN_Q_OVERFLOW:
+            self.overflows += 1
+            self._rescan(now)
+            return
+        if mask & IN_IGNORED or mask & IN_DELETE_SELF:
+            self._table.remove(wd)
+            return
+        if wd not in self._table:
+            return
+        path = self._table.path(wd) + b"/" + name
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have been written before the new watch was in place
+                self._watch_tree(path, wd, name, mark=True)
+            elif mask & IN_MOVED_FROM:
+                child = self._table.child(wd, name)
+                if child is not None:
+                    self._unwatch_tree(child)
+            return
+        if mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._mark(path, now)
+
+    def _rescan(self, now):
+        top = os.fsencode(self.root)
+        for wd in range(len(self._table.parents)):
+            if wd in self._table:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                self._table.remove(wd)
+        self._watch_tree(top, _ROOT, top, mark=True)
+
+    def _release_due(self):
+        """Move files that have been quiet long enough, or waited max_delay, to the ready queue."""
+        now = time.monotonic()
+        due = []
+        while self._pending:
+            path, (first, last) = next(iter(self._pending.items()))
+            if now - last < self.quiet:
+                break
+            del self._pending[path]
+            due.append((path, first))
+        while self._first_seen and now - self._first_seen[0][0] >= self.max_delay:
+            first, path = self._first_seen.popleft()
+            times = self._pending.get(path)
+            if times is not None and times[0] == first:
+                del self._pending[path]
+                due.append((path, first))
+        # Drop deadline entries of files already released by the quiet rule
+        while self._first_seen and self._pending.get(self._first_seen[0][1], (None,))[0] != self._first_seen[0][0]:
+            self._first_seen.popleft()
+        for path, first in due:
+            try:
+                if not stat.S_ISREG(os.stat(path, follow_symlinks=False).st_mode):
+                    continue
+            except OSError:
+                continue  # Deleted again before it settled
+            path = os.fsdecode(path)
+            if self.latency is not None:
+                self.latency.changed(path, first)
+            self._ready.put(ChangedFile(path, first))
+
+
+class WatchLatency:
+    """End-to-end latency of watch mode: from a file's first change event to its verdicts.
+
+    Feed every VerdictRecord to verdict(). A file's latency is recorded when
+    all engine_count engines have answered for it, and its detection latency
+    when the first engine flags it; archive members count towards their
+    archive's detection but not its verdict latency.
+    """
+
+    def __init__(self, engine_count, samples=1000):
+        self.engine_count = engine_count
+        self._lock = threading.Lock()
+        # Path -> [first change, verdicts so far, detected]
+        self._open = {}
+        self.verdict_seconds = deque(maxlen=samples)
+        self.detection_seconds = deque(maxlen=samples)
+
+    def changed(self, path, changed_at):
+        with self._lock:
+            if path not in self._open:
+                self._open[path] = [changed_at, 0, False]
+
+    def verdict(self, record):
+        path = outer_path(record.path)
+        now = time.monotonic()
+        with self._lock:
+            state = self._open.get(path)
+            if state is None:
+                return
+            if record.verdict == INFECTED and not state[2]:
+                state[2] = True
+                self.detection_seconds.append(now - state[0])
+                metrics.record("av_watch_latency_seconds", now - state[0], outcome="detection")
+            if record.path != path:
+                return
+            state[1] += 1
+            if state[1] < self.engine_count:
+                return
+            del self._open[path]
+            self.verdict_seconds.append(now - state[0])
+        metrics.record("av_watch_latency_seconds", now - state[0], outcome="verdict")
+
+    def summary(self):
+        """Return (files, median, 95th percentile, detections, median detection) over recent samples."""
+        with self._lock:
+            verdicts = sorted(self.verdict_seconds)
+            detections = sorted(self.detection_seconds)
+
+        def quantile(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+        return (len(verdicts), quantile(verdicts, 0.5), quantile(verdicts, 0.95),
+                len(detections), quantile(detections, 0.5))
+
+
+metrics.describe("av_watch_latency_seconds", "Watch mode time from a file's first change event to its verdicts.")